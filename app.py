@@ -1,10 +1,49 @@
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for
+from flask import Flask, render_template, stream_template, request, jsonify, session, redirect, url_for
+from flask import g, has_app_context, has_request_context, before_render_template, template_rendered
+from markupsafe import Markup
+from functools import wraps
+import bisect
+import csv
+import gzip
+import hashlib
+import heapq
+import itertools
 import os
+import re
 import uuid
+import threading
+import time
+import zlib
+from array import array
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+import click
 import pymysql.cursors
+from pymysql.constants import CLIENT, SERVER_STATUS
 import json
 from werkzeug.security import generate_password_hash, check_password_hash
-from datetime import date
+try:
+    import orjson
+except ImportError:  # Optional: booking details fall back to the standard library parser
+    orjson = None
+try:
+    import brotli
+except ImportError:  # Optional: cached pages are then served gzip-only
+    brotli = None
+try:
+    import numpy as np
+except ImportError:  # Optional: the fare engine then prices result sets in plain Python
+    np = None
+try:
+    from gevent import monkey as gevent_monkey
+except ImportError:  # Optional: only consulted to decide whether live seat streams are safe
+    gevent_monkey = None
+try:
+    from eventlet import patcher as eventlet_patcher
+except ImportError:  # Optional: as above, for eventlet workers
+    eventlet_patcher = None
+from datetime import date, datetime, timedelta
+from decimal import Decimal, ROUND_HALF_UP
 
 # Initialize the Flask application
 app = Flask(__name__)
@@ -18,30 +57,2728 @@ app.config['MYSQL_USER'] = 'root'
 app.config['MYSQL_PASSWORD'] = 'P@ssword19' # IMPORTANT: Replace with your actual MySQL password
 app.config['MYSQL_DB'] = 'travelgo'
 
-def get_db_connection():
-    """Creates and returns a new database connection."""
-    connection = pymysql.connect(
-        host=app.config['MYSQL_HOST'],
-        user=app.config['MYSQL_USER'],
-        password=app.config['MYSQL_PASSWORD'],
-        db=app.config['MYSQL_DB'],
-        cursorclass=pymysql.cursors.DictCursor
+# --- Connection Pool Configuration ---
+app.config['MYSQL_POOL_SIZE'] = 10          # Maximum number of open connections
+app.config['MYSQL_POOL_TIMEOUT'] = 5.0      # Seconds to wait for a free connection
+app.config['MYSQL_POOL_PING_INTERVAL'] = 30 # Ping connections idle for longer than this (seconds)
+
+
+class PooledConnection:
+    """
+    Thin wrapper around a pymysql connection checked out from a ConnectionPool.
+    Calling close() hands the connection back to the pool instead of closing it,
+    so existing `conn = get_db_connection() ... finally: conn.close()` code works unchanged.
+    """
+
+    def __init__(self, pool, raw):
+        self._pool = pool
+        self._raw = raw
+
+    def __getattr__(self, name):
+        if self._raw is None:
+            raise pymysql.err.InterfaceError("Connection has already been returned to the pool.")
+        return getattr(self._raw, name)
+
+    def cursor(self, *args, **kwargs):
+        """Returns a cursor whose statements are timed and counted as DB round trips."""
+        return InstrumentedCursor(self.__getattr__('cursor')(*args, **kwargs))
+
+    def begin(self):
+        with timed_statement('BEGIN'):
+            self.__getattr__('begin')()
+
+    def commit(self):
+        with timed_statement('COMMIT'):
+            self.__getattr__('commit')()
+
+    def rollback(self):
+        with timed_statement('ROLLBACK'):
+            self.__getattr__('rollback')()
+
+    def close(self):
+        """Returns the underlying connection to the pool (safe to call twice)."""
+        raw, self._raw = self._raw, None
+        if raw is not None:
+            self._pool.release(raw)
+
+
+class ConnectionPool:
+    """A bounded, thread-safe pool of reusable MySQL connections."""
+
+    def __init__(self, connect, max_size=10, timeout=5.0, ping_interval=30):
+        self._connect = connect
+        self.max_size = max_size
+        self.timeout = timeout
+        self.ping_interval = ping_interval
+        self._idle = deque()  # (connection, last_used) pairs, most recently used on the right
+        self._size = 0        # Connections currently open (idle + checked out)
+        self._cond = threading.Condition()
+        self._stats = {
+            'acquired': 0, 'created': 0, 'discarded': 0,
+            'waits': 0, 'timeouts': 0, 'wait_time_total': 0.0,
+        }
+
+    def acquire(self):
+        """
+        Checks out a healthy connection, opening a new one while below max_size.
+        Raises pymysql.err.OperationalError if none frees up within the timeout.
+        """
+        start = time.monotonic()
+        deadline = start + self.timeout
+        raw, last_used, waited = None, None, False
+        with self._cond:
+            while True:
+                if self._idle:
+                    # LIFO reuse keeps the warmest connections busy and lets cold ones age out
+                    raw, last_used = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats['timeouts'] += 1
+                    raise pymysql.err.OperationalError("Timed out waiting for a free database connection.")
+                if not waited:
+                    self._stats['waits'] += 1
+                    waited = True
+                self._cond.wait(remaining)
+            self._stats['acquired'] += 1
+            self._stats['wait_time_total'] += time.monotonic() - start
+
+        try:
+            if raw is not None and not self._is_healthy(raw, last_used):
+                self._discard(raw, reopen=True)
+                raw = None
+            if raw is None:
+                raw = self._connect()
+                with self._cond:
+                    self._stats['created'] += 1
+        except Exception:
+            # Give the slot back so a failed connect does not shrink the pool forever
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        return PooledConnection(self, raw)
+
+    def release(self, raw):
+        """Returns a connection to the idle set, discarding it if it is no longer usable."""
+        try:
+            if not raw.open:
+                raise pymysql.err.InterfaceError("Connection was closed while checked out.")
+            # End any open transaction so the next borrower never sees a stale snapshot. Flows whose
+            # last batch ended in COMMIT have none, so they skip this round trip entirely.
+            if raw.server_status & SERVER_STATUS.SERVER_STATUS_IN_TRANS:
+                with timed_statement('ROLLBACK'):
+                    raw.rollback()
+        except Exception:
+            self._discard(raw)
+            return
+        with self._cond:
+            self._idle.append((raw, time.monotonic()))
+            self._cond.notify()
+
+    def _is_healthy(self, raw, last_used):
+        """Health-checks a connection on checkout; pings only if it sat idle for a while."""
+        if not raw.open:
+            return False
+        if time.monotonic() - last_used < self.ping_interval:
+            return True
+        try:
+            with timed_statement('PING'):
+                raw.ping(reconnect=False)
+            return True
+        except Exception:
+            return False
+
+    def _discard(self, raw, reopen=False):
+        """Closes a broken connection; with reopen=True its slot stays reserved for a replacement."""
+        try:
+            raw.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._stats['discarded'] += 1
+            if not reopen:
+                self._size -= 1
+                self._cond.notify()
+
+    @property
+    def in_use(self):
+        """Connections currently checked out (read without the lock; good enough for load balancing)."""
+        return self._size - len(self._idle)
+
+    def stats(self):
+        """Returns a snapshot of pool usage counters."""
+        with self._cond:
+            snapshot = dict(self._stats)
+            snapshot.update({
+                'max_size': self.max_size,
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': self._size - len(self._idle),
+            })
+        snapshot['avg_wait_ms'] = round(1000 * snapshot['wait_time_total'] / snapshot['acquired'], 3) if snapshot['acquired'] else 0.0
+        return snapshot
+
+
+_db_pools = {}
+_db_pools_lock = threading.Lock()
+
+def mysql_connector(multi_statements=True, **settings):
+    """Returns a function opening pymysql connections with the given settings and the app's cursor and client flags."""
+    return lambda: pymysql.connect(
+        cursorclass=pymysql.cursors.DictCursor,
+        # Lets execute_batch send several statements in one round trip. The price: any SQL built
+        # by splicing request data into the string, rather than passing it as params, could then
+        # stack extra statements, so keep every value in params and leave it off where unneeded.
+        client_flag=CLIENT.MULTI_STATEMENTS if multi_statements else 0,
+        **settings
+    )
+
+def get_db_pool():
+    """Returns the connection pool for the current MYSQL_* settings, creating it on first use."""
+    key = (app.config['MYSQL_HOST'], app.config['MYSQL_USER'], app.config['MYSQL_PASSWORD'], app.config['MYSQL_DB'])
+    pool = _db_pools.get(key)
+    if pool is None:
+        with _db_pools_lock:
+            pool = _db_pools.get(key)
+            if pool is None:
+                host, user, password, db = key
+                pool = ConnectionPool(
+                    mysql_connector(host=host, user=user, password=password, db=db),
+                    max_size=app.config['MYSQL_POOL_SIZE'],
+                    timeout=app.config['MYSQL_POOL_TIMEOUT'],
+                    ping_interval=app.config['MYSQL_POOL_PING_INTERVAL'],
+                )
+                ensure_schema_extensions(pool)
+                _db_pools[key] = pool
+    return pool
+
+# --- Read Replicas ---
+# Read-only routes check out connections from these when any are configured and healthy,
+# e.g. [{'host': 'replica-1'}, {'host': 'replica-2', 'port': 3307}]. Missing user, password
+# and db settings are taken from the MYSQL_* primary settings above.
+app.config['MYSQL_REPLICAS'] = []
+app.config['MYSQL_REPLICA_POOL_SIZE'] = 10           # Maximum open connections per replica
+app.config['MYSQL_REPLICA_POOL_TIMEOUT'] = 1.0       # Seconds to wait on a busy replica before falling back to the primary
+app.config['MYSQL_REPLICA_CONNECT_TIMEOUT'] = 2      # Seconds before an unreachable replica is given up on
+app.config['MYSQL_REPLICA_CHECK_INTERVAL'] = 5       # Seconds between replica health checks
+app.config['MYSQL_REPLICA_MAX_LAG'] = 5              # Replicas further behind than this get no reads; None skips the lag check
+app.config['READ_YOUR_WRITES_SECONDS'] = 10          # After a write, the session reads from the primary for this long (keep above MAX_LAG)
+
+
+def replica_lag(cur):
+    """
+    Returns how many seconds a replica is behind, 0 for a server that is not
+    replicating, or None if its replication threads are stopped.
+    """
+    try:
+        cur.execute("SHOW REPLICA STATUS")
+    except pymysql.MySQLError:
+        # Servers before MySQL 8.0.22 only know the old spelling
+        cur.execute("SHOW SLAVE STATUS")
+    row = cur.fetchone()
+    if row is None:
+        return 0
+    return row.get('Seconds_Behind_Source', row.get('Seconds_Behind_Master'))
+
+
+class ReplicaSet:
+    """
+    Spreads read-only checkouts across replica pools. Each checkout goes to the
+    healthy replica with the fewest connections in use; a background thread
+    re-checks every replica's reachability and lag. Callers fall back to the
+    primary when acquire() returns None.
+    """
+
+    def __init__(self, pools, check_interval=5, max_lag=5):
+        self.replicas = [
+            # Replicas only join the rotation once a first health check has passed
+            {'name': name, 'pool': pool, 'healthy': False, 'lag': None, 'error': 'not checked yet', 'reads': 0}
+            for name, pool in pools
+        ]
+        self.check_interval = check_interval
+        self.max_lag = max_lag
+        self._lock = threading.Lock()
+        self._turn = itertools.count()
+        self.fallbacks = 0
+        self._checker_started = False
+
+    def acquire(self):
+        """Checks out a connection from the least busy healthy replica, or returns None if none can serve."""
+        self.start_checker()
+        # Rotating the candidates first spreads ties between equally idle replicas
+        start = next(self._turn)
+        candidates = [self.replicas[(start + i) % len(self.replicas)] for i in range(len(self.replicas))]
+        candidates = sorted((r for r in candidates if r['healthy']), key=lambda r: r['pool'].in_use)
+        for replica in candidates:
+            try:
+                conn = replica['pool'].acquire()
+            except pymysql.MySQLError as e:
+                self._mark(replica, False, error=str(e))
+                continue
+            with self._lock:
+                replica['reads'] += 1
+            return conn
+        with self._lock:
+            self.fallbacks += 1
+        return None
+
+    def check(self):
+        """Health-checks every replica: it must answer and, if max_lag is set, be no further behind than that."""
+        for replica in self.replicas:
+            try:
+                conn = replica['pool'].acquire()
+                try:
+                    with conn.cursor() as cur:
+                        if self.max_lag is None:
+                            cur.execute("SELECT 1")
+                            lag = None
+                        else:
+                            lag = replica_lag(cur)
+                finally:
+                    conn.close()
+            except pymysql.MySQLError as e:
+                self._mark(replica, False, error=str(e))
+                continue
+            if self.max_lag is not None and (lag is None or lag > self.max_lag):
+                self._mark(replica, False, lag=lag, error='replication stopped' if lag is None else 'lagging')
+            else:
+                self._mark(replica, True, lag=lag)
+
+    def _mark(self, replica, healthy, lag=None, error=None):
+        with self._lock:
+            if replica['healthy'] and not healthy:
+                print(f"Read replica {replica['name']} taken out of rotation: {error}")
+            replica.update(healthy=healthy, lag=lag, error=error)
+
+    def start_checker(self):
+        """Starts the background health-check thread (once per replica set)."""
+        with self._lock:
+            if self._checker_started:
+                return
+            self._checker_started = True
+
+        def run():
+            while True:
+                self.check()
+                time.sleep(self.check_interval)
+
+        threading.Thread(target=run, name='replica-health-check', daemon=True).start()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'fallbacks': self.fallbacks,
+                'replicas': [
+                    # Hosts and driver errors stay in the server log; this payload is public
+                    dict({key: replica[key] for key in ('healthy', 'lag', 'reads')}, pool=replica['pool'].stats())
+                    for replica in self.replicas
+                ],
+            }
+
+
+_replica_sets = {}
+
+def get_replica_set():
+    """Returns the ReplicaSet for the current MYSQL_REPLICAS settings, or None when no replicas are configured."""
+    if not app.config['MYSQL_REPLICAS']:
+        return None
+    key = json.dumps([app.config['MYSQL_REPLICAS'], app.config['MYSQL_USER'], app.config['MYSQL_DB']], sort_keys=True)
+    replica_set = _replica_sets.get(key)
+    if replica_set is None:
+        with _db_pools_lock:
+            replica_set = _replica_sets.get(key)
+            if replica_set is None:
+                pools = []
+                for replica in app.config['MYSQL_REPLICAS']:
+                    settings = {
+                        'host': replica['host'],
+                        'port': replica.get('port', 3306),
+                        'user': replica.get('user', app.config['MYSQL_USER']),
+                        'password': replica.get('password', app.config['MYSQL_PASSWORD']),
+                        'db': replica.get('db', app.config['MYSQL_DB']),
+                    }
+                    pool = ConnectionPool(
+                        # Replicas only ever run single-statement batches, so they can refuse stacked ones
+                        mysql_connector(multi_statements=False, connect_timeout=app.config['MYSQL_REPLICA_CONNECT_TIMEOUT'],
+                                        **settings),
+                        max_size=app.config['MYSQL_REPLICA_POOL_SIZE'],
+                        timeout=app.config['MYSQL_REPLICA_POOL_TIMEOUT'],
+                        ping_interval=app.config['MYSQL_POOL_PING_INTERVAL'],
+                    )
+                    pools.append((f"{settings['host']}:{settings['port']}", pool))
+                replica_set = _replica_sets[key] = ReplicaSet(
+                    pools,
+                    check_interval=app.config['MYSQL_REPLICA_CHECK_INTERVAL'],
+                    max_lag=app.config['MYSQL_REPLICA_MAX_LAG'],
+                )
+    return replica_set
+
+def mark_session_write():
+    """Pins the session's reads to the primary for a while, so it sees its own booking or cancellation."""
+    session['primary_reads_until'] = time.time() + app.config['READ_YOUR_WRITES_SECONDS']
+
+def reads_pinned_to_primary():
+    if not has_request_context():
+        return False
+    return session.get('primary_reads_until', 0) > time.time()
+
+def get_db_connection(read_only=False):
+    """
+    Checks out a database connection from the pool; conn.close() returns it.
+    With read_only=True the connection may come from a read replica, unless
+    the session wrote recently or no replica is healthy.
+    """
+    started = time.perf_counter()
+    try:
+        if read_only and not reads_pinned_to_primary():
+            replica_set = get_replica_set()
+            conn = replica_set.acquire() if replica_set is not None else None
+            if conn is not None:
+                return conn
+        return get_db_pool().acquire()
+    finally:
+        elapsed = time.perf_counter() - started
+        DB_ACQUIRE_SECONDS.observe((), elapsed)
+        request_metrics = current_request_metrics()
+        if request_metrics is not None:
+            request_metrics['acquire_seconds'] += elapsed
+
+# --- Metrics ---
+app.config['SLOW_REQUEST_LOG_MS'] = 500  # Log a per-query breakdown for slower requests; None disables
+app.config['DB_ROUND_TRIPS_HEADER'] = True  # Report each request's round trips in X-DB-Round-Trips
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+ROUND_TRIP_BUCKETS = (0, 1, 2, 3, 4, 5, 8, 13, 21, 34)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+class Counter:
+    """A Prometheus-style counter keyed by a tuple of label values."""
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name, self.help_text, self.labelnames = name, help_text, labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    """A Prometheus-style cumulative histogram keyed by a tuple of label values."""
+
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name, self.help_text, self.labelnames = name, help_text, labelnames
+        self.buckets = tuple(buckets)
+        self._series = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series):
+                    lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, [('le', bound)])} {count}")
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, [('le', '+Inf')])} {series[-1]}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {series[-2]}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {series[-1]}")
+        return lines
+
+
+HTTP_REQUESTS = Counter('travelgo_http_requests_total', 'HTTP requests by route, method and status.', ('route', 'method', 'status'))
+HTTP_REQUEST_SECONDS = Histogram('travelgo_http_request_duration_seconds', 'HTTP request latency by route.', ('route', 'method'))
+DB_STATEMENT_SECONDS = Histogram('travelgo_db_statement_duration_seconds', 'SQL statement latency by statement shape.', ('statement',))
+DB_ROUND_TRIPS = Histogram('travelgo_db_round_trips_per_request', 'Database round trips per request by route.', ('route',), ROUND_TRIP_BUCKETS)
+DB_ACQUIRE_SECONDS = Histogram('travelgo_db_connection_acquire_seconds', 'Time spent checking a connection out of the pool.')
+TEMPLATE_RENDER_SECONDS = Histogram('travelgo_template_render_seconds', 'Template render time by template.', ('template',))
+METRICS = [HTTP_REQUESTS, HTTP_REQUEST_SECONDS, DB_STATEMENT_SECONDS, DB_ROUND_TRIPS, DB_ACQUIRE_SECONDS, TEMPLATE_RENDER_SECONDS]
+
+_SQL_COMMENTS = re.compile(r'/\*.*?\*/', re.S)
+_SQL_IN_LIST = re.compile(r'\(\s*%s(?:\s*,\s*%s)+\s*\)')
+_SQL_REPEATED_ROWS = re.compile(r'(\([^()]*(?:\([^()]*\)[^()]*)*\))(?:\s*,\s*\1)+')
+_SQL_LITERALS = re.compile(r"'[^']*'|\b\d+\b")
+
+def normalize_sql(sql):
+    """Reduces a statement to its shape so it can label a metric: no comments, literals or list lengths."""
+    shape = _SQL_COMMENTS.sub('', sql)
+    shape = _SQL_IN_LIST.sub('(%s, ...)', shape)
+    shape = _SQL_REPEATED_ROWS.sub(r'\1, ...', shape)
+    shape = _SQL_LITERALS.sub('?', shape)
+    return ' '.join(shape.split())[:200]
+
+def current_request_metrics():
+    """Returns the per-request metrics dict, or None outside a request (e.g. in background threads)."""
+    if not has_app_context():
+        return None
+    return g.get('request_metrics')
+
+
+class timed_statement:
+    """Context manager timing one database round trip and attributing it to the current request."""
+
+    def __init__(self, sql):
+        self.sql = sql
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.started
+        shape = normalize_sql(self.sql)
+        DB_STATEMENT_SECONDS.observe((shape,), elapsed)
+        request_metrics = current_request_metrics()
+        if request_metrics is not None:
+            request_metrics['round_trips'] += 1
+            request_metrics['db_seconds'] += elapsed
+            request_metrics['queries'].append((shape, elapsed))
+        return False
+
+
+class InstrumentedCursor:
+    """Wraps a pymysql cursor so every execute/executemany is timed by statement shape."""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._cursor.close()
+        return False
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def execute(self, query, args=None):
+        with timed_statement(query):
+            return self._cursor.execute(query, args)
+
+    def executemany(self, query, args):
+        with timed_statement(query):
+            return self._cursor.executemany(query, args)
+
+
+@app.before_request
+def start_request_metrics():
+    g.request_metrics = {
+        'started': time.perf_counter(), 'round_trips': 0, 'db_seconds': 0.0,
+        'acquire_seconds': 0.0, 'render_seconds': 0.0, 'queries': [],
+    }
+
+@before_render_template.connect_via(app)
+def _start_template_timer(sender, template, context, **extra):
+    if has_app_context():
+        g.template_started = time.perf_counter()
+
+@template_rendered.connect_via(app)
+def _record_template_time(sender, template, context, **extra):
+    started = g.pop('template_started', None) if has_app_context() else None
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    TEMPLATE_RENDER_SECONDS.observe((template.name or 'string',), elapsed)
+    request_metrics = current_request_metrics()
+    if request_metrics is not None:
+        request_metrics['render_seconds'] += elapsed
+
+@app.after_request
+def record_request_metrics(response):
+    request_metrics = g.pop('request_metrics', None)
+    if request_metrics is None:
+        return response
+    elapsed = time.perf_counter() - request_metrics['started']
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    HTTP_REQUESTS.inc((route, request.method, str(response.status_code)))
+    HTTP_REQUEST_SECONDS.observe((route, request.method), elapsed)
+    DB_ROUND_TRIPS.observe((route,), request_metrics['round_trips'])
+    if app.config['DB_ROUND_TRIPS_HEADER']:
+        response.headers['X-DB-Round-Trips'] = str(request_metrics['round_trips'])
+
+    threshold_ms = app.config['SLOW_REQUEST_LOG_MS']
+    if threshold_ms is not None and elapsed * 1000 >= threshold_ms:
+        print(
+            f"Slow request: {request.method} {request.path} took {elapsed * 1000:.1f}ms "
+            f"(db {request_metrics['db_seconds'] * 1000:.1f}ms in {request_metrics['round_trips']} round trips, "
+            f"acquire {request_metrics['acquire_seconds'] * 1000:.1f}ms, render {request_metrics['render_seconds'] * 1000:.1f}ms)"
+        )
+        for shape, seconds in request_metrics['queries']:
+            print(f"    {seconds * 1000:8.1f}ms  {shape}")
+    return response
+
+def render_stats_gauges(prefix, stats, labels=()):
+    """Renders the numeric values of a stats() dict as Prometheus gauges."""
+    lines = []
+    for key, value in stats.items():
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            continue
+        lines.append(f"# TYPE {prefix}_{key} gauge")
+        lines.append(f"{prefix}_{key}{_format_labels([name for name, _ in labels], [v for _, v in labels])} {value}")
+    return lines
+
+# --- Schema Extensions ---
+# Tables the core schema does not include, created on first connection if missing
+SCHEMA_EXTENSIONS = [
+    """
+    CREATE TABLE IF NOT EXISTS seat_holds (
+        seat_type VARCHAR(10) NOT NULL,
+        service_id INT NOT NULL,
+        seat_number VARCHAR(10) NOT NULL,
+        user_id INT NOT NULL,
+        expires_at DATETIME NOT NULL,
+        PRIMARY KEY (seat_type, service_id, seat_number),
+        KEY idx_seat_holds_expires_at (expires_at)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS service_availability (
+        service_type VARCHAR(10) NOT NULL,
+        service_id INT NOT NULL,
+        service_date DATE NOT NULL,
+        seat_capacity INT NOT NULL,
+        seats_left INT NOT NULL,
+        PRIMARY KEY (service_type, service_id),
+        KEY idx_service_availability_search (service_type, service_date, seats_left)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS idempotency_keys (
+        user_id INT NOT NULL,
+        idem_key VARCHAR(128) NOT NULL,
+        request_hash CHAR(64) NOT NULL,
+        status_code SMALLINT NULL,
+        response_body MEDIUMTEXT NULL,
+        created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (user_id, idem_key),
+        KEY idx_idempotency_keys_created_at (created_at)
+    )
+    """,
+]
+
+def ensure_schema_extensions(pool):
+    """Creates any missing extension tables using a connection from `pool`."""
+    try:
+        conn = pool.acquire()
+    except pymysql.MySQLError as e:
+        print(f"Database error creating schema extensions: {e}")
+        return
+    try:
+        with conn.cursor() as cur:
+            for statement in SCHEMA_EXTENSIONS:
+                cur.execute(statement)
+            seed_availability_counters(cur)
+        conn.commit()
+    except pymysql.MySQLError as e:
+        print(f"Database error creating schema extensions: {e}")
+    finally:
+        conn.close()
+
+# --- Data Access ---
+
+def execute_batch(cur, statements):
+    """
+    Sends several (sql, params) statements to MySQL as a single multi-statement
+    round trip and returns one {'rowcount', 'lastrowid', 'rows'} dict per statement.
+    A failing statement raises and stops the rest of the batch from running.
+    Several statements need a primary connection: replica connections are opened
+    without multi-statement support.
+    """
+    sql = ';\n'.join(statement for statement, _ in statements)
+    params = [value for _, statement_params in statements for value in statement_params]
+    cur.execute(sql, params)
+    results = []
+    while True:
+        results.append({'rowcount': cur.rowcount, 'lastrowid': cur.lastrowid, 'rows': cur.fetchall()})
+        if not cur.nextset():
+            break
+    return results
+
+# --- Search Result Cache ---
+app.config['SEARCH_CACHE_MAX_ENTRIES'] = 1024
+# Seconds a cached result set stays fresh, per service type
+app.config['SEARCH_CACHE_TTL'] = {'bus': 60, 'train': 120, 'flight': 60, 'hotel': 300}
+
+
+class SearchCache:
+    """
+    A size-bounded LRU cache of search result sets with per-service TTLs.
+    Keys are (service_type, normalized params) so a booking can drop every
+    entry for the service it changed.
+    """
+
+    def __init__(self, max_entries=1024, ttls=None, default_ttl=60):
+        self.max_entries = max_entries
+        self.ttls = ttls or {}
+        self.default_ttl = default_ttl
+        self._entries = OrderedDict()  # (service_type, key) -> (expires_at, value)
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def _counter(self, service_type):
+        return self._stats.setdefault(service_type, {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0})
+
+    def get(self, service_type, key):
+        """Returns the cached value, or None on a miss or expired entry."""
+        full_key = (service_type, key)
+        with self._lock:
+            counter = self._counter(service_type)
+            entry = self._entries.get(full_key)
+            if entry is None or entry[0] <= time.monotonic():
+                if entry is not None:
+                    del self._entries[full_key]
+                counter['misses'] += 1
+                return None
+            self._entries.move_to_end(full_key)
+            counter['hits'] += 1
+            return entry[1]
+
+    def set(self, service_type, key, value):
+        """Stores a value, evicting the least recently used entries beyond max_entries."""
+        ttl = self.ttls.get(service_type, self.default_ttl)
+        full_key = (service_type, key)
+        with self._lock:
+            self._entries[full_key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(full_key)
+            while len(self._entries) > self.max_entries:
+                (evicted_type, _), _ = self._entries.popitem(last=False)
+                self._counter(evicted_type)['evictions'] += 1
+
+    def invalidate(self, service_type):
+        """Drops every cached entry for a service type."""
+        with self._lock:
+            stale = [k for k in self._entries if k[0] == service_type]
+            for k in stale:
+                del self._entries[k]
+            self._counter(service_type)['invalidations'] += 1
+
+    def stats(self):
+        """Returns hit/miss counters per service type plus the current size."""
+        with self._lock:
+            per_service = {name: dict(counter) for name, counter in self._stats.items()}
+            size = len(self._entries)
+        for counter in per_service.values():
+            lookups = counter['hits'] + counter['misses']
+            counter['hit_ratio'] = round(counter['hits'] / lookups, 4) if lookups else 0.0
+        return {'size': size, 'max_entries': self.max_entries, 'services': per_service}
+
+
+search_cache = SearchCache(
+    max_entries=app.config['SEARCH_CACHE_MAX_ENTRIES'],
+    ttls=app.config['SEARCH_CACHE_TTL'],
+)
+
+def normalize_search_params(*values):
+    """Builds a cache key from search inputs, ignoring case and extra whitespace."""
+    return tuple(' '.join(str(value).split()).lower() if value else '' for value in values)
+
+# Rendered result fragments, keyed and invalidated exactly like the row cache above
+fragment_cache = SearchCache(
+    max_entries=app.config['SEARCH_CACHE_MAX_ENTRIES'],
+    ttls=app.config['SEARCH_CACHE_TTL'],
+)
+
+def invalidate_search_results(service_type):
+    """Drops cached rows and rendered fragments for a service type after its inventory changes."""
+    search_cache.invalidate(service_type)
+    fragment_cache.invalidate(service_type)
+
+def render_search_page(page_template, results_template, service_type, cache_key, **context):
+    """Renders a search page, caching its results fragment so identical searches skip re-rendering it."""
+    results_html = Markup(render_template(results_template, **context))
+    fragment_cache.set(service_type, cache_key, results_html)
+    return render_template(page_template, results_html=results_html, **context)
+
+# --- Static Page Cache ---
+app.config['STATIC_PAGE_CACHE'] = True
+app.config['STATIC_PAGE_CACHE_CONTROL'] = 'private, no-cache'  # Revalidate every time; unchanged pages cost a 304
+
+_static_pages = {}  # (endpoint, logged_in) -> cached page
+
+def build_cached_page(html):
+    """Pre-encodes a rendered page once: identity, gzip and (if available) brotli, with a strong ETag."""
+    body = html.encode('utf-8')
+    page = {
+        'identity': body,
+        'gzip': gzip.compress(body, compresslevel=9, mtime=0),
+        'br': brotli.compress(body, quality=11) if brotli is not None else None,
+        'etag': hashlib.sha256(body).hexdigest()[:32],
+    }
+    return page
+
+def serve_cached_page(page):
+    """Serves the best encoding the client accepts, answering 304 when its ETag still matches."""
+    if page['br'] is not None and request.accept_encodings['br']:
+        encoding = 'br'
+    elif request.accept_encodings['gzip']:
+        encoding = 'gzip'
+    else:
+        encoding = 'identity'
+    # Each encoding is a different representation, so each gets its own strong ETag
+    etag = page['etag'] if encoding == 'identity' else f"{page['etag']}-{encoding}"
+
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        response = app.response_class(page[encoding], mimetype='text/html')
+        if encoding != 'identity':
+            response.headers['Content-Encoding'] = encoding
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = app.config['STATIC_PAGE_CACHE_CONTROL']
+    response.vary.update(('Accept-Encoding', 'Cookie'))
+    return response
+
+def cached_page(view):
+    """
+    Renders a page whose output only changes between deploys once per login state
+    (the navigation differs), then serves the stored bytes on every later hit.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not app.config['STATIC_PAGE_CACHE']:
+            return view(*args, **kwargs)
+        key = (request.endpoint, 'user_email' in session)
+        page = _static_pages.get(key)
+        if page is None:
+            html = view(*args, **kwargs)
+            if not isinstance(html, str):
+                return html
+            page = _static_pages[key] = build_cached_page(html)
+        return serve_cached_page(page)
+    return wrapper
+
+# --- Search Pagination ---
+app.config['SEARCH_PAGE_SIZE'] = 50
+app.config['SEARCH_MAX_PAGE_SIZE'] = 1000
+app.config['SEARCH_STREAM_THRESHOLD'] = 200  # Pages at least this large are streamed to the client
+
+# Only the columns the search templates render
+BUS_SEARCH_COLUMNS = "id, name, from_city, to_city, details, departure_time, price, travel_date"
+HOTEL_SEARCH_COLUMNS = "id, name, location, price_per_night, availability"
+TRAIN_SEARCH_COLUMNS = "id, name, origin, destination, departure, arrival, price, travel_date"
+FLIGHT_SEARCH_COLUMNS = "id, airline, number, origin, destination, departure, arrival, price, departure_date"
+
+def get_page_size():
+    """Reads the requested page size from the query string or form, clamped to the configured bounds."""
+    page_size = request.values.get('page_size', app.config['SEARCH_PAGE_SIZE'], type=int)
+    return min(max(page_size, 1), app.config['SEARCH_MAX_PAGE_SIZE'])
+
+def add_keyset_filter(query, params, sort_column, after_value, after_id, descending=False):
+    """Appends a condition resuming after the (sort_column, id) of the previous page's last row."""
+    if not after_value or after_id is None:
+        return query
+    op = '<' if descending else '>'
+    params.extend([after_value, after_value, after_id])
+    return query + f" AND ({sort_column} {op} %s OR ({sort_column} = %s AND id {op} %s))"
+
+def stream_rows(query, params):
+    """
+    Yields rows from an unbuffered server-side cursor, so a large page is sent
+    to the client as it is read instead of being held in worker memory.
+    The connection is returned to the pool once the generator is exhausted or closed.
+    """
+    conn = get_db_connection(read_only=True)
+    try:
+        with conn.cursor(pymysql.cursors.SSDictCursor) as cur:
+            cur.execute(query, params)
+            for row in cur:
+                yield row
+    except pymysql.MySQLError as e:
+        print(f"Database error while streaming results: {e}")
+    finally:
+        conn.close()
+
+# --- Dashboard ---
+app.config['DASHBOARD_PAGE_SIZE'] = 20
+app.config['DASHBOARD_CACHE_MAX_ENTRIES'] = 4096
+app.config['DASHBOARD_CACHE_TTL'] = 60  # Bounds staleness from bookings made outside the user's session
+
+# Cached dashboard pages are keyed on the user's generation; bumping it on a
+# booking or cancellation orphans every cached page without scanning the cache
+dashboard_cache = SearchCache(
+    max_entries=app.config['DASHBOARD_CACHE_MAX_ENTRIES'],
+    ttls={'dashboard': app.config['DASHBOARD_CACHE_TTL']},
+)
+_dashboard_generations = {}
+_dashboard_generations_lock = threading.Lock()
+
+def invalidate_dashboard(user_id):
+    """Drops a user's cached dashboard pages after their bookings change."""
+    with _dashboard_generations_lock:
+        _dashboard_generations[user_id] = _dashboard_generations.get(user_id, 0) + 1
+
+def decode_booking_details(raw):
+    """Parses a booking's JSON details column, using orjson when it is installed."""
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+# --- Location Index & Autocomplete ---
+app.config['LOCATION_INDEX_REFRESH'] = 300  # Seconds between incremental index refreshes
+app.config['LOCATION_INDEX_FULL_REFRESH'] = 3600  # Seconds between full rebuilds, which pick up edited values
+# Autocomplete field -> (table, columns) sources of distinct location values
+LOCATION_FIELDS = {
+    'bus_city': [('services', ('from_city', 'to_city'))],
+    'train_city': [('trains', ('origin', 'destination'))],
+    'airport': [('flights', ('origin', 'destination'))],
+    'hotel_location': [('hotels', ('location',))],
+}
+
+
+class NgramIndex:
+    """In-memory trigram index answering case-insensitive substring lookups over a set of values."""
+
+    N = 3
+
+    def __init__(self):
+        self._values = []      # value id -> original value
+        self._normalized = []  # value id -> normalized value
+        self._ids = {}         # normalized value -> value id
+        self._grams = {}       # trigram -> set of value ids
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def normalize(value):
+        return ' '.join(str(value).split()).lower()
+
+    def __len__(self):
+        return len(self._values)
+
+    def add(self, value):
+        """Adds a value to the index; re-adding a known value is a no-op."""
+        if not value:
+            return
+        norm = self.normalize(value)
+        with self._lock:
+            if norm in self._ids:
+                return
+            value_id = len(self._values)
+            self._values.append(value)
+            self._normalized.append(norm)
+            self._ids[norm] = value_id
+            for i in range(len(norm) - self.N + 1):
+                self._grams.setdefault(norm[i:i + self.N], set()).add(value_id)
+
+    def _matching_ids(self, norm):
+        """Returns ids of values containing norm; caller must hold the lock."""
+        if len(norm) < self.N:
+            candidates = range(len(self._values))
+        else:
+            postings = []
+            for i in range(len(norm) - self.N + 1):
+                posting = self._grams.get(norm[i:i + self.N])
+                if not posting:
+                    return []
+                postings.append(posting)
+            postings.sort(key=len)
+            candidates = set(postings[0]).intersection(*postings[1:])
+        # Trigram hits are only candidates; confirm the full substring
+        return [i for i in candidates if norm in self._normalized[i]]
+
+    def lookup(self, query):
+        """Returns every indexed value that contains the query."""
+        norm = self.normalize(query)
+        with self._lock:
+            return [self._values[i] for i in self._matching_ids(norm)]
+
+    def suggest(self, query, limit=10):
+        """Returns up to `limit` values containing the query, best matches first."""
+        norm = self.normalize(query)
+        if not norm:
+            return []
+        with self._lock:
+            matches = [(self._normalized[i], self._values[i]) for i in self._matching_ids(norm)]
+
+        def rank(match):
+            candidate, value = match
+            if candidate == norm:
+                tier = 0
+            elif candidate.startswith(norm):
+                tier = 1
+            elif (' ' + norm) in candidate:
+                tier = 2  # Matches the start of a later word
+            else:
+                tier = 3
+            return (tier, len(candidate), candidate)
+
+        return [value for _, value in sorted(matches, key=rank)[:limit]]
+
+
+class LocationIndex:
+    """
+    Per-field NgramIndexes over the distinct location values in the inventory
+    tables. Loaded on first use, refreshed incrementally by only reading rows
+    added since the last refresh, and rebuilt in full periodically so values
+    edited in existing rows are picked up too.
+    """
+
+    def __init__(self, fields, refresh_interval=300, full_refresh_interval=3600):
+        self.fields = fields
+        self.refresh_interval = refresh_interval
+        self.full_refresh_interval = full_refresh_interval
+        self._indexes = {field: NgramIndex() for field in fields}
+        self._watermarks = {}  # table -> highest id already indexed
+        self._loaded_at = None
+        self._rebuilt_at = None
+        self._refresh_lock = threading.Lock()
+
+    def refresh(self, full=False):
+        """Indexes location values from rows added since the previous refresh, or every row when `full`."""
+        # A full rebuild fills fresh indexes and swaps them in, so lookups keep using the current ones meanwhile
+        indexes = {field: NgramIndex() for field in self.fields} if full else self._indexes
+        watermarks = {} if full else self._watermarks
+        conn = get_db_connection(read_only=True)
+        try:
+            with conn.cursor() as cur:
+                for field, sources in self.fields.items():
+                    for table, columns in sources:
+                        cur.execute(f"SELECT MAX(id) AS max_id FROM {table}")
+                        max_id = cur.fetchone()['max_id'] or 0
+                        last_id = watermarks.get(table, 0)
+                        if max_id <= last_id:
+                            continue
+                        for column in columns:
+                            cur.execute(
+                                f"SELECT DISTINCT {column} AS value FROM {table} WHERE id > %s AND id <= %s",
+                                (last_id, max_id)
+                            )
+                            for row in cur.fetchall():
+                                indexes[field].add(row['value'])
+                        watermarks[table] = max_id
+        finally:
+            conn.close()
+        first = self._loaded_at is None
+        self._indexes = indexes
+        self._watermarks = watermarks
+        self._loaded_at = time.monotonic()
+        if full or first:
+            self._rebuilt_at = self._loaded_at
+
+    def ensure_fresh(self):
+        """Loads the index on first use, then refreshes it incrementally or in full as it ages."""
+        now = time.monotonic()
+        if self._loaded_at is not None and now - self._loaded_at < self.refresh_interval:
+            return
+        # The first load blocks; later refreshes are done by one request while others use the current index
+        if not self._refresh_lock.acquire(blocking=self._loaded_at is None):
+            return
+        try:
+            if self._loaded_at is None or time.monotonic() - self._loaded_at >= self.refresh_interval:
+                self.refresh(full=self._rebuilt_at is not None and now - self._rebuilt_at >= self.full_refresh_interval)
+        except pymysql.MySQLError as e:
+            print(f"Database error refreshing location index: {e}")
+        finally:
+            self._refresh_lock.release()
+
+    def add(self, field, value):
+        """Adds a single value, e.g. right after new inventory is inserted."""
+        self._indexes[field].add(value)
+
+    def lookup(self, field, query):
+        """Returns exact stored values containing the query, or None if the index is not loaded."""
+        self.ensure_fresh()
+        if self._loaded_at is None:
+            return None
+        return self._indexes[field].lookup(query)
+
+    def suggest(self, field, query, limit=10):
+        """Returns ranked completions for the query."""
+        self.ensure_fresh()
+        return self._indexes[field].suggest(query, limit)
+
+
+location_index = LocationIndex(LOCATION_FIELDS, refresh_interval=app.config['LOCATION_INDEX_REFRESH'],
+                               full_refresh_interval=app.config['LOCATION_INDEX_FULL_REFRESH'])
+
+def add_location_filter(query, params, column, field, value):
+    """
+    Appends a filter for fuzzy location input. The input is resolved through the
+    location index to exact values so MySQL can use an index on the column,
+    falling back to a leading-wildcard LIKE if the index could not be loaded or
+    has no match (the value may be newer than the index, or edited since).
+    """
+    matches = location_index.lookup(field, value)
+    if not matches:
+        params.append(f"%{value}%")
+        return query + f" AND {column} LIKE %s"
+    params.extend(matches)
+    return query + f" AND {column} IN ({','.join(['%s'] * len(matches))})"
+
+# --- Hotel Catalog ---
+app.config['HOTEL_CATALOG_REFRESH'] = 120  # Seconds between full reloads of the in-memory hotel catalog
+
+# sort option -> (column, descending). Hotels without a rating sort last on rating.
+HOTEL_SORTS = {
+    'price': ('price_per_night', False),
+    'price_desc': ('price_per_night', True),
+    'rating': ('rating', True),
+}
+HOTEL_NO_RATING = -1  # Stands in for a missing rating in the rating index and in page cursors
+
+
+class HotelCatalog:
+    """
+    In-memory copy of the hotels table with, per normalized location, one list
+    of (value, id) pairs sorted on each sort column. A range on the sort column
+    is two bisects, a page is a slice of that range, and searches spanning
+    several matching locations merge their runs lazily, so no query scans the
+    catalog. Reloaded in full every refresh_interval seconds and swapped in whole.
+    """
+
+    def __init__(self, refresh_interval=120):
+        self.refresh_interval = refresh_interval
+        self._snapshot = None
+        self._loaded_at = None
+        self._refresh_lock = threading.Lock()
+
+    def refresh(self):
+        """Reads every hotel and rebuilds the indexes. The `rating` column is used when the table has one."""
+        conn = get_db_connection(read_only=True)
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SHOW COLUMNS FROM hotels LIKE 'rating'")
+                has_rating = cur.fetchone() is not None
+            with conn.cursor(pymysql.cursors.SSDictCursor) as cur:
+                cur.execute(f"SELECT {HOTEL_SEARCH_COLUMNS}{', rating' if has_rating else ''} FROM hotels")
+                hotels = {row['id']: row for row in cur}
+        finally:
+            conn.close()
+
+        columns = ['price_per_night'] + (['rating'] if has_rating else [])
+        locations = NgramIndex()
+        by_location = {}
+        for hotel in hotels.values():
+            locations.add(hotel['location'])
+            by_location.setdefault(NgramIndex.normalize(hotel['location'] or ''), []).append(hotel)
+        by_location[None] = list(hotels.values())  # Searches without a location
+
+        indexes = {}
+        for key, rows in by_location.items():
+            indexes[key] = {
+                column: sorted((self.sort_value(row, column), row['id']) for row in rows)
+                for column in columns
+            }
+        self._snapshot = {'hotels': hotels, 'locations': locations, 'indexes': indexes, 'has_rating': has_rating}
+        self._loaded_at = time.monotonic()
+
+    def ensure_fresh(self):
+        """Loads the catalog on first use and reloads it once it is older than refresh_interval."""
+        if self._loaded_at is not None and time.monotonic() - self._loaded_at < self.refresh_interval:
+            return
+        # The first load blocks; later reloads are done by one request while others search the current snapshot
+        if not self._refresh_lock.acquire(blocking=self._loaded_at is None):
+            return
+        try:
+            if self._loaded_at is None or time.monotonic() - self._loaded_at >= self.refresh_interval:
+                self.refresh()
+        except pymysql.MySQLError as e:
+            print(f"Database error refreshing hotel catalog: {e}")
+        finally:
+            self._refresh_lock.release()
+
+    @staticmethod
+    def sort_value(hotel, column):
+        value = hotel[column]
+        return HOTEL_NO_RATING if value is None else value
+
+    @property
+    def has_rating(self):
+        snapshot = self._snapshot
+        return snapshot is not None and snapshot['has_rating']
+
+    def search(self, location=None, price_range=(None, None), rating_range=(None, None), sort='price',
+               after_value=None, after_id=None, limit=50):
+        """
+        Returns one page of hotels matching the filters in `sort` order, resuming
+        after the (sort value, id) of the previous page's last hotel. Returns None
+        if the catalog could not be loaded.
+        """
+        self.ensure_fresh()
+        snapshot = self._snapshot
+        if snapshot is None:
+            return None
+        hotels, indexes = snapshot['hotels'], snapshot['indexes']
+
+        if location:
+            keys = {NgramIndex.normalize(value) for value in snapshot['locations'].lookup(location)}
+        else:
+            keys = {None}
+        column, descending = HOTEL_SORTS[sort]
+        ranges = {'price_per_night': price_range, 'rating': rating_range}
+        low, high = ranges.pop(column)
+        # The range on the sort column is cut out by bisecting; any other range is checked per hotel
+        other_column, (other_low, other_high) = next(iter(ranges.items()))
+
+        runs = []
+        for key in keys:
+            entries = indexes.get(key, {}).get(column)
+            if not entries:
+                continue
+            start = bisect.bisect_left(entries, (low,)) if low is not None else 0
+            end = bisect.bisect_right(entries, (high, float('inf'))) if high is not None else len(entries)
+            if column == 'rating' and (low is not None or high is not None):
+                # Unrated hotels sort as HOTEL_NO_RATING but, as in SQL, never match a rating range
+                start = max(start, bisect.bisect_right(entries, (HOTEL_NO_RATING, float('inf'))))
+            if after_value is not None and after_id is not None:
+                if descending:
+                    end = min(end, bisect.bisect_left(entries, (after_value, after_id)))
+                else:
+                    start = max(start, bisect.bisect_right(entries, (after_value, after_id)))
+            if start < end:
+                positions = range(end - 1, start - 1, -1) if descending else range(start, end)
+                runs.append(map(entries.__getitem__, positions))
+
+        page = []
+        for _, hotel_id in heapq.merge(*runs, reverse=descending):
+            hotel = hotels[hotel_id]
+            if other_low is not None or other_high is not None:
+                value = hotel.get(other_column)
+                if (value is None or (other_low is not None and value < other_low)
+                        or (other_high is not None and value > other_high)):
+                    continue
+            page.append(hotel)
+            if len(page) >= limit:
+                break
+        return page
+
+    def stats(self):
+        snapshot = self._snapshot
+        if snapshot is None:
+            return {'loaded': False}
+        return {
+            'loaded': True,
+            'hotels': len(snapshot['hotels']),
+            'locations': len(snapshot['indexes']) - 1,
+            'has_rating': snapshot['has_rating'],
+            'age_seconds': round(time.monotonic() - self._loaded_at, 1),
+        }
+
+
+hotel_catalog = HotelCatalog(refresh_interval=app.config['HOTEL_CATALOG_REFRESH'])
+
+def get_decimal_arg(name, minimum=0):
+    """Reads an optional number from the query string; blank, invalid or input below `minimum` counts as absent."""
+    value = request.args.get(name, '').strip()
+    try:
+        number = Decimal(value)
+    except ArithmeticError:
+        return None
+    return number if number.is_finite() and number >= minimum else None
+
+def hotel_search_query(location, price_range, rating_range, sort, after_value, after_id, page_size, has_rating):
+    """Builds the SQL equivalent of a catalog search, used while the catalog cannot be loaded."""
+    columns = HOTEL_SEARCH_COLUMNS + (', rating' if has_rating else '')
+    query = f"SELECT {columns} FROM hotels WHERE 1=1"
+    params = []
+    if location:
+        query = add_location_filter(query, params, 'location', 'hotel_location', location)
+    ranges = [('price_per_night', price_range)] + ([('rating', rating_range)] if has_rating else [])
+    for column, (low, high) in ranges:
+        if low is not None:
+            query += f" AND {column} >= %s"
+            params.append(low)
+        if high is not None:
+            query += f" AND {column} <= %s"
+            params.append(high)
+    column, descending = HOTEL_SORTS[sort]
+    sort_column = f"COALESCE(rating, {HOTEL_NO_RATING})" if column == 'rating' else column
+    query = add_keyset_filter(query, params, sort_column, after_value, after_id, descending=descending)
+    direction = ' DESC' if descending else ''
+    query += f" ORDER BY {sort_column}{direction}, id{direction} LIMIT %s"
+    params.append(page_size)
+    return query, params
+
+# --- Seat Maps ---
+app.config['SEAT_MAP_MAX_ENTRIES'] = 4096
+app.config['SEAT_MAP_TTL'] = 30  # Seconds before a map is re-read to pick up bookings made by other workers
+
+# Seat type -> (seat table, foreign key column to the service)
+SEAT_TABLES = {
+    'bus': ('bus_seats', 'service_id'),
+    'flight': ('flight_seats', 'flight_id'),
+}
+
+
+class SeatMap:
+    """
+    Compact seat map for one service: the static seat layout plus a bitset
+    with one bit per seat (set = booked) that is updated in place.
+    """
+
+    def __init__(self, seat_numbers, booked_flags):
+        self.layout = tuple(seat_numbers)
+        self.positions = {seat: i for i, seat in enumerate(self.layout)}
+        self.bits = bytearray((len(self.layout) + 7) // 8)
+        self.version = 0
+        self.loaded_at = time.monotonic()
+        for i, is_booked in enumerate(booked_flags):
+            if is_booked:
+                self.bits[i >> 3] |= 1 << (i & 7)
+
+    def is_booked(self, i):
+        return bool(self.bits[i >> 3] >> (i & 7) & 1)
+
+    def set_booked(self, seat_numbers, booked=True):
+        """Flips the bits for the given seats; returns True if anything changed."""
+        changed = False
+        for seat in seat_numbers:
+            i = self.positions.get(seat)
+            if i is None or self.is_booked(i) == booked:
+                continue
+            self.bits[i >> 3] ^= 1 << (i & 7)
+            changed = True
+        if changed:
+            self.version += 1
+        return changed
+
+    @property
+    def etag(self):
+        # Derived from content so every worker serving the same state hands out the same tag
+        return f"{len(self.layout)}-{zlib.crc32(self.bits):08x}"
+
+    def as_rows(self):
+        """Expands the map into the seat_number/is_booked rows the seat templates expect."""
+        return [{'seat_number': seat, 'is_booked': int(self.is_booked(i))} for i, seat in enumerate(self.layout)]
+
+
+class SeatMapStore:
+    """LRU store of SeatMaps keyed on (seat_type, service_id)."""
+
+    def __init__(self, max_entries=4096, ttl=30):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._maps = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, seat_type, service_id, cur=None):
+        """
+        Returns the SeatMap for a service, reading it with `cur` (or a pooled
+        connection) when missing or stale. Returns None if the service has no seats.
+        """
+        seat_map = self.peek(seat_type, service_id)
+        if seat_map is not None:
+            return seat_map
+
+        query, params = self.load_statement(seat_type, service_id)
+        if cur is not None:
+            cur.execute(query, params)
+            rows = cur.fetchall()
+        else:
+            conn = get_db_connection()
+            try:
+                with conn.cursor() as own_cur:
+                    own_cur.execute(query, params)
+                    rows = own_cur.fetchall()
+            finally:
+                conn.close()
+        return self.store(seat_type, service_id, rows)
+
+    def peek(self, seat_type, service_id):
+        """Returns the cached SeatMap if it is still fresh, without touching the database."""
+        key = (seat_type, int(service_id))
+        with self._lock:
+            seat_map = self._maps.get(key)
+            if seat_map is not None and time.monotonic() - seat_map.loaded_at < self.ttl:
+                self._maps.move_to_end(key)
+                return seat_map
+        return None
+
+    def load_statement(self, seat_type, service_id):
+        """Builds the (sql, params) that reads a service's seats, for callers batching their own queries."""
+        table, fk_column = SEAT_TABLES[seat_type]
+        return f"SELECT seat_number, is_booked FROM {table} WHERE {fk_column} = %s ORDER BY id", [service_id]
+
+    def store(self, seat_type, service_id, rows):
+        """Builds a SeatMap from rows read with load_statement and caches it. Returns None if there are no seats."""
+        if not rows:
+            return None
+
+        key = (seat_type, int(service_id))
+        fresh = SeatMap([row['seat_number'] for row in rows], [row['is_booked'] for row in rows])
+        with self._lock:
+            previous = self._maps.get(key)
+            if previous is not None:
+                # Keep the version moving forward across reloads
+                fresh.version = previous.version + (previous.bits != fresh.bits)
+            self._maps[key] = fresh
+            self._maps.move_to_end(key)
+            while len(self._maps) > self.max_entries:
+                self._maps.popitem(last=False)
+        return fresh
+
+    def mark(self, seat_type, service_id, seat_numbers, booked=True):
+        """Updates a loaded map in place after seats are booked or released."""
+        with self._lock:
+            seat_map = self._maps.get((seat_type, int(service_id)))
+            if seat_map is not None:
+                seat_map.set_booked(seat_numbers, booked)
+
+
+seat_maps = SeatMapStore(max_entries=app.config['SEAT_MAP_MAX_ENTRIES'], ttl=app.config['SEAT_MAP_TTL'])
+
+# --- Live Seat Feed ---
+app.config['SEAT_STREAM_HEARTBEAT'] = 15     # Seconds between keep-alive comments on an idle stream
+app.config['SEAT_STREAM_MAX_SECONDS'] = 300  # Streams end after this long; EventSource reconnects and resumes
+app.config['SEAT_STREAM_MAX_CLIENTS'] = 200  # Open streams per worker before new viewers get a 503
+app.config['SEAT_STREAM_BACKLOG'] = 256      # Recent changes kept per service for viewers resuming a stream
+app.config['SEAT_STREAM_MAX_PENDING'] = 64   # Changes a viewer may fall behind before it is sent a snapshot instead
+app.config['SEAT_STREAM_CHANNELS'] = 1024    # Services whose change history is kept in memory
+app.config['SEAT_STREAM_RETRY_MS'] = 3000    # Reconnect delay suggested to EventSource clients
+app.config['SEAT_STREAM_ENABLED'] = None     # None: stream only under gevent/eventlet workers; True/False forces it
+app.config['SEAT_POLL_INTERVAL'] = 5         # Seconds between ETag polls of /api/seats when streams are off
+
+
+class SeatChannel:
+    """Change history and wake-up condition shared by the viewers of one service."""
+
+    def __init__(self, backlog):
+        # Event ids carry the token so a Last-Event-ID from another worker or process is never replayed here
+        self.token = uuid.uuid4().hex[:8]
+        self.version = 0
+        self.events = deque(maxlen=backlog)  # (version, booked, seat_numbers)
+        self.condition = threading.Condition()
+        self.subscribers = 0
+
+
+class SeatChangeFeed:
+    """
+    In-process fan-out of seat changes. A publish appends to the service's
+    backlog and wakes every viewer with one notify_all; each viewer keeps its
+    own cursor, so a slow connection never blocks publishers or other viewers,
+    and one that falls too far behind gets a single snapshot instead of a queue.
+    """
+
+    def __init__(self, backlog=256, max_pending=64, max_channels=1024, max_clients=200):
+        self.backlog = backlog
+        self.max_pending = max_pending
+        self.max_channels = max_channels
+        self.max_clients = max_clients
+        self._channels = OrderedDict()
+        self._lock = threading.Lock()
+        self.clients = 0
+        self.published = 0
+        self.rejected = 0
+        self.snapshots = 0
+
+    def publish(self, seat_type, service_id, seat_numbers, booked=True):
+        """Records a change and wakes its viewers. Services nobody has watched keep no history."""
+        with self._lock:
+            channel = self._channels.get((seat_type, int(service_id)))
+            if channel is None:
+                return
+            self.published += 1
+        with channel.condition:
+            channel.version += 1
+            channel.events.append((channel.version, booked, list(seat_numbers)))
+            channel.condition.notify_all()
+
+    def subscribe(self, seat_type, service_id):
+        """Returns the service's channel for a new viewer, or None when the worker is at its stream limit."""
+        key = (seat_type, int(service_id))
+        with self._lock:
+            if self.clients >= self.max_clients:
+                self.rejected += 1
+                return None
+            self.clients += 1
+            channel = self._channels.get(key)
+            if channel is None:
+                channel = self._channels[key] = SeatChannel(self.backlog)
+            channel.subscribers += 1
+            self._channels.move_to_end(key)
+            # Drop the history of the least recently watched services nobody is viewing
+            for old_key in list(self._channels):
+                if len(self._channels) <= self.max_channels:
+                    break
+                if self._channels[old_key].subscribers == 0:
+                    del self._channels[old_key]
+        return channel
+
+    def unsubscribe(self, channel):
+        with self._lock:
+            self.clients -= 1
+            channel.subscribers -= 1
+
+    def wait(self, channel, cursor, timeout):
+        """
+        Blocks until the channel moves past `cursor` or `timeout` passes.
+        Returns (events, version, reset); reset means the viewer missed changes
+        the backlog no longer holds, or more than max_pending, and needs a snapshot.
+        """
+        with channel.condition:
+            channel.condition.wait_for(lambda: channel.version != cursor, timeout)
+            version = channel.version
+            if version == cursor:
+                return [], version, False
+            if (cursor > version or version - cursor > self.max_pending
+                    or not channel.events or channel.events[0][0] > cursor + 1):
+                self.snapshots += 1
+                return [], version, True
+            return [event for event in channel.events if event[0] > cursor], version, False
+
+    def stats(self):
+        with self._lock:
+            return {
+                'clients': self.clients,
+                'channels': len(self._channels),
+                'published': self.published,
+                'rejected': self.rejected,
+                'snapshots': self.snapshots,
+            }
+
+
+seat_feed = SeatChangeFeed(
+    backlog=app.config['SEAT_STREAM_BACKLOG'],
+    max_pending=app.config['SEAT_STREAM_MAX_PENDING'],
+    max_channels=app.config['SEAT_STREAM_CHANNELS'],
+    max_clients=app.config['SEAT_STREAM_MAX_CLIENTS'],
+)
+
+
+def seats_changed(seat_type, service_id, seat_numbers, booked=True):
+    """Applies committed seat changes to the cached seat map and pushes them to live viewers."""
+    seat_maps.mark(seat_type, service_id, seat_numbers, booked)
+    seat_feed.publish(seat_type, service_id, seat_numbers, booked)
+
+
+def seat_streams_enabled():
+    """
+    Whether seat pages should hold a live stream open. Each viewer blocks in
+    Condition.wait, which is a cheap greenlet under monkey-patched gevent or
+    eventlet workers but a whole worker on sync/threaded servers, so those
+    poll the seat endpoint instead unless SEAT_STREAM_ENABLED says otherwise.
+    """
+    enabled = app.config['SEAT_STREAM_ENABLED']
+    if enabled is not None:
+        return bool(enabled)
+    if gevent_monkey is not None and gevent_monkey.is_module_patched('threading'):
+        return True
+    return eventlet_patcher is not None and eventlet_patcher.is_monkey_patched('thread')
+
+
+def sse_event(event, data, event_id=None):
+    """Formats one server-sent event."""
+    lines = [f"id: {event_id}"] if event_id is not None else []
+    lines += [f"event: {event}", f"data: {json.dumps(data, separators=(',', ':'))}"]
+    return '\n'.join(lines) + '\n\n'
+
+
+def seat_snapshot(seat_map):
+    return {'booked': [seat for i, seat in enumerate(seat_map.layout) if seat_map.is_booked(i)]}
+
+
+def seat_delta(events):
+    """Folds a run of changes into the final state of each seat they touched."""
+    final = {}
+    for _, booked, seat_numbers in events:
+        for seat in seat_numbers:
+            final[seat] = booked
+    return {
+        'booked': [seat for seat, booked in final.items() if booked],
+        'released': [seat for seat, booked in final.items() if not booked],
+    }
+
+# --- Seat Holds ---
+app.config['SEAT_HOLD_TTL'] = 180            # Seconds a seat stays held while the user checks out
+app.config['SEAT_HOLD_SWEEP_INTERVAL'] = 30  # Seconds between sweeps of expired holds
+app.config['SEAT_HOLD_SWEEP_BATCH'] = 500    # Expired holds deleted per statement
+
+
+class SeatUnavailableError(ValueError):
+    """Raised when requested seats are already booked or held by someone else."""
+
+    def __init__(self, seats):
+        self.seats = sorted(seats)
+        super().__init__(f"Seat(s) no longer available: {', '.join(self.seats)}")
+
+
+def parse_seat_list(raw):
+    """Splits a comma-separated seat list, dropping blanks and duplicates while keeping order."""
+    if isinstance(raw, (list, tuple)):
+        raw = ','.join(str(seat) for seat in raw)
+    return list(dict.fromkeys(seat.strip() for seat in (raw or '').split(',') if seat.strip()))
+
+def hold_seats(cur, seat_type, service_id, seat_numbers, user_id, ttl):
+    """
+    Places (or extends) holds for the user on every requested seat, all or nothing.
+    Each seat is claimed through its own seat_holds primary-key row, so concurrent
+    buyers only ever contend on the seats they both want. The claim and the check
+    go to MySQL as one round trip. Raises SeatUnavailableError.
+    """
+    table, fk_column = SEAT_TABLES[seat_type]
+    placeholders = ','.join(['%s'] * len(seat_numbers))
+    values = ','.join(['(%s, %s, %s, %s, NOW() + INTERVAL %s SECOND)'] * len(seat_numbers))
+    params = []
+    for seat in seat_numbers:
+        params.extend([seat_type, service_id, seat, user_id, ttl])
+    results = execute_batch(cur, [
+        # Take over an expired hold or refresh our own; a live hold by someone else is left alone.
+        # MySQL applies the assignments left to right, so expires_at sees the updated user_id.
+        (f"""INSERT INTO seat_holds (seat_type, service_id, seat_number, user_id, expires_at) VALUES {values}
+            ON DUPLICATE KEY UPDATE
+                user_id = IF(expires_at <= NOW() OR user_id = VALUES(user_id), VALUES(user_id), user_id),
+                expires_at = IF(user_id = VALUES(user_id), VALUES(expires_at), expires_at)""", params),
+        # Seats we now hold that are still unbooked; anything else is unavailable
+        (f"""SELECT h.seat_number FROM seat_holds h
+            JOIN {table} s ON s.{fk_column} = h.service_id AND s.seat_number = h.seat_number
+            WHERE h.seat_type = %s AND h.service_id = %s AND h.seat_number IN ({placeholders})
+              AND h.user_id = %s AND s.is_booked = 0""", [seat_type, service_id] + seat_numbers + [user_id]),
+    ])
+    unavailable = set(seat_numbers) - {row['seat_number'] for row in results[1]['rows']}
+    if unavailable:
+        raise SeatUnavailableError(unavailable)
+
+def release_holds_statement(seat_type, service_id, seat_numbers, user_id):
+    """Builds the statement dropping the user's holds on the given seats."""
+    placeholders = ','.join(['%s'] * len(seat_numbers))
+    return (
+        f"DELETE FROM seat_holds WHERE seat_type = %s AND service_id = %s AND seat_number IN ({placeholders}) AND user_id = %s",
+        [seat_type, service_id] + seat_numbers + [user_id]
+    )
+
+def release_seat_holds(cur, seat_type, service_id, seat_numbers, user_id):
+    """Drops the user's holds on the given seats."""
+    cur.execute(*release_holds_statement(seat_type, service_id, seat_numbers, user_id))
+
+def confirm_seats_statement(seat_type, service_id, seat_numbers, user_id):
+    """
+    Builds the conditional update that books seats only if they are still free
+    and not held by another user; its affected row count must equal len(seat_numbers).
+    """
+    table, fk_column = SEAT_TABLES[seat_type]
+    placeholders = ','.join(['%s'] * len(seat_numbers))
+    return (
+        f"""UPDATE {table} s SET s.is_booked = 1, s.user_id = %s
+            WHERE s.{fk_column} = %s AND s.seat_number IN ({placeholders}) AND s.is_booked = 0
+              AND NOT EXISTS (
+                  SELECT 1 FROM seat_holds h
+                  WHERE h.seat_type = %s AND h.service_id = s.{fk_column} AND h.seat_number = s.seat_number
+                    AND h.user_id <> %s AND h.expires_at > NOW()
+              )""",
+        [user_id, service_id] + seat_numbers + [seat_type, user_id]
+    )
+
+def check_confirmed_seats(cur, seat_type, service_id, seat_numbers, user_id, confirmed):
+    """Raises SeatUnavailableError naming the lost seats if the conditional update fell short."""
+    if confirmed == len(seat_numbers):
+        return
+    table, fk_column = SEAT_TABLES[seat_type]
+    placeholders = ','.join(['%s'] * len(seat_numbers))
+    cur.execute(
+        f"SELECT seat_number FROM {table} WHERE {fk_column} = %s AND seat_number IN ({placeholders}) AND user_id = %s AND is_booked = 1",
+        [service_id] + seat_numbers + [user_id]
+    )
+    # Everything the conditional update just took is rolled back by the caller
+    raise SeatUnavailableError(set(seat_numbers) - {row['seat_number'] for row in cur.fetchall()} or seat_numbers)
+
+def sweep_expired_holds():
+    """Deletes expired holds in small batches so the sweep never holds long or wide locks."""
+    batch = app.config['SEAT_HOLD_SWEEP_BATCH']
+    total = 0
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            while True:
+                deleted = cur.execute(
+                    "DELETE FROM seat_holds WHERE expires_at <= NOW() ORDER BY expires_at LIMIT %s", (batch,)
+                )
+                conn.commit()
+                total += deleted
+                if deleted < batch:
+                    break
+    finally:
+        conn.close()
+    return total
+
+_hold_sweeper_started = False
+_hold_sweeper_lock = threading.Lock()
+
+def start_hold_sweeper():
+    """Starts the background thread that periodically sweeps expired holds (once per process)."""
+    global _hold_sweeper_started
+    with _hold_sweeper_lock:
+        if _hold_sweeper_started:
+            return
+        _hold_sweeper_started = True
+
+    def run():
+        while True:
+            time.sleep(app.config['SEAT_HOLD_SWEEP_INTERVAL'])
+            try:
+                sweep_expired_holds()
+            except pymysql.MySQLError as e:
+                print(f"Database error sweeping seat holds: {e}")
+
+    threading.Thread(target=run, name='seat-hold-sweeper', daemon=True).start()
+
+# --- Seat Availability ---
+app.config['TRAIN_SEAT_CAPACITY'] = 300  # Trains have no seat table, so each one sells this many seats
+
+# service_type -> (table, date column) for services with a maintained free-seat counter
+AVAILABILITY_SOURCES = {
+    'bus': ('services', 'travel_date'),
+    'train': ('trains', 'travel_date'),
+    'flight': ('flights', 'departure_date'),
+}
+
+
+class SoldOutError(ValueError):
+    """Raised when a service has fewer seats left than a booking asks for."""
+
+    def __init__(self, service_type, service_id, seats_left):
+        self.seats_left = seats_left
+        super().__init__(f"Only {seats_left} seat(s) left on {service_type} {service_id}")
+
+
+def seed_counters_statement(service_type, where, params):
+    """Builds the INSERT IGNORE creating counters, from their free seats, for services (aliased `s`) matching `where` that have none."""
+    table, date_column = AVAILABILITY_SOURCES[service_type]
+    missing = "NOT EXISTS (SELECT 1 FROM service_availability a WHERE a.service_type = %s AND a.service_id = s.id)"
+    if service_type in SEAT_TABLES:
+        seat_table, fk_column = SEAT_TABLES[service_type]
+        return (
+            f"""INSERT IGNORE INTO service_availability (service_type, service_id, service_date, seat_capacity, seats_left)
+                SELECT %s, s.id, s.{date_column}, COUNT(x.seat_number), COUNT(x.seat_number) - COALESCE(SUM(x.is_booked), 0)
+                FROM {table} s LEFT JOIN {seat_table} x ON x.{fk_column} = s.id
+                WHERE {where} AND {missing}
+                GROUP BY s.id, s.{date_column}""",
+            [service_type] + list(params) + [service_type]
+        )
+    capacity = app.config['TRAIN_SEAT_CAPACITY']
+    return (
+        f"""INSERT IGNORE INTO service_availability (service_type, service_id, service_date, seat_capacity, seats_left)
+            SELECT %s, s.id, s.{date_column}, %s, %s FROM {table} s WHERE {where} AND {missing}""",
+        [service_type, capacity, capacity] + list(params) + [service_type]
+    )
+
+def seed_availability_counters(cur):
+    """Creates counters for services that do not have one yet, counting their free seats."""
+    for service_type in AVAILABILITY_SOURCES:
+        cur.execute(*seed_counters_statement(service_type, '1=1', []))
+
+class MissingCounterError(ValueError):
+    """Raised when a claim finds no counter for its service, e.g. one added to the table outside the app."""
+
+    def __init__(self, service_type, service_id):
+        self.service_type, self.service_id = service_type, service_id
+        super().__init__(f"No availability counter for {service_type} {service_id}")
+
+
+def create_availability_counter(conn, service_type, service_id):
+    """
+    Creates one service's missing counter in its own short transaction. The free
+    seats are counted with a plain (non-locking) read and inserted as values, so
+    unlike an INSERT ... SELECT this takes no shared locks that a concurrent
+    booking's counter update would then deadlock on. Call it outside any booking
+    transaction; it commits.
+    """
+    table, date_column = AVAILABILITY_SOURCES[service_type]
+    with conn.cursor() as cur:
+        if service_type in SEAT_TABLES:
+            seat_table, fk_column = SEAT_TABLES[service_type]
+            cur.execute(
+                f"""SELECT s.{date_column} AS service_date, COUNT(x.seat_number) AS capacity,
+                       COUNT(x.seat_number) - COALESCE(SUM(x.is_booked), 0) AS seats_left
+                   FROM {table} s LEFT JOIN {seat_table} x ON x.{fk_column} = s.id
+                   WHERE s.id = %s GROUP BY s.id, s.{date_column}""",
+                [service_id]
+            )
+        else:
+            capacity = app.config['TRAIN_SEAT_CAPACITY']
+            cur.execute(f"SELECT {date_column} AS service_date, %s AS capacity, %s AS seats_left FROM {table} WHERE id = %s",
+                        [capacity, capacity, service_id])
+        row = cur.fetchone()
+        if row is not None:
+            cur.execute(
+                "INSERT IGNORE INTO service_availability (service_type, service_id, service_date, seat_capacity, seats_left) VALUES (%s, %s, %s, %s, %s)",
+                [service_type, service_id, row['service_date'], row['capacity'], row['seats_left']]
+            )
+    conn.commit()
+
+def adjust_availability_statement(service_type, service_id, delta):
+    """Builds the statement moving a service's free-seat counter by `delta`, kept within 0..capacity."""
+    return (
+        "UPDATE service_availability SET seats_left = LEAST(seat_capacity, GREATEST(seats_left + %s, 0)) WHERE service_type = %s AND service_id = %s",
+        [delta, service_type, service_id]
+    )
+
+def claim_availability_statement(service_type, service_id, count):
+    """Builds the conditional update taking `count` seats off the counter; it changes no row when sold out."""
+    return (
+        "UPDATE service_availability SET seats_left = seats_left - %s WHERE service_type = %s AND service_id = %s AND seats_left >= %s",
+        [count, service_type, service_id, count]
     )
-    return connection
+
+def check_claimed_availability(cur, service_type, service_id, claimed, conditional=True):
+    """
+    Checks a counter update that changed `claimed` rows. Raises MissingCounterError
+    if the service has no counter, and SoldOutError if a `conditional`
+    claim_availability_statement found too few seats left.
+    """
+    if claimed:
+        return
+    cur.execute("SELECT seats_left FROM service_availability WHERE service_type = %s AND service_id = %s", (service_type, service_id))
+    counter = cur.fetchone()
+    if counter is None:
+        raise MissingCounterError(service_type, service_id)
+    if conditional:
+        raise SoldOutError(service_type, service_id, counter['seats_left'])
+
+def cancellation_statements(booking, user_id):
+    """
+    Builds the statements handing a cancelled booking's seats back to its service.
+    Returns (statements, freed seat numbers).
+    """
+    service_type, service_id = booking['service_type'], booking['service_id']
+    details = decode_booking_details(booking['details'])
+    if service_type in SEAT_TABLES:
+        seats = parse_seat_list(details.get('seats'))
+        if not seats:
+            return [], []
+        table, fk_column = SEAT_TABLES[service_type]
+        placeholders = ','.join(['%s'] * len(seats))
+        return [
+            (f"UPDATE {table} SET is_booked = 0, user_id = NULL WHERE {fk_column} = %s AND seat_number IN ({placeholders}) AND user_id = %s AND is_booked = 1",
+             [service_id] + seats + [user_id]),
+            # ROW_COUNT() is the number of seats the previous statement actually freed
+            ("UPDATE service_availability SET seats_left = LEAST(seat_capacity, seats_left + ROW_COUNT()) WHERE service_type = %s AND service_id = %s",
+             [service_type, service_id]),
+        ], seats
+    if service_type == 'train':
+        quantity = details.get('quantity')
+        if quantity is None:
+            # Bookings made before the quantity was recorded only have "N ticket(s) in ..."
+            match = re.match(r'\s*(\d+)', details.get('details') or '')
+            quantity = int(match.group(1)) if match else 0
+        if quantity:
+            return [adjust_availability_statement(service_type, service_id, int(quantity))], []
+    return [], []
+
+def get_min_seats():
+    """Returns the requested minimum number of free seats, or None when not filtering."""
+    min_seats = request.values.get('passengers', type=int)
+    return min_seats if min_seats and min_seats > 0 else None
+
+def refresh_availability_counters(cur, service_type, service_ids):
+    """
+    Creates or recounts the counters of the given services, e.g. after their
+    inventory was (re)loaded. Train counters keep their seats_left.
+    """
+    table, date_column = AVAILABILITY_SOURCES[service_type]
+    placeholders = ','.join(['%s'] * len(service_ids))
+    if service_type in SEAT_TABLES:
+        seat_table, fk_column = SEAT_TABLES[service_type]
+        cur.execute(
+            f"""INSERT INTO service_availability (service_type, service_id, service_date, seat_capacity, seats_left)
+                SELECT %s, s.id, s.{date_column}, COUNT(x.seat_number), COUNT(x.seat_number) - COALESCE(SUM(x.is_booked), 0)
+                FROM {table} s LEFT JOIN {seat_table} x ON x.{fk_column} = s.id
+                WHERE s.id IN ({placeholders})
+                GROUP BY s.id, s.{date_column}
+                ON DUPLICATE KEY UPDATE service_date = VALUES(service_date), seat_capacity = VALUES(seat_capacity),
+                    seats_left = VALUES(seats_left)""",
+            [service_type] + list(service_ids)
+        )
+    else:
+        capacity = app.config['TRAIN_SEAT_CAPACITY']
+        cur.execute(
+            f"""INSERT INTO service_availability (service_type, service_id, service_date, seat_capacity, seats_left)
+                SELECT %s, s.id, s.{date_column}, %s, %s FROM {table} s WHERE s.id IN ({placeholders})
+                ON DUPLICATE KEY UPDATE service_date = VALUES(service_date)""",
+            [service_type, capacity, capacity] + list(service_ids)
+        )
+
+def availability_join(service_type):
+    """Returns the clause joining a service table to its counter (aliased `a`) by primary key."""
+    table, date_column = AVAILABILITY_SOURCES[service_type]
+    return (f"LEFT JOIN service_availability a ON a.service_type = '{service_type}'"
+            f" AND a.service_id = {table}.id AND a.service_date = {table}.{date_column}")
+
+def add_min_seats_filter(query, params, min_seats):
+    """
+    Keeps only services with at least `min_seats` seats left, when a minimum was asked for.
+    Services without a counter yet (one is created on their first booking) are kept.
+    """
+    if min_seats:
+        query += " AND (a.seats_left IS NULL OR a.seats_left >= %s)"
+        params.append(min_seats)
+    return query
+
+# --- Fares ---
+# Fare classes per service type as (name, multiplier on the base price). The first class is the default.
+FARE_CLASSES = {
+    'bus': (('Standard', Decimal('1.0')),),
+    'train': (('Sleeper', Decimal('1.0')), ('AC Chair', Decimal('1.5')), ('First Class', Decimal('2.5'))),
+    'flight': (('Economy', Decimal('1.0')),),
+    'hotel': (('Standard', Decimal('1.0')),),
+}
+# Base price column per service type
+FARE_PRICE_COLUMNS = {'bus': 'price', 'train': 'price', 'flight': 'price', 'hotel': 'price_per_night'}
+app.config['FARE_MATRIX_QUANTITIES'] = (1, 2, 3, 4)  # Quantities shown in search-result price matrices
+app.config['FARE_MAX_QUANTITY'] = 10
+
+
+class FareEngine:
+    """
+    Prices whole result sets at once: base prices x fare classes x quantities in one
+    broadcast computation (NumPy when installed, plain Python otherwise). All maths is
+    done in integer cents with half-up rounding, so quotes, search listings and the
+    amount create_booking charges always agree to the cent.
+    """
+
+    def __init__(self, fare_classes):
+        self.fare_classes = fare_classes
+        # Multipliers as integer basis points, so 1.5 -> 15000
+        self._basis_points = {
+            service_type: [int(multiplier * 10000) for _, multiplier in classes]
+            for service_type, classes in fare_classes.items()
+        }
+
+    def class_names(self, service_type):
+        return [name for name, _ in self.fare_classes[service_type]]
+
+    def default_class(self, service_type):
+        return self.fare_classes[service_type][0][0]
+
+    def matrix(self, service_type, base_prices, quantities, classes=None):
+        """
+        Returns totals in cents as nested lists indexed [service][class][quantity].
+        `classes` narrows (and orders) the fare classes; unknown names raise ValueError.
+        """
+        names = self.class_names(service_type)
+        basis_points = self._basis_points[service_type]
+        if classes is not None:
+            unknown = [name for name in classes if name not in names]
+            if unknown:
+                raise ValueError(f"Unknown fare class(es) for {service_type}: {', '.join(unknown)}")
+            basis_points = [basis_points[names.index(name)] for name in classes]
+        cents = [int((Decimal(str(price)) * 100).quantize(Decimal('1'), rounding=ROUND_HALF_UP)) for price in base_prices]
+        if np is not None:
+            totals = (np.asarray(cents, dtype=np.int64)[:, None, None]
+                      * np.asarray(basis_points, dtype=np.int64)[None, :, None]
+                      * np.asarray(quantities, dtype=np.int64)[None, None, :])
+            return ((totals + 5000) // 10000).tolist()
+        return [[[(c * bp * q + 5000) // 10000 for q in quantities] for bp in basis_points] for c in cents]
+
+    def quote(self, service_type, base_price, fare_class=None, quantity=1):
+        """Total price as a Decimal for one service, class and quantity."""
+        fare_class = fare_class or self.default_class(service_type)
+        cents = self.matrix(service_type, [base_price], [quantity], [fare_class])[0][0][0]
+        return to_money(cents)
+
+    def price_table(self, service_type, rows, quantities):
+        """Maps each row's id to {class: [total per quantity]} for rendering, priced in one batch."""
+        column = FARE_PRICE_COLUMNS[service_type]
+        totals = self.matrix(service_type, [row[column] for row in rows], quantities)
+        names = self.class_names(service_type)
+        return {
+            row['id']: {name: [to_money(cents) for cents in per_quantity] for name, per_quantity in zip(names, per_class)}
+            for row, per_class in zip(rows, totals)
+        }
+
+
+def to_money(cents):
+    """Converts integer cents to a two-place Decimal."""
+    return (Decimal(cents) / 100).quantize(Decimal('0.01'))
+
+fare_engine = FareEngine(FARE_CLASSES)
+
+def fare_context(service_type, rows):
+    """Template context with a class x quantity price matrix for each result row."""
+    quantities = app.config['FARE_MATRIX_QUANTITIES']
+    return {'fares': fare_engine.price_table(service_type, rows, quantities), 'fare_quantities': quantities}
+
+def connection_context(rows, origin, destination, travel_date, first_page):
+    """
+    Template context offering multi-leg itineraries when a first results page has no
+    direct service, so the user still gets something to book.
+    """
+    if rows or not first_page or not origin or not destination:
+        return {}
+    try:
+        depart_after = datetime.combine(date.fromisoformat(travel_date), datetime.min.time()) if travel_date else datetime.now()
+    except ValueError:
+        return {}
+    # Rendered inline with the page, so it gets a tighter budget than /api/itineraries
+    itineraries, _ = timetable.search(origin, destination, depart_after, k=3,
+                                      time_budget=app.config['ITINERARY_SUGGESTION_BUDGET'])
+    return {'itineraries': itineraries}
+
+# --- Unified Multi-Modal Search ---
+app.config['UNIFIED_SEARCH_WORKERS'] = 4     # Threads shared by all /api/search requests, each holding one pooled connection
+app.config['UNIFIED_SEARCH_TIMEOUT'] = 2.0   # Seconds each source may take before it is skipped
+
+# A running source keeps its connection past the deadline (cancel() only stops queued ones), so
+# the threads are capped at half the primary pool and searches can never starve the other routes
+unified_search_executor = ThreadPoolExecutor(
+    max_workers=max(1, min(app.config['UNIFIED_SEARCH_WORKERS'], app.config['MYSQL_POOL_SIZE'] // 2)),
+    thread_name_prefix='unified-search'
+)
+
+def format_json_value(value):
+    """Converts DATE/TIME/DECIMAL column values into JSON-friendly strings and floats."""
+    if isinstance(value, timedelta):
+        # MySQL TIME columns arrive as timedelta; render them as zero-padded HH:MM:SS
+        total = int(value.total_seconds())
+        return f"{total // 3600:02d}:{total % 3600 // 60:02d}:{total % 60:02d}"
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    return value
+
+def fetch_search_source(service_type, query, params, cache_key, read_only=True):
+    """
+    Runs one source of a unified search on its own pooled connection, through the
+    search cache. Worker threads have no session, so the request resolves its
+    read-your-writes pin and passes read_only=False while it holds.
+    """
+    rows = search_cache.get(service_type, cache_key)
+    if rows is None:
+        conn = get_db_connection(read_only=read_only)
+        try:
+            with conn.cursor() as cur:
+                cur.execute(query, params)
+                rows = cur.fetchall()
+        finally:
+            conn.close()
+        search_cache.set(service_type, cache_key, rows)
+    return rows
+
+def build_unified_search_sources(origin, destination, travel_date, limit, timeout_ms):
+    """Builds the (query, params) for every source of a unified search."""
+    # The optimizer hint makes MySQL abandon a source query we have already stopped waiting for
+    select = f"SELECT /*+ MAX_EXECUTION_TIME({timeout_ms}) */"
+    sources = {}
+    for service_type, columns, table, field, from_column, to_column, date_column in (
+        ('bus', BUS_SEARCH_COLUMNS, 'services', 'bus_city', 'from_city', 'to_city', 'travel_date'),
+        ('train', TRAIN_SEARCH_COLUMNS, 'trains', 'train_city', 'origin', 'destination', 'travel_date'),
+        ('flight', FLIGHT_SEARCH_COLUMNS, 'flights', 'airport', 'origin', 'destination', 'departure_date'),
+    ):
+        params = []
+        query = f"{select} {columns} FROM {table} WHERE 1=1"
+        query = add_location_filter(query, params, from_column, field, origin)
+        query = add_location_filter(query, params, to_column, field, destination)
+        if travel_date:
+            query += f" AND {date_column} = %s"
+            params.append(travel_date)
+        query += " ORDER BY price, id LIMIT %s"
+        params.append(limit)
+        sources[service_type] = (query, params)
+
+    params = []
+    query = add_location_filter(f"{select} {HOTEL_SEARCH_COLUMNS} FROM hotels WHERE 1=1", params, 'location', 'hotel_location', destination)
+    query += " ORDER BY price_per_night, id LIMIT %s"
+    params.append(limit)
+    sources['hotel'] = (query, params)
+    return sources
+
+def normalize_search_result(service_type, row):
+    """Maps a row from any transport table onto one common result shape."""
+    if service_type == 'bus':
+        result = {
+            'name': row['name'], 'origin': row['from_city'], 'destination': row['to_city'],
+            'departure': row['departure_time'], 'arrival': None, 'date': row['travel_date'],
+        }
+    elif service_type == 'train':
+        result = {
+            'name': row['name'], 'origin': row['origin'], 'destination': row['destination'],
+            'departure': row['departure'], 'arrival': row['arrival'], 'date': row['travel_date'],
+        }
+    else:
+        result = {
+            'name': f"{row['airline']} {row['number']}", 'origin': row['origin'], 'destination': row['destination'],
+            'departure': row['departure'], 'arrival': row['arrival'], 'date': row['departure_date'],
+        }
+    result.update({'type': service_type, 'id': row['id'], 'price': row['price']})
+    return {key: format_json_value(value) for key, value in result.items()}
+
+# --- Itinerary Planner ---
+app.config['ITINERARY_REFRESH'] = 60          # Seconds between incremental timetable refreshes
+app.config['ITINERARY_FULL_REFRESH'] = 3600   # Seconds between full rebuilds, which pick up edited and deleted legs
+app.config['ITINERARY_HORIZON_HOURS'] = 48    # How far past the requested departure legs are considered
+app.config['ITINERARY_MAX_LEGS'] = 4
+app.config['ITINERARY_TIME_BUDGET'] = 0.5     # Seconds a search may scan before returning what it has found
+app.config['ITINERARY_SUGGESTION_BUDGET'] = 0.15  # The same for the connections offered on empty result pages
+# Minimum minutes between arriving somewhere and boarding a leg of each mode there
+app.config['ITINERARY_MIN_TRANSFER'] = {'bus': 15, 'train': 10, 'flight': 60}
+app.config['ITINERARY_BUS_LEG_MINUTES'] = 240  # Buses have no arrival column, so their legs are assumed to take this long
+
+# mode -> (table, columns, date column); the columns alias to origin, destination, dep_date, departure, arrival, price
+TIMETABLE_SOURCES = {
+    'bus': ('services', "id, from_city AS origin, to_city AS destination, travel_date AS dep_date, "
+                        "departure_time AS departure, NULL AS arrival, price", 'travel_date'),
+    'train': ('trains', "id, origin, destination, travel_date AS dep_date, departure, arrival, price", 'travel_date'),
+    'flight': ('flights', "id, origin, destination, departure_date AS dep_date, departure, arrival, price", 'departure_date'),
+}
+TIMETABLE_MODES = tuple(TIMETABLE_SOURCES)
+# Parallel arrays holding one connection per index, sorted by departure
+TIMETABLE_FIELDS = ('dep', 'arr', 'origin', 'dest', 'price', 'mode', 'service_id')
+
+
+def clock_minutes(value):
+    """Minutes after midnight for a TIME column (pymysql returns a timedelta) or an 'HH:MM[:SS]' string."""
+    if value is None:
+        return None
+    if isinstance(value, timedelta):
+        return int(value.total_seconds()) // 60
+    hours, minutes = str(value).split(':')[:2]
+    return int(hours) * 60 + int(minutes)
+
+def minute_to_datetime(minute):
+    """Inverse of the timetable's absolute minutes (proleptic ordinal day * 1440 + minute of day)."""
+    return datetime.fromordinal(minute // 1440) + timedelta(minutes=minute % 1440)
+
+
+class Timetable:
+    """
+    Every bus, train and flight leg as a connection list sorted by departure time,
+    stored in compact parallel arrays with stop names interned to integers. Loaded
+    on first use, topped up incrementally with rows added since the last refresh,
+    and rebuilt in full periodically. A refresh builds new arrays and swaps them in,
+    so searches keep using the snapshot they started with.
+    """
+
+    def __init__(self, sources, refresh_interval=60, full_refresh_interval=3600):
+        self.sources = sources
+        self.refresh_interval = refresh_interval
+        self.full_refresh_interval = full_refresh_interval
+        self._snapshot = None  # {'stops', 'stop_ids', 'dep', 'arr', ...}
+        self._watermarks = {}  # mode -> highest id already loaded
+        self._loaded_at = None
+        self._rebuilt_at = None
+        self._refresh_lock = threading.Lock()
+
+    def refresh(self, full=False):
+        """Loads legs added since the previous refresh, or every current leg when `full`."""
+        previous = None if full or self._snapshot is None else self._snapshot
+        stops = list(previous['stops']) if previous else []
+        stop_ids = dict(previous['stop_ids']) if previous else {}
+        watermarks = {} if previous is None else dict(self._watermarks)
+        bus_minutes = app.config['ITINERARY_BUS_LEG_MINUTES']
+        oldest = date.today() - timedelta(days=1)
+
+        def intern(name):
+            key = name.strip().lower()
+            stop = stop_ids.get(key)
+            if stop is None:
+                stop = stop_ids[key] = len(stops)
+                stops.append(name.strip())
+            return stop
+
+        new_legs = []
+        conn = get_db_connection(read_only=True)
+        try:
+            with conn.cursor(pymysql.cursors.SSDictCursor) as cur:
+                for mode_index, (mode, (table, columns, date_column)) in enumerate(self.sources.items()):
+                    last_id = watermarks.get(mode, 0)
+                    cur.execute(
+                        f"SELECT {columns} FROM {table} WHERE id > %s AND {date_column} >= %s ORDER BY id",
+                        (last_id, oldest)
+                    )
+                    for row in cur:
+                        last_id = row['id']
+                        departure = clock_minutes(row['departure'])
+                        if departure is None or not row['origin'] or not row['destination'] or row['price'] is None:
+                            continue
+                        dep = row['dep_date'].toordinal() * 1440 + departure
+                        arrival = clock_minutes(row['arrival'])
+                        if arrival is None:
+                            arr = dep + bus_minutes
+                        else:
+                            # An arrival clock time at or before departure means the leg runs past midnight
+                            arr = dep - departure + arrival + (1440 if arrival <= departure else 0)
+                        price = int((Decimal(str(row['price'])) * 100).quantize(Decimal('1'), rounding=ROUND_HALF_UP))
+                        new_legs.append((dep, arr, intern(row['origin']), intern(row['destination']), price, mode_index, row['id']))
+                    watermarks[mode] = max(watermarks.get(mode, 0), last_id)
+        finally:
+            conn.close()
+
+        if previous is not None and not new_legs:
+            self._loaded_at = time.monotonic()
+            return
+        legs = list(zip(*(previous[field] for field in TIMETABLE_FIELDS))) if previous else []
+        # The old legs are already sorted, so this is a linear merge for Timsort
+        legs.extend(sorted(new_legs))
+        legs.sort()
+        snapshot = {'stops': stops, 'stop_ids': stop_ids}
+        for position, field in enumerate(TIMETABLE_FIELDS):
+            snapshot[field] = array('q', (leg[position] for leg in legs))
+        snapshot['feeders'] = self.index_feeders(snapshot['origin'], snapshot['dest'])
+        self._snapshot = snapshot
+        self._watermarks = watermarks
+        self._loaded_at = time.monotonic()
+        if full or previous is None:
+            self._rebuilt_at = self._loaded_at
+
+    def ensure_fresh(self):
+        """Loads the timetable on first use, then refreshes it incrementally or in full as it ages."""
+        now = time.monotonic()
+        if self._loaded_at is not None and now - self._loaded_at < self.refresh_interval:
+            return
+        # The first load blocks; later refreshes are done by one request while others search the current snapshot
+        if not self._refresh_lock.acquire(blocking=self._loaded_at is None):
+            return
+        try:
+            if self._loaded_at is None or time.monotonic() - self._loaded_at >= self.refresh_interval:
+                self.refresh(full=self._rebuilt_at is not None and now - self._rebuilt_at >= self.full_refresh_interval)
+        except pymysql.MySQLError as e:
+            print(f"Database error refreshing timetable: {e}")
+        finally:
+            self._refresh_lock.release()
+
+    @staticmethod
+    def index_feeders(origins, destinations):
+        """Maps each stop to the set of stops with a direct leg into it, whatever the time."""
+        feeders = {}
+        for origin, destination in zip(origins, destinations):
+            feeders.setdefault(destination, set()).add(origin)
+        return feeders
+
+    def resolve(self, snapshot, query):
+        """Stop ids matching a place name: the exact (case-insensitive) stop, else every stop containing it."""
+        key = (query or '').strip().lower()
+        if not key:
+            return []
+        if key in snapshot['stop_ids']:
+            return [snapshot['stop_ids'][key]]
+        return [stop for stop, name in enumerate(snapshot['stops']) if key in name.lower()]
+
+    def search(self, origin, destination, depart_after, k=5, objective='cheapest', max_legs=3, time_budget=None):
+        """
+        Connection-scan search for the k best journeys from `origin` to `destination`
+        leaving at or after the `depart_after` datetime. Scans legs in departure order,
+        keeping per stop every partial journey that fewer than k others beat on arrival,
+        cost, legs and first departure, and honouring per-mode minimum transfer times.
+        Legs into stops too many hops from the destination to finish within max_legs
+        are skipped, which leaves most of the scan with nothing to do.
+        The result is the exact top k unless the time budget (`time_budget` seconds,
+        by default ITINERARY_TIME_BUDGET) ran out.
+        Returns (itineraries, complete); complete is False if the time budget ran out.
+        """
+        self.ensure_fresh()
+        snapshot = self._snapshot
+        if snapshot is None:
+            return [], False
+        origins = self.resolve(snapshot, origin)
+        targets = set(self.resolve(snapshot, destination)) - set(origins)
+        if not origins or not targets:
+            return [], True
+
+        dep, arr, org, dst, price, mode = (snapshot[field] for field in TIMETABLE_FIELDS[:6])
+        transfer = [app.config['ITINERARY_MIN_TRANSFER'].get(name, 0) for name in TIMETABLE_MODES]
+        start = depart_after.date().toordinal() * 1440 + depart_after.hour * 60 + depart_after.minute
+        first_leg = bisect.bisect_left(dep, start)
+        last_leg = bisect.bisect_right(dep, start + app.config['ITINERARY_HORIZON_HOURS'] * 60)
+        deadline = time.monotonic() + (app.config['ITINERARY_TIME_BUDGET'] if time_budget is None else time_budget)
+
+        # Fewest legs from each stop to a target, ignoring times: a journey reaching a stop
+        # that is n hops out with more than max_legs - n legs used can never finish in time
+        hops = dict.fromkeys(targets, 0)
+        frontier = targets
+        for n in range(1, max_legs):
+            frontier = {feeder for stop in frontier for feeder in snapshot['feeders'].get(stop, ()) if feeder not in hops}
+            hops.update(dict.fromkeys(frontier, n))
+
+        if objective == 'fastest':
+            rank = lambda label: (label[0] - label[3], label[1], label[0])
+        else:
+            rank = lambda label: (label[1], label[0], label[0] - label[3])
+
+        # A label is (arrival, cost, legs, first departure, parent label, leg index, stops left from)
+        bags = {stop: [(start, 0, 0, None, None, None, frozenset())] for stop in origins}
+        found = []  # (rank, sequence, label) for the best k complete journeys, best first
+        sequence = itertools.count()
+        complete = True
+        for i in range(first_leg, last_leg):
+            if (i - first_leg) & 4095 == 4095 and time.monotonic() > deadline:
+                complete = False
+                break
+            bag = bags.get(org[i])
+            if not bag or dst[i] == org[i]:
+                continue
+            departs, stop = dep[i], dst[i]
+            # Most legs a journey may have used before this one and still reach a target in time
+            spare = max_legs - 1 - hops.get(stop, max_legs)
+            if spare < 0:
+                continue
+            for label in tuple(bag):
+                if label[2] > spare:
+                    continue
+                ready = label[0] if label[5] is None else label[0] + transfer[mode[i]]
+                if ready > departs:
+                    continue
+                if stop in label[6]:
+                    continue  # Journeys never pass through the same stop twice
+                new = (arr[i], label[1] + price[i], label[2] + 1, departs if label[3] is None else label[3], label, i)
+                new_rank = rank(new)
+                # Costs and durations only grow, so anything already worse than the k-th result is dead
+                if len(found) >= k and new_rank >= found[-1][0]:
+                    continue
+                if stop in targets:
+                    bisect.insort(found, (new_rank, next(sequence), new))
+                    del found[k:]
+                    continue
+                self._add_to_bag(bags.setdefault(stop, []), new + (label[6] | {org[i]},), k)
+
+        return [self._describe(snapshot, label) for _, _, label in found], complete
+
+    @staticmethod
+    def _dominates(a, b):
+        """
+        True if every way of continuing journey `b` also continues `a` into a journey at
+        least as good: `a` is no later, no dearer, no longer, left no earlier, and has
+        passed through no stop that `b` has not (so it is free to go everywhere `b` can).
+        """
+        return (a[0] <= b[0] and a[1] <= b[1] and a[2] <= b[2]
+                and (a[3] is None or (b[3] is not None and a[3] >= b[3])) and a[6] <= b[6])
+
+    @classmethod
+    def _add_to_bag(cls, bag, new, k):
+        """
+        Adds a label unless k others dominate it, dropping labels it takes to k dominators.
+        Each dominator leads to a distinct journey at least as good, so a label with k of
+        them can never be among the k best; one with fewer must be kept.
+        """
+        dominates = cls._dominates
+        dominators, beaten = 0, []
+        for other in bag:
+            if dominates(other, new):
+                dominators += 1
+                if dominators >= k:
+                    return
+            elif dominates(new, other):
+                beaten.append(other)
+        bag.append(new)
+        # One at a time, so every label dropped still has k dominators left in the bag
+        for other in beaten:
+            if sum(1 for rival in bag if rival is not other and dominates(rival, other)) >= k:
+                bag[:] = [label for label in bag if label is not other]
+
+    @staticmethod
+    def _describe(snapshot, label):
+        """Turns a complete journey label into a JSON-ready itinerary."""
+        arrival, cost, _, first = label[:4]
+        legs = []
+        while label[5] is not None:
+            i = label[5]
+            legs.append({
+                'type': TIMETABLE_MODES[snapshot['mode'][i]],
+                'service_id': snapshot['service_id'][i],
+                'origin': snapshot['stops'][snapshot['origin'][i]],
+                'destination': snapshot['stops'][snapshot['dest'][i]],
+                'departure': minute_to_datetime(snapshot['dep'][i]).isoformat(timespec='minutes'),
+                'arrival': minute_to_datetime(snapshot['arr'][i]).isoformat(timespec='minutes'),
+                'price': float(to_money(snapshot['price'][i])),
+            })
+            label = label[4]
+        legs.reverse()
+        return {
+            'legs': legs,
+            'transfers': len(legs) - 1,
+            'departure': minute_to_datetime(first).isoformat(timespec='minutes'),
+            'arrival': minute_to_datetime(arrival).isoformat(timespec='minutes'),
+            'duration_minutes': arrival - first,
+            'total_price': float(to_money(cost)),
+        }
+
+    def stats(self):
+        snapshot = self._snapshot
+        return {
+            'legs': len(snapshot['dep']) if snapshot else 0,
+            'stops': len(snapshot['stops']) if snapshot else 0,
+            'watermarks': dict(self._watermarks),
+        }
+
+
+timetable = Timetable(TIMETABLE_SOURCES, refresh_interval=app.config['ITINERARY_REFRESH'],
+                      full_refresh_interval=app.config['ITINERARY_FULL_REFRESH'])
+
+# --- Password Hashing ---
+app.config['PASSWORD_HASH_METHOD'] = 'scrypt:32768:8:1'  # Spell out every parameter so stored hashes compare equal
+app.config['PASSWORD_HASH_WORKERS'] = 4
+app.config['PASSWORD_HASH_MAX_PENDING'] = 32  # Queued + running hashes before new logins get 503
+app.config['PASSWORD_HASH_TIMEOUT'] = 10.0    # Seconds a request waits for its hash
+
+
+class HashingOverloadedError(Exception):
+    """Raised when the hashing pool is saturated or a hash does not finish in time."""
+
+
+class HashingExecutor:
+    """
+    Bounded worker pool for the deliberately expensive password hash operations.
+    Work beyond max_pending is rejected immediately instead of queueing, so a
+    login storm cannot tie up the request workers that serve every other route.
+    """
+
+    def __init__(self, workers=4, max_pending=32, timeout=10.0):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hash')
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._stats = {
+            op: {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'queue_wait_ms': 0.0}
+            for op in ('hash', 'verify')
+        }
+        self._rejected = 0
+        self._timed_out = 0
+
+    def run(self, op, fn, *args):
+        """Runs fn(*args) on the pool and returns its result, or raises HashingOverloadedError."""
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self._rejected += 1
+                raise HashingOverloadedError("Password hashing queue is full.")
+            self._pending += 1
+        submitted = time.perf_counter()
+
+        def task():
+            started = time.perf_counter()
+            try:
+                return fn(*args)
+            finally:
+                finished = time.perf_counter()
+                with self._lock:
+                    stats = self._stats[op]
+                    elapsed_ms = (finished - started) * 1000
+                    stats['count'] += 1
+                    stats['total_ms'] += elapsed_ms
+                    stats['max_ms'] = max(stats['max_ms'], elapsed_ms)
+                    stats['queue_wait_ms'] += (started - submitted) * 1000
+
+        def done(_):
+            with self._lock:
+                self._pending -= 1
+
+        future = self._executor.submit(task)
+        future.add_done_callback(done)
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            with self._lock:
+                self._timed_out += 1
+            raise HashingOverloadedError("Password hashing timed out.")
+
+    def stats(self):
+        """Returns per-operation timings plus queue depth and rejection counters."""
+        with self._lock:
+            ops = {op: dict(stats) for op, stats in self._stats.items()}
+            snapshot = {
+                'workers': self.workers, 'max_pending': self.max_pending, 'pending': self._pending,
+                'rejected': self._rejected, 'timed_out': self._timed_out,
+            }
+        for stats in ops.values():
+            count = stats['count']
+            stats['avg_ms'] = round(stats['total_ms'] / count, 3) if count else 0.0
+            stats['avg_queue_wait_ms'] = round(stats['queue_wait_ms'] / count, 3) if count else 0.0
+        snapshot.update(ops)
+        return snapshot
+
+
+password_hasher = HashingExecutor(
+    workers=app.config['PASSWORD_HASH_WORKERS'],
+    max_pending=app.config['PASSWORD_HASH_MAX_PENDING'],
+    timeout=app.config['PASSWORD_HASH_TIMEOUT'],
+)
+
+def hash_password(password):
+    """Hashes a password on the hashing pool with the configured method."""
+    return password_hasher.run('hash', generate_password_hash, password, app.config['PASSWORD_HASH_METHOD'])
+
+def verify_password(stored_hash, password):
+    """Checks a password against its stored hash on the hashing pool."""
+    return password_hasher.run('verify', check_password_hash, stored_hash, password)
+
+def password_needs_rehash(stored_hash):
+    """True if a stored hash was made with parameters other than PASSWORD_HASH_METHOD."""
+    return stored_hash.split('$', 1)[0] != app.config['PASSWORD_HASH_METHOD']
+
+def overloaded_response():
+    """Fast 503 for requests turned away by hashing admission control."""
+    return jsonify({'success': False, 'message': 'Server is busy. Please try again shortly.'}), 503, {'Retry-After': '1'}
+
+# --- Idempotency Keys ---
+app.config['IDEMPOTENCY_TTL'] = 24 * 3600          # Seconds a key's stored response is replayed
+app.config['IDEMPOTENCY_CACHE_MAX_ENTRIES'] = 10000
+app.config['IDEMPOTENCY_WAIT_TIMEOUT'] = 30.0      # Seconds a duplicate waits for the in-flight original
+app.config['IDEMPOTENCY_CLAIM_TIMEOUT'] = 120      # Seconds after which an unfinished claim counts as abandoned
+app.config['IDEMPOTENCY_SWEEP_INTERVAL'] = 600
+IDEMPOTENCY_KEY_MAX_LENGTH = 128
+
+
+class IdempotencyStore:
+    """
+    Remembers the response to each (user, Idempotency-Key) so a retried request
+    gets the original answer instead of running again. A bounded TTL cache answers
+    repeats without touching the database; the idempotency_keys table, whose
+    primary key is the claim, makes that hold across processes and restarts.
+    Duplicates arriving while the original is still running in this process wait
+    for its result.
+    """
+
+    def __init__(self, max_entries=10000, ttl=24 * 3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._responses = OrderedDict()  # key -> (expires_at, fingerprint, status, body)
+        self._inflight = {}  # key -> (threading.Event, fingerprint)
+        self._lock = threading.Lock()
+        self._last_sweep = time.monotonic()
+        self._stats = {'hits': 0, 'db_hits': 0, 'waited': 0, 'executed': 0, 'conflicts': 0}
+
+    def _cached(self, key):
+        entry = self._responses.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            self._responses.pop(key, None)
+            return None
+        self._responses.move_to_end(key)
+        return entry
+
+    def _remember(self, key, fingerprint, status, body):
+        with self._lock:
+            self._responses[key] = (time.monotonic() + self.ttl, fingerprint, status, body)
+            self._responses.move_to_end(key)
+            while len(self._responses) > self.max_entries:
+                self._responses.popitem(last=False)
+
+    def run(self, key, fingerprint, view):
+        """Returns the stored response for `key`, or runs `view` once and stores what it returns."""
+        deadline = time.monotonic() + app.config['IDEMPOTENCY_WAIT_TIMEOUT']
+        while True:
+            with self._lock:
+                entry = self._cached(key)
+                if entry is not None:
+                    self._stats['hits'] += 1
+                    return replay_response(entry[1], entry[2], entry[3], fingerprint)
+                inflight = self._inflight.get(key)
+                if inflight is None:
+                    done = threading.Event()
+                    self._inflight[key] = (done, fingerprint)
+                    break
+                self._stats['waited'] += 1
+            if inflight[1] != fingerprint:
+                return idempotency_error(422, 'Idempotency-Key was already used for a different request.')
+            if not inflight[0].wait(max(deadline - time.monotonic(), 0)):
+                return idempotency_error(409, 'A request with this Idempotency-Key is still in progress.')
+            # Re-check: the original either stored its response or gave the key up (e.g. on a 5xx)
+
+        try:
+            return self._run_claimed(key, fingerprint, view)
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            done.set()
+
+    def _run_claimed(self, key, fingerprint, view):
+        user_id, idempotency_key = key
+        conn = get_db_connection()
+        try:
+            with conn.cursor() as cur:
+                # Claim the key. An existing row is a finished response, another process still
+                # working on it, or a claim left behind by a crashed worker, which we take over:
+                # bookings record their result in their own transaction, so such a claim booked nothing.
+                claim = execute_batch(cur, [
+                    ("""INSERT INTO idempotency_keys (user_id, idem_key, request_hash) VALUES (%s, %s, %s)
+                        ON DUPLICATE KEY UPDATE created_at = IF(
+                            status_code IS NULL AND request_hash = VALUES(request_hash)
+                                AND created_at < NOW() - INTERVAL %s SECOND,
+                            NOW(), created_at)""",
+                     [user_id, idempotency_key, fingerprint, app.config['IDEMPOTENCY_CLAIM_TIMEOUT']]),
+                    ("SELECT request_hash, status_code, response_body FROM idempotency_keys WHERE user_id = %s AND idem_key = %s",
+                     [user_id, idempotency_key]),
+                    ("COMMIT", []),
+                ])
+        except pymysql.MySQLError as e:
+            conn.rollback()
+            print(f"Database error claiming idempotency key: {e}")
+            return idempotency_error(500, 'A database error occurred.')
+        finally:
+            conn.close()
+
+        # 1 = inserted, 2 = took over an abandoned claim, 0 = someone else's row left unchanged
+        if claim[0]['rowcount'] == 0:
+            row = claim[1]['rows'][0]
+            if row['status_code'] is not None:
+                self._stats['db_hits'] += 1
+                self._remember(key, row['request_hash'], row['status_code'], row['response_body'])
+                return replay_response(row['request_hash'], row['status_code'], row['response_body'], fingerprint)
+            self._stats['conflicts'] += 1
+            if row['request_hash'] != fingerprint:
+                return idempotency_error(422, 'Idempotency-Key was already used for a different request.')
+            return idempotency_error(409, 'A request with this Idempotency-Key is still in progress.')
+
+        self._stats['executed'] += 1
+        # Lets the view record its response in the transaction that commits its writes
+        g.idempotency_key = key
+        try:
+            response = app.make_response(view())
+        except Exception:
+            self._store(key, None)
+            raise
+        finally:
+            g.pop('idempotency_key', None)
+        self._store(key, response)
+        if response.status_code < 500:
+            self._remember(key, fingerprint, response.status_code, response.get_data(as_text=True))
+        self.maybe_sweep()
+        return response
+
+    def _store(self, key, response):
+        """Records the response on the claimed row, or drops the claim after a failure so a retry can run."""
+        user_id, idempotency_key = key
+        if response is None or response.status_code >= 500:
+            # Nothing was committed, so a retry should run the request again. A row whose
+            # result was recorded with the writes (see idempotent_result_statements) is kept.
+            statement = ("DELETE FROM idempotency_keys WHERE user_id = %s AND idem_key = %s AND status_code IS NULL",
+                         [user_id, idempotency_key])
+        elif g.pop('idempotent_result_recorded', False):
+            return
+        else:
+            statement = (
+                "UPDATE idempotency_keys SET status_code = %s, response_body = %s WHERE user_id = %s AND idem_key = %s",
+                [response.status_code, response.get_data(as_text=True), user_id, idempotency_key]
+            )
+        conn = get_db_connection()
+        try:
+            with conn.cursor() as cur:
+                execute_batch(cur, [statement, ("COMMIT", [])])
+        except pymysql.MySQLError as e:
+            # The request itself is done; this process's cache still dedupes its retries
+            print(f"Database error storing idempotent response: {e}")
+        finally:
+            conn.close()
+
+    def maybe_sweep(self):
+        """Deletes expired keys in small batches, at most once per IDEMPOTENCY_SWEEP_INTERVAL."""
+        with self._lock:
+            if time.monotonic() - self._last_sweep < app.config['IDEMPOTENCY_SWEEP_INTERVAL']:
+                return
+            self._last_sweep = time.monotonic()
+        conn = get_db_connection()
+        try:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "DELETE FROM idempotency_keys WHERE created_at < NOW() - INTERVAL %s SECOND ORDER BY created_at LIMIT %s",
+                    (self.ttl, app.config['SEAT_HOLD_SWEEP_BATCH'])
+                )
+            conn.commit()
+        except pymysql.MySQLError as e:
+            print(f"Database error sweeping idempotency keys: {e}")
+        finally:
+            conn.close()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, size=len(self._responses), inflight=len(self._inflight), max_entries=self.max_entries)
+
+
+idempotency_store = IdempotencyStore(max_entries=app.config['IDEMPOTENCY_CACHE_MAX_ENTRIES'], ttl=app.config['IDEMPOTENCY_TTL'])
+
+def idempotency_error(status, message):
+    return jsonify({'status': 'error', 'message': message}), status
+
+def replay_response(stored_fingerprint, status, body, fingerprint):
+    """Rebuilds a stored response, refusing keys reused with a different request body."""
+    if stored_fingerprint != fingerprint:
+        return idempotency_error(422, 'Idempotency-Key was already used for a different request.')
+    response = app.response_class(body, status=status, mimetype='application/json')
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+INSERTED_ID_PLACEHOLDER = re.compile(r'"@@inserted_id:(\d+)@@"')
+
+def inserted_booking_id(n):
+    """Stands in, in a payload for idempotent_result_statements, for the id of row `n` of the last multi-row INSERT."""
+    return f"@@inserted_id:{n}@@"
+
+def idempotent_result_statements(payload, status=200):
+    """
+    Builds the statement recording `payload` as the response to the request's
+    claimed Idempotency-Key, to send in the batch that commits the writes it
+    reports. Recorded in that transaction, the result survives a worker dying
+    right after the commit, and a retry replays it instead of taking over the
+    claim and booking again. Ids from inserted_booking_id() are filled in from
+    LAST_INSERT_ID(). Returns [] when the request has no claimed key.
+    """
+    key = g.get('idempotency_key')
+    if key is None:
+        return []
+    # The JSON split around the placeholders: literal text at even positions, row numbers at odd ones
+    parts = INSERTED_ID_PLACEHOLDER.split(json.dumps(payload))
+    body = ', '.join('%s' if i % 2 == 0 else f"LAST_INSERT_ID() + {int(part)} * @@SESSION.auto_increment_increment"
+                     for i, part in enumerate(parts))
+    g.idempotent_result_recorded = True
+    return [(
+        f"UPDATE idempotency_keys SET status_code = %s, response_body = CONCAT({body}) WHERE user_id = %s AND idem_key = %s",
+        [status] + parts[0::2] + list(key)
+    )]
+
+def idempotent(view):
+    """
+    Makes a JSON POST endpoint honour the Idempotency-Key header: the first request
+    with a key runs, and repeats of it get the same response without running again.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get('Idempotency-Key')
+        if not key or 'user_id' not in session:
+            return view(*args, **kwargs)
+        if len(key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+            return idempotency_error(400, f'Idempotency-Key must be at most {IDEMPOTENCY_KEY_MAX_LENGTH} characters.')
+        fingerprint = hashlib.sha256(request.path.encode() + b'\0' + request.get_data()).hexdigest()
+        return idempotency_store.run((session['user_id'], key), fingerprint, lambda: view(*args, **kwargs))
+    return wrapper
 
 # --- Main & Static Routes ---
 
 @app.route('/')
+@cached_page
 def home():
     """Renders the homepage."""
     return render_template('home.html')
 
 @app.route('/about')
+@cached_page
 def about():
     """Renders the About Us page."""
     return render_template('about.html')
 
 @app.route('/contact')
+@cached_page
 def contact():
     """Renders the Contact Us page."""
     return render_template('contactus.html')
@@ -50,11 +2787,13 @@ def contact():
 # --- Authentication Routes ---
 
 @app.route('/login_page')
+@cached_page
 def login_page():
     """Serves the login page."""
     return render_template('login.html')
 
 @app.route('/register_page')
+@cached_page
 def register_page():
     """Serves the registration page."""
     return render_template('registration.html')
@@ -67,6 +2806,12 @@ def register():
     
     if not all([name, email, password]):
         return jsonify({'success': False, 'message': 'Missing required fields.'}), 400
+
+    # Hash before checking out a connection so none is held while the hash runs
+    try:
+        hashed_password = hash_password(password)
+    except HashingOverloadedError:
+        return overloaded_response()
     
     conn = get_db_connection()
     try:
@@ -77,7 +2822,6 @@ def register():
                 return jsonify({'success': False, 'message': 'An account with this email already exists.'}), 409
             
             # Insert new user into the database
-            hashed_password = generate_password_hash(password)
             cur.execute("INSERT INTO users (name, email, password) VALUES (%s, %s, %s)", (name, email, hashed_password))
         conn.commit()
         return jsonify({'success': True, 'message': 'Account created successfully! Please log in.'})
@@ -113,8 +2857,25 @@ def login():
     if not user:
         return jsonify({'success': False, 'message': 'Email not found.'}), 401
 
-    if not check_password_hash(user['password'], password):
-        return jsonify({'success': False, 'message': 'Incorrect password.'}), 401
+    try:
+        if not verify_password(user['password'], password):
+            return jsonify({'success': False, 'message': 'Incorrect password.'}), 401
+    except HashingOverloadedError:
+        return overloaded_response()
+
+    if password_needs_rehash(user['password']):
+        # Transparently upgrade the stored hash to the current parameters; login succeeds regardless
+        try:
+            new_hash = hash_password(password)
+            conn = get_db_connection()
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("UPDATE users SET password = %s WHERE id = %s", (new_hash, user['id']))
+                conn.commit()
+            finally:
+                conn.close()
+        except (HashingOverloadedError, pymysql.MySQLError) as e:
+            print(f"Password rehash skipped for user {user['id']}: {e}")
 
     session['user_email'] = user['email']
     session['user_name'] = user['name']
@@ -138,88 +2899,172 @@ def check_session():
 
 @app.route('/dashboard')
 def dashboard():
+    """Shows the user's bookings, newest first, one keyset-paginated page at a time."""
     if 'user_id' not in session:
         return redirect(url_for('login_page'))
  
     user_id = session['user_id']
+    # Cursor: the (booking_date, id) of the last booking on the previous page
+    after_date = request.args.get('after_date')
+    after_id = request.args.get('after_id', type=int)
+    page_size = min(max(request.args.get('page_size', app.config['DASHBOARD_PAGE_SIZE'], type=int), 1),
+                    app.config['SEARCH_MAX_PAGE_SIZE'])
+
+    # The generation only moves in this process; the session's last-write stamp (set by
+    # mark_session_write on whichever worker took the booking) misses pages cached elsewhere
+    cache_key = (user_id, _dashboard_generations.get(user_id, 0), session.get('primary_reads_until'),
+                 after_date, after_id, page_size)
+    bookings = dashboard_cache.get('dashboard', cache_key)
+    if bookings is not None:
+        return render_template('userdashboard.html', bookings=bookings, page_size=page_size)
+
     bookings = []
     
-    conn = get_db_connection()
+    conn = get_db_connection(read_only=True)
     try:
         with conn.cursor() as cur:
-            # Fetch all bookings for the user from a single table
-            cur.execute(""" 
-                SELECT id, service_type, details, total_price, booking_date 
-                FROM bookings 
-                WHERE user_id = %s 
-                ORDER BY booking_date DESC
-            """, (user_id,))
+            # Fetch one page of the user's bookings from a single table
+            query = "SELECT id, service_type, details, total_price, booking_date FROM bookings WHERE user_id = %s"
+            params = [user_id]
+            query = add_keyset_filter(query, params, 'booking_date', after_date, after_id, descending=True)
+            query += " ORDER BY booking_date DESC, id DESC LIMIT %s"
+            params.append(page_size)
+            cur.execute(query, params)
             bookings_raw = cur.fetchall()
             for booking in bookings_raw:
-                booking['details'] = json.loads(booking['details'])
+                booking['details'] = decode_booking_details(booking['details'])
                 bookings.append(booking)
+        dashboard_cache.set('dashboard', cache_key, bookings)
     except pymysql.MySQLError as e:
         print(f"Database error in dashboard: {e}")
         # Render the page with empty lists in case of an unexpected DB error
-        return render_template('userdashboard.html', bookings=[])
+        return render_template('userdashboard.html', bookings=[], page_size=page_size)
     finally:
         conn.close()
 
-    return render_template('userdashboard.html', bookings=bookings)
+    return render_template('userdashboard.html', bookings=bookings, page_size=page_size)
 
 # --- Search Pages ---
 @app.route('/bus_search', methods=['GET', 'POST'])
 def bus_search():
-    """Displays the bus search page and handles search."""
+    """Displays the bus search page and handles search, one keyset-paginated page at a time."""
     if 'user_email' not in session:
         return redirect(url_for('login_page'))
     
     today_date = date.today().isoformat()
 
+    # On POST request (clicking search), show all buses irrespective of date; on GET, today's buses.
+    # Follow-up pages are GETs carrying all=1 and the (travel_date, id) of the last row shown.
+    show_all = request.method == 'POST' or request.args.get('all') == '1'
+    after_date = request.args.get('after_date')
+    after_id = request.args.get('after_id', type=int)
+    page_size = get_page_size()
+    min_seats = get_min_seats()
+    context = {'today_date': today_date, 'show_all': show_all, 'page_size': page_size, 'min_seats': min_seats}
+
+    query = f"SELECT {BUS_SEARCH_COLUMNS}, a.seats_left FROM services {availability_join('bus')} WHERE 1=1"
+    params = []
+    if not show_all:
+        query += " AND travel_date = %s"
+        params.append(today_date)
+    query = add_min_seats_filter(query, params, min_seats)
+    query = add_keyset_filter(query, params, 'travel_date', after_date, after_id)
+    query += " ORDER BY travel_date, id LIMIT %s"
+    params.append(page_size)
+
+    if page_size >= app.config['SEARCH_STREAM_THRESHOLD']:
+        return stream_template('bussearch.html', services=stream_rows(query, params), **context)
+
+    # The posted travel_date is baked into the rendered "Book Now" links, so it is part of the key
+    cache_key = normalize_search_params(request.method, 'all' if show_all else today_date, after_date, after_id, page_size,
+                                        request.form.get('travel_date'), min_seats)
+    results_html = fragment_cache.get('bus', cache_key)
+    if results_html is not None:
+        return render_template('bussearch.html', results_html=results_html, **context)
+
+    services = search_cache.get('bus', cache_key)
+    if services is not None:
+        return render_search_page('bussearch.html', 'bus_results.html', 'bus', cache_key, services=services, **context)
+
     services = []
-    conn = get_db_connection()
+    loaded = False
+    conn = get_db_connection(read_only=True)
     try:
         with conn.cursor() as cur:
-            if request.method == 'POST':
-                # On POST request (clicking search), show all buses irrespective of date
-                query = "SELECT * FROM services"
-                cur.execute(query)
-                services = cur.fetchall()
-            else:
-                # On GET request, show all buses for today
-                cur.execute("SELECT * FROM services WHERE travel_date = %s", (today_date,))
-                services = cur.fetchall()
+            cur.execute(query, params)
+            services = cur.fetchall()
+        search_cache.set('bus', cache_key, services)
+        loaded = True
     except pymysql.MySQLError as e:
         print(f"Database error in bus_search: {e}")
     finally:
         conn.close()
 
-    return render_template('bussearch.html', services=services, today_date=today_date)
+    if loaded:
+        return render_search_page('bussearch.html', 'bus_results.html', 'bus', cache_key, services=services, **context)
+    return render_template('bussearch.html', services=services, **context)
 
 
 @app.route('/search_hotels', methods=['GET'])
 def search_hotels():
+    """Hotel search with price and rating ranges, sorting and keyset pagination, answered from the hotel catalog."""
     if 'user_id' not in session:
         return redirect(url_for('login_page'))
 
+    hotel_catalog.ensure_fresh()
+    has_rating = hotel_catalog.has_rating
     location = request.args.get('location')
-    conn = get_db_connection()
+    sort = request.args.get('sort')
+    if sort not in HOTEL_SORTS or (sort == 'rating' and not has_rating):
+        sort = 'price'
+    price_range = (get_decimal_arg('min_price'), get_decimal_arg('max_price'))
+    rating_range = (get_decimal_arg('min_rating'), get_decimal_arg('max_rating')) if has_rating else (None, None)
+    # Cursor: the sort value and id of the last hotel on the previous page
+    after_value = get_decimal_arg('after_value', minimum=HOTEL_NO_RATING)
+    after_id = request.args.get('after_id', type=int)
+    page_size = get_page_size()
+    context = {'page_size': page_size, 'sort': sort, 'sort_column': HOTEL_SORTS[sort][0], 'has_rating': has_rating,
+               'no_rating': HOTEL_NO_RATING}
+
+    cache_key = normalize_search_params(location, sort, *price_range, *rating_range, after_value, after_id, page_size)
+    if page_size < app.config['SEARCH_STREAM_THRESHOLD']:
+        results_html = fragment_cache.get('hotel', cache_key)
+        if results_html is not None:
+            return render_template('hotelsearch.html', results_html=results_html, **context)
+
+    hotels = hotel_catalog.search(location, price_range, rating_range, sort, after_value, after_id, page_size)
+    if hotels is not None:
+        if page_size >= app.config['SEARCH_STREAM_THRESHOLD']:
+            return stream_template('hotelsearch.html', hotels=hotels, **context)
+        return render_search_page('hotelsearch.html', 'hotel_results.html', 'hotel', cache_key, hotels=hotels, **context)
+
+    # The catalog could not be loaded: run the same search against the table
+    query, params = hotel_search_query(location, price_range, rating_range, sort, after_value, after_id, page_size,
+                                       has_rating)
+    if page_size >= app.config['SEARCH_STREAM_THRESHOLD']:
+        return stream_template('hotelsearch.html', hotels=stream_rows(query, params), **context)
+
+    hotels = search_cache.get('hotel', cache_key)
+    if hotels is not None:
+        return render_search_page('hotelsearch.html', 'hotel_results.html', 'hotel', cache_key, hotels=hotels, **context)
+
+    loaded = False
+    conn = get_db_connection(read_only=True)
     try:
         with conn.cursor() as cursor:
-            if location:
-                # Use a LIKE query to allow for partial matches
-                cursor.execute("SELECT * FROM hotels WHERE location LIKE %s", (f"%{location}%",))
-            else:
-                # If no location is specified, show all hotels
-                cursor.execute("SELECT * FROM hotels")
+            cursor.execute(query, params)
             hotels = cursor.fetchall()
+        search_cache.set('hotel', cache_key, hotels)
+        loaded = True
     except pymysql.MySQLError as e:
         print(f"Database error in search_hotels: {e}")
         hotels = []
     finally:
         conn.close()
 
-    return render_template('hotelsearch.html', hotels=hotels)
+    if loaded:
+        return render_search_page('hotelsearch.html', 'hotel_results.html', 'hotel', cache_key, hotels=hotels, **context)
+    return render_template('hotelsearch.html', hotels=hotels, **context)
 
 
 @app.route('/book_hotel/<int:hotel_id>', methods=['GET'])
@@ -231,7 +3076,7 @@ def book_hotel(hotel_id):
     # Use today's date as a default check-in date
     checkin_date = date.today().isoformat()
 
-    conn = get_db_connection()
+    conn = get_db_connection(read_only=True)
     try:
         with conn.cursor() as cur:
             cur.execute("SELECT * FROM hotels WHERE id = %s", (hotel_id,))
@@ -252,23 +3097,30 @@ def select_seats(service_id):
 
     travel_date = request.args.get('travel_date')
 
-    conn = get_db_connection()
+    # A cached seat map is shared by every viewer and only kept current by mark(),
+    # so a miss is read from the primary: replica rows could undo fresh bookings
+    seat_map = seat_maps.peek('bus', service_id)
+    conn = get_db_connection(read_only=seat_map is not None)
     try:
         with conn.cursor() as cur:
-            # Get service details
-            cur.execute("SELECT * FROM services WHERE id = %s", (service_id,))
-            service = cur.fetchone()
-
-            # Get seat availability
-            cur.execute("SELECT seat_number, is_booked FROM bus_seats WHERE service_id = %s ORDER BY id", (service_id,))
-            seats = cur.fetchall()
+            # Get bus details, plus the seats in the same round trip unless the seat map is cached
+            statements = [("SELECT * FROM services WHERE id = %s", [service_id])]
+            if seat_map is None:
+                statements.append(seat_maps.load_statement('bus', service_id))
+            results = execute_batch(cur, statements)
+            service = results[0]['rows'][0] if results[0]['rows'] else None
+            if service and seat_map is None:
+                seat_map = seat_maps.store('bus', service_id, results[1]['rows'])
     finally:
         conn.close()
 
     if not service:
         return "Service not found", 404
 
-    return render_template('seat_selection.html', service=service, seats=seats, travel_date=travel_date)
+    seats = seat_map.as_rows() if seat_map else []
+
+    return render_template('seat_selection.html', service=service, seats=seats, travel_date=travel_date,
+                           live_seats=seat_streams_enabled(), seat_poll_interval=app.config['SEAT_POLL_INTERVAL'])
 
 @app.route('/train_search', methods=['GET', 'POST'])
 def train_search():
@@ -277,36 +3129,63 @@ def train_search():
         return redirect(url_for('login_page'))
     
     trains = []
+    page_size = get_page_size()
+    min_seats = get_min_seats()
     if request.method == 'POST':
         from_city = request.form.get('from_city')
         to_city = request.form.get('to_city')
         travel_date = request.form.get('travel_date')
-        
-        conn = get_db_connection()
+        # Keyset cursor posted back by the "Next page" form
+        after_date = request.form.get('after_date')
+        after_id = request.form.get('after_id', type=int)
+
+        cache_key = normalize_search_params(from_city, to_city, travel_date, after_date, after_id, page_size, min_seats)
+        results_html = fragment_cache.get('train', cache_key)
+        if results_html is not None:
+            return render_template('train_search.html', results_html=results_html, page_size=page_size, min_seats=min_seats)
+
+        trains = search_cache.get('train', cache_key)
+        if trains is not None:
+            return render_search_page('train_search.html', 'train_results.html', 'train', cache_key,
+                                      trains=trains, page_size=page_size, min_seats=min_seats, **fare_context('train', trains),
+                                      **connection_context(trains, from_city, to_city, travel_date, after_id is None))
+
+        trains = []
+        loaded = False
+        conn = get_db_connection(read_only=True)
         try:
             with conn.cursor() as cur:
                 # Build query with optional filters
-                query = "SELECT * FROM trains WHERE 1=1"
+                query = f"SELECT {TRAIN_SEARCH_COLUMNS}, a.seats_left FROM trains {availability_join('train')} WHERE 1=1"
                 params = []
                 if from_city:
-                    query += " AND origin LIKE %s"
-                    params.append(f"%{from_city}%")
+                    query = add_location_filter(query, params, 'origin', 'train_city', from_city)
                 if to_city:
-                    query += " AND destination LIKE %s"
-                    params.append(f"%{to_city}%")
+                    query = add_location_filter(query, params, 'destination', 'train_city', to_city)
                 if travel_date:
                     query += " AND travel_date = %s"
                     params.append(travel_date)
+                query = add_min_seats_filter(query, params, min_seats)
+                query = add_keyset_filter(query, params, 'travel_date', after_date, after_id)
+                query += " ORDER BY travel_date, id LIMIT %s"
+                params.append(page_size)
                 
                 cur.execute(query, params)
                 trains = cur.fetchall()
+            search_cache.set('train', cache_key, trains)
+            loaded = True
         except pymysql.MySQLError as e:
             print(f"Database error in train_search: {e}")
             # In case of error, trains remains an empty list
         finally:
             conn.close()
 
-    return render_template('train_search.html', trains=trains)
+        if loaded:
+            return render_search_page('train_search.html', 'train_results.html', 'train', cache_key,
+                                      trains=trains, page_size=page_size, min_seats=min_seats, **fare_context('train', trains),
+                                      **connection_context(trains, from_city, to_city, travel_date, after_id is None))
+
+    return render_template('train_search.html', trains=trains, page_size=page_size, min_seats=min_seats)
 
 @app.route('/book_train/<int:train_id>')
 def book_train(train_id):
@@ -316,7 +3195,7 @@ def book_train(train_id):
 
     travel_date = request.args.get('travel_date') # Correctly get the date parameter
 
-    conn = get_db_connection()
+    conn = get_db_connection(read_only=True)
     try:
         with conn.cursor() as cur:
             cur.execute("SELECT * FROM trains WHERE id = %s", (train_id,))
@@ -327,7 +3206,11 @@ def book_train(train_id):
     if not train:
         return "Train not found", 404
 
-    return render_template('train_booking.html', train=train, travel_date=travel_date)
+    # Prices for every class and ticket count come from the same engine create_booking charges with
+    quantities = range(1, app.config['FARE_MAX_QUANTITY'] + 1)
+    fares = {name: [str(total) for total in totals]
+             for name, totals in fare_engine.price_table('train', [train], quantities)[train['id']].items()}
+    return render_template('train_booking.html', train=train, travel_date=travel_date, fares=fares)
 
 @app.route('/flight_search', methods=['GET', 'POST'])
 def flight_search():
@@ -336,35 +3219,62 @@ def flight_search():
         return redirect(url_for('login_page'))
 
     flights = []
+    page_size = get_page_size()
+    min_seats = get_min_seats()
     if request.method == 'POST':
         from_airport = request.form.get('from_airport')
         to_airport = request.form.get('to_airport')
         departure_date = request.form.get('departure_date')
+        # Keyset cursor posted back by the "Next page" form
+        after_date = request.form.get('after_date')
+        after_id = request.form.get('after_id', type=int)
 
-        conn = get_db_connection()
+        cache_key = normalize_search_params(from_airport, to_airport, departure_date, after_date, after_id, page_size, min_seats)
+        results_html = fragment_cache.get('flight', cache_key)
+        if results_html is not None:
+            return render_template('flight_search.html', results_html=results_html, page_size=page_size, min_seats=min_seats)
+
+        flights = search_cache.get('flight', cache_key)
+        if flights is not None:
+            return render_search_page('flight_search.html', 'flight_results.html', 'flight', cache_key,
+                                      flights=flights, page_size=page_size, min_seats=min_seats, **fare_context('flight', flights),
+                                      **connection_context(flights, from_airport, to_airport, departure_date, after_id is None))
+
+        flights = []
+        loaded = False
+        conn = get_db_connection(read_only=True)
         try:
             with conn.cursor() as cur:
-                query = "SELECT * FROM flights WHERE 1=1"
+                query = f"SELECT {FLIGHT_SEARCH_COLUMNS}, a.seats_left FROM flights {availability_join('flight')} WHERE 1=1"
                 params = []
                 if from_airport:
-                    query += " AND origin LIKE %s"
-                    params.append(f"%{from_airport}%")
+                    query = add_location_filter(query, params, 'origin', 'airport', from_airport)
                 if to_airport:
-                    query += " AND destination LIKE %s"
-                    params.append(f"%{to_airport}%")
+                    query = add_location_filter(query, params, 'destination', 'airport', to_airport)
                 # Assuming you add a 'departure_date' column of type DATE to your 'flights' table
                 if departure_date:
                     query += " AND departure_date = %s"
                     params.append(departure_date)
+                query = add_min_seats_filter(query, params, min_seats)
+                query = add_keyset_filter(query, params, 'departure_date', after_date, after_id)
+                query += " ORDER BY departure_date, id LIMIT %s"
+                params.append(page_size)
 
                 cur.execute(query, params)
                 flights = cur.fetchall()
+            search_cache.set('flight', cache_key, flights)
+            loaded = True
         except pymysql.MySQLError as e:
             print(f"Database error in flight_search: {e}")
         finally:
             conn.close()
 
-    return render_template('flight_search.html', flights=flights)
+        if loaded:
+            return render_search_page('flight_search.html', 'flight_results.html', 'flight', cache_key,
+                                      flights=flights, page_size=page_size, min_seats=min_seats, **fare_context('flight', flights),
+                                      **connection_context(flights, from_airport, to_airport, departure_date, after_id is None))
+
+    return render_template('flight_search.html', flights=flights, page_size=page_size, min_seats=min_seats)
 
 @app.route('/select_flight_seats/<int:flight_id>')
 def select_flight_seats(flight_id):
@@ -374,27 +3284,127 @@ def select_flight_seats(flight_id):
 
     travel_date = request.args.get('departure_date')
 
-    conn = get_db_connection()
+    # A cached seat map is shared by every viewer and only kept current by mark(),
+    # so a miss is read from the primary: replica rows could undo fresh bookings
+    seat_map = seat_maps.peek('flight', flight_id)
+    conn = get_db_connection(read_only=seat_map is not None)
     try:
         with conn.cursor() as cur:
-            # Get flight details
-            cur.execute("SELECT * FROM flights WHERE id = %s", (flight_id,))
-            flight = cur.fetchone()
-
-            # Get seat availability for the flight
-            cur.execute("SELECT seat_number, is_booked FROM flight_seats WHERE flight_id = %s ORDER BY id", (flight_id,))
-            seats = cur.fetchall()
+            # Get flight details, plus the seats in the same round trip unless the seat map is cached
+            statements = [("SELECT * FROM flights WHERE id = %s", [flight_id])]
+            if seat_map is None:
+                statements.append(seat_maps.load_statement('flight', flight_id))
+            results = execute_batch(cur, statements)
+            flight = results[0]['rows'][0] if results[0]['rows'] else None
+            if flight and seat_map is None:
+                seat_map = seat_maps.store('flight', flight_id, results[1]['rows'])
     finally:
         conn.close()
 
     if not flight:
         return "Flight not found", 404
 
-    return render_template('flight_seat_selection.html', flight=flight, seats=seats, travel_date=travel_date)
+    seats = seat_map.as_rows() if seat_map else []
+
+    return render_template('flight_seat_selection.html', flight=flight, seats=seats, travel_date=travel_date,
+                           live_seats=seat_streams_enabled(), seat_poll_interval=app.config['SEAT_POLL_INTERVAL'])
 
 
 # --- Booking Process ---
+app.config['BATCH_BOOKING_MAX_ITEMS'] = 100
+
+# Columns read for each service type when pricing bookings, one id or many
+BATCH_SERVICE_QUERIES = {
+    'bus': "SELECT id, name, from_city, to_city, price FROM services WHERE id IN ({})",
+    'train': "SELECT id, name, origin, destination, price FROM trains WHERE id IN ({})",
+    'flight': "SELECT id, airline, number, origin, destination, price FROM flights WHERE id IN ({})",
+    'hotel': "SELECT id, name, location, price_per_night FROM hotels WHERE id IN ({})",
+}
+
+def validate_booking_item(item):
+    """
+    Checks one booking request (or one item of a batch) and returns it normalized as
+    {'type', 'service_id', 'seats', 'quantity', 'class', 'date'}. Raises ValueError.
+    """
+    if not isinstance(item, dict):
+        raise ValueError("Item must be an object")
+    service_type = item.get('type')
+    if service_type not in BATCH_SERVICE_QUERIES:
+        raise ValueError(f"Unknown service type: {service_type}")
+    try:
+        service_id = int(item.get('service_id'))
+    except (TypeError, ValueError):
+        raise ValueError("Missing or invalid service ID")
+
+    normalized = {'type': service_type, 'service_id': service_id, 'seats': [], 'quantity': 1,
+                  'class': fare_engine.default_class(service_type), 'date': item.get('date') or None}
+    if service_type in SEAT_TABLES:
+        normalized['seats'] = parse_seat_list(item.get('seats'))
+        if not normalized['seats']:
+            raise ValueError(f"Missing {service_type} seats")
+        normalized['quantity'] = len(normalized['seats'])
+    elif service_type == 'train':
+        try:
+            normalized['quantity'] = int(item.get('quantity', 1))
+        except (TypeError, ValueError):
+            raise ValueError("Invalid quantity")
+        if not 1 <= normalized['quantity'] <= app.config['FARE_MAX_QUANTITY']:
+            raise ValueError(f"Quantity must be between 1 and {app.config['FARE_MAX_QUANTITY']}")
+        normalized['class'] = item.get('class') or normalized['class']
+        if normalized['class'] not in fare_engine.class_names(service_type):
+            raise ValueError(f"Unknown travel class: {normalized['class']}")
+    return normalized
+
+def price_booking_item(item, service_info):
+    """Returns (details, total_price) for a validated item, priced by the fare engine."""
+    travel_date = item['date'] or 'N/A'
+    service_type = item['type']
+    total_price = fare_engine.quote(service_type, service_info[FARE_PRICE_COLUMNS[service_type]], item['class'], item['quantity'])
+    if service_type == 'bus':
+        details = {"name": service_info['name'], "from": service_info['from_city'], "to": service_info['to_city'],
+                   "seats": ", ".join(item['seats']), "date": travel_date}
+    elif service_type == 'train':
+        details = {"name": service_info['name'], "details": f"{item['quantity']} ticket(s) in {item['class']}",
+                   "quantity": item['quantity'], "from": service_info['origin'], "to": service_info['destination'], "date": travel_date}
+    elif service_type == 'flight':
+        details = {"name": f"{service_info['airline']} {service_info['number']}", "from": service_info['origin'],
+                   "to": service_info['destination'], "seats": ", ".join(item['seats']), "date": travel_date}
+    else:
+        # Using 'from' for location consistency
+        details = {"name": service_info['name'], "from": service_info['location'], "to": "N/A",
+                   "details": "1 Night Stay", "date": travel_date}
+    return details, total_price
+
+def claim_statements(service_type, service_id, seats, quantity, user_id):
+    """
+    Builds the statements that take a booking's seats: the seat rows are taken
+    (failing if any was taken or is held by someone else), then the counter is
+    moved by an update that is the only statement touching it, so concurrent
+    bookings queue on its exclusive lock rather than deadlock. Hotels claim nothing.
+    """
+    if service_type in SEAT_TABLES:
+        return [
+            confirm_seats_statement(service_type, service_id, seats, user_id),
+            release_holds_statement(service_type, service_id, seats, user_id),
+            adjust_availability_statement(service_type, service_id, -len(seats)),
+        ]
+    if service_type in AVAILABILITY_SOURCES:
+        # Trains have no seat rows, so the counter itself is what runs out
+        return [claim_availability_statement(service_type, service_id, quantity)]
+    return []
+
+def check_claim(cur, service_type, service_id, seats, user_id, results):
+    """
+    Raises SeatUnavailableError, SoldOutError or MissingCounterError if the `results`
+    of a claim_statements batch fell short. The counter update is always the last one.
+    """
+    if service_type in SEAT_TABLES:
+        check_confirmed_seats(cur, service_type, service_id, seats, user_id, results[0]['rowcount'])
+    check_claimed_availability(cur, service_type, service_id, results[-1]['rowcount'],
+                               conditional=service_type not in SEAT_TABLES)
+
 @app.route('/create_booking', methods=['POST'])
+@idempotent
 def create_booking():
     """
     A unified API endpoint to create bookings for any service type.
@@ -404,117 +3414,59 @@ def create_booking():
         return jsonify({'status': 'error', 'message': 'User not logged in'}), 401
 
     data = request.get_json()
-    service_type = data.get('type')
-    service_id = data.get('service_id')
     user_id = session['user_id']
 
     conn = get_db_connection()
     try:
         with conn.cursor() as cur:
-            # --- Start Transaction ---
-            conn.begin()
-
-            details = {}
-            total_price = 0
-            travel_date = data.get('date') if data.get('date') else None
-
-            if service_type == 'bus':
-                selected_seats = data.get('seats', '').split(',')
-                if not selected_seats or not service_id:
-                    raise ValueError("Missing bus service ID or seats")
-
-                # Lock seats and create booking
-                cur.execute("SELECT name, from_city, to_city, price FROM services WHERE id = %s", (service_id,))
-                service_info = cur.fetchone()
-                total_price = len(selected_seats) * service_info['price']
-
-                details = {
-                    "name": service_info['name'],
-                    "from": service_info['from_city'],
-                    "to": service_info['to_city'],
-                    "seats": ", ".join(selected_seats),
-                    "date": travel_date or 'N/A'
-                }
-
-                # Mark seats as booked
-                placeholders = ','.join(['%s'] * len(selected_seats))
-                sql = f"UPDATE bus_seats SET is_booked = 1, user_id = %s WHERE service_id = %s AND seat_number IN ({placeholders})"
-                params = [user_id, service_id] + selected_seats
-                cur.execute(sql, params)
-
-            elif service_type == 'train':
-                quantity = int(data.get('quantity', 1))
-                travel_class = data.get('class', 'Sleeper')
-
-                # Fetch service details to store in the booking
-                cur.execute("SELECT * FROM trains WHERE id = %s", (service_id,))
-                service_info = cur.fetchone()
-                if not service_info:
+            item = validate_booking_item(data)
+            service_type, service_id, selected_seats = item['type'], item['service_id'], item['seats']
+
+            # The transaction starts implicitly with the first batch, which claims the seats
+            # and reads the service's details and base price. The fare engine then prices the
+            # booking, and the insert goes out together with the commit: two round trips.
+            statements = claim_statements(service_type, service_id, selected_seats, item['quantity'], user_id)
+            claimed = len(statements)
+            statements.append((BATCH_SERVICE_QUERIES[service_type].format('%s'), [service_id]))
+            for attempt in range(2):
+                results = execute_batch(cur, statements)
+                service_info = results[-1]['rows'][0] if results[-1]['rows'] else None
+                if service_info is None:
                     raise ValueError(f"{service_type} not found.")
-                
-                # Calculate price based on class multiplier
-                price_multiplier = {'Sleeper': 1.0, 'AC Chair': 1.5, 'First Class': 2.5}.get(travel_class, 1.0)
-                total_price = float(service_info['price']) * price_multiplier * quantity
-
-                details = {
-                    "name": service_info.get('name'),
-                    "details": f"{quantity} ticket(s) in {travel_class}",
-                    "from": service_info['origin'],
-                    "to": service_info['destination'],
-                    "date": travel_date or 'N/A'
-                }
-            
-            elif service_type == 'flight':
-                selected_seats = data.get('seats', '').split(',')
-                if not selected_seats or not service_id:
-                    raise ValueError("Missing flight service ID or seats")
-
-                cur.execute("SELECT airline, number, origin, destination, price FROM flights WHERE id = %s", (service_id,))
-                service_info = cur.fetchone()
-                total_price = len(selected_seats) * float(service_info['price'])
-
-                details = {
-                    "name": f"{service_info['airline']} {service_info['number']}",
-                    "from": service_info['origin'],
-                    "to": service_info['destination'],
-                    "seats": ", ".join(selected_seats),
-                    "date": travel_date or 'N/A'
-                }
-
-                # Mark seats as booked for the flight
-                placeholders = ','.join(['%s'] * len(selected_seats))
-                sql = f"UPDATE flight_seats SET is_booked = 1, user_id = %s WHERE flight_id = %s AND seat_number IN ({placeholders})"
-                params = [user_id, service_id] + selected_seats
-                cur.execute(sql, params)
-            
-            elif service_type == 'hotel':
-                # Fetch hotel details for the booking record
-                cur.execute("SELECT * FROM hotels WHERE id = %s", (service_id,))
-                service_info = cur.fetchone()
-                if not service_info:
-                    raise ValueError("Hotel not found.")
-                
-                total_price = service_info['price_per_night']
-                details = {
-                    "name": service_info['name'],
-                    "from": service_info['location'], # Using 'from' for location consistency
-                    "to": "N/A",
-                    "details": "1 Night Stay",
-                    "date": travel_date or 'N/A'
-                }
+                try:
+                    if claimed:
+                        check_claim(cur, service_type, service_id, selected_seats, user_id, results[:claimed])
+                    break
+                except MissingCounterError:
+                    if attempt:
+                        raise
+                    # Rare (services added outside the app): create it outside this transaction and claim again
+                    conn.rollback()
+                    create_availability_counter(conn, service_type, service_id)
 
-            
-            # Insert into the unified bookings table
-            cur.execute(
-                "INSERT INTO bookings (user_id, service_type, service_id, details, total_price) VALUES (%s, %s, %s, %s, %s)",
-                (user_id, service_type, service_id, json.dumps(details), total_price)
-            )
-            booking_id = cur.lastrowid
-            
-            # --- Commit Transaction ---
-            conn.commit()
-            return jsonify({'status': 'success', 'booking_id': booking_id})
+            details, total_price = price_booking_item(item, service_info)
+            results = execute_batch(cur, [
+                ("INSERT INTO bookings (user_id, service_type, service_id, details, total_price) VALUES (%s, %s, %s, %s, %s)",
+                 [user_id, service_type, service_id, json.dumps(details), total_price]),
+                *idempotent_result_statements({'status': 'success', 'booking_id': inserted_booking_id(0),
+                                               'total_price': float(total_price)}),
+                ("COMMIT", []),
+            ])
+            booking_id = results[0]['lastrowid']
+
+            invalidate_search_results(service_type)
+            invalidate_dashboard(user_id)
+            mark_session_write()
+            if selected_seats:
+                seats_changed(service_type, service_id, selected_seats)
+            return jsonify({'status': 'success', 'booking_id': booking_id, 'total_price': float(total_price)})
 
+    except SeatUnavailableError as e:
+        conn.rollback()
+        return jsonify({'status': 'error', 'message': f'Failed to create booking: {e}', 'unavailable': e.seats}), 409
+    except SoldOutError as e:
+        conn.rollback()
+        return jsonify({'status': 'error', 'message': f'Failed to create booking: {e}', 'seats_left': e.seats_left}), 409
     except (pymysql.MySQLError, ValueError) as e:
         conn.rollback()
         print(f"Error during booking creation: {e}")
@@ -522,17 +3474,175 @@ def create_booking():
     finally:
         conn.close()
 
+@app.route('/api/create_bookings', methods=['POST'])
+@idempotent
+def create_bookings():
+    """
+    Books a list of bus, train, flight and hotel items in one transaction, all or nothing.
+    Expects {"items": [{"type", "service_id", "seats"|"quantity"+"class", "date"}, ...]}
+    and answers with one result per item, in order.
+    """
+    if 'user_id' not in session:
+        return jsonify({'status': 'error', 'message': 'User not logged in'}), 401
+
+    data = request.get_json(silent=True) or {}
+    raw_items = data.get('items')
+    max_items = app.config['BATCH_BOOKING_MAX_ITEMS']
+    if not isinstance(raw_items, list) or not raw_items:
+        return jsonify({'status': 'error', 'message': 'Provide a non-empty list of items.'}), 400
+    if len(raw_items) > max_items:
+        return jsonify({'status': 'error', 'message': f'At most {max_items} items per request.'}), 400
+    user_id = session['user_id']
+
+    def failed(status_code, message, errors):
+        results = [
+            {'index': i, 'status': 'error', 'message': errors[i]} if i in errors else {'index': i, 'status': 'skipped'}
+            for i in range(len(raw_items))
+        ]
+        return jsonify({'status': 'error', 'message': message, 'results': results}), status_code
+
+    # --- Validate everything before touching the database ---
+    items, errors = [], {}
+    claimed_seats = {}  # (type, service_id, seat) -> index of the item asking for it
+    for i, raw_item in enumerate(raw_items):
+        try:
+            item = validate_booking_item(raw_item)
+        except ValueError as e:
+            errors[i] = str(e)
+            continue
+        for seat in item['seats']:
+            other = claimed_seats.setdefault((item['type'], item['service_id'], seat), i)
+            if other != i:
+                errors[i] = f"Seat {seat} is also requested by item {other}"
+        items.append(item)
+    if errors:
+        return failed(400, 'Some items are invalid.', errors)
+
+    # Seats grouped per service so each service gets a single conditional update
+    seat_groups = {}
+    for i, item in enumerate(items):
+        if item['type'] in AVAILABILITY_SOURCES:
+            seat_groups.setdefault((item['type'], item['service_id']), []).append(i)
+    # Claimed in a fixed service order, so two batches sharing services lock them in the same order
+    seat_groups = dict(sorted(seat_groups.items()))
+
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            # --- Fetch every referenced service in one round trip ---
+            service_types = list(dict.fromkeys(item['type'] for item in items))
+            statements = []
+            for service_type in service_types:
+                ids = sorted({item['service_id'] for item in items if item['type'] == service_type})
+                statements.append((BATCH_SERVICE_QUERIES[service_type].format(','.join(['%s'] * len(ids))), ids))
+            services = {
+                (service_type, row['id']): row
+                for service_type, result in zip(service_types, execute_batch(cur, statements))
+                for row in result['rows']
+            }
+            missing = {i: f"{item['type']} {item['service_id']} not found." for i, item in enumerate(items)
+                       if (item['type'], item['service_id']) not in services}
+            if missing:
+                conn.rollback()
+                return failed(404, 'Some services were not found.', missing)
+
+            # --- Book seats and take them off the counters in one round trip ---
+            if seat_groups:
+                statements, spans = [], []
+                for (service_type, service_id), indexes in seat_groups.items():
+                    # Remember which results belong to this group's claim
+                    seats = [seat for i in indexes for seat in items[i]['seats']]
+                    quantity = sum(items[i]['quantity'] for i in indexes)
+                    claim = claim_statements(service_type, service_id, seats, quantity, user_id)
+                    spans.append((len(statements), len(statements) + len(claim)))
+                    statements.extend(claim)
+                for attempt in range(2):
+                    results = execute_batch(cur, statements)
+                    unavailable, missing_counters = {}, []
+                    for (start, end), ((service_type, service_id), indexes) in zip(spans, seat_groups.items()):
+                        seats = [seat for i in indexes for seat in items[i]['seats']]
+                        try:
+                            check_claim(cur, service_type, service_id, seats, user_id, results[start:end])
+                        except SeatUnavailableError as e:
+                            for i in indexes:
+                                lost = [seat for seat in items[i]['seats'] if seat in e.seats]
+                                if lost:
+                                    unavailable[i] = f"Seats unavailable: {', '.join(lost)}"
+                        except SoldOutError as e:
+                            for i in indexes:
+                                unavailable[i] = str(e)
+                        except MissingCounterError:
+                            if attempt:
+                                raise
+                            missing_counters.append((service_type, service_id))
+                    if unavailable or not missing_counters:
+                        break
+                    # Rare (services added outside the app): create them outside this transaction and claim again
+                    conn.rollback()
+                    for service_type, service_id in missing_counters:
+                        create_availability_counter(conn, service_type, service_id)
+                if unavailable:
+                    conn.rollback()
+                    return failed(409, 'Some seats are no longer available.', unavailable)
+
+            def succeeded(booking_id):
+                return {'status': 'success', 'results': [
+                    {'index': i, 'status': 'success', 'booking_id': booking_id(i), 'type': item['type'],
+                     'service_id': item['service_id'], 'total_price': float(price)}
+                    for i, (item, price) in enumerate(zip(items, prices))
+                ]}
+
+            # --- Insert all bookings with one multi-row INSERT ---
+            rows, prices = [], []
+            for item in items:
+                details, total_price = price_booking_item(item, services[(item['type'], item['service_id'])])
+                rows.append((user_id, item['type'], item['service_id'], json.dumps(details), total_price))
+                prices.append(total_price)
+            cur.executemany(
+                "INSERT INTO bookings (user_id, service_type, service_id, details, total_price) VALUES (%s, %s, %s, %s, %s)",
+                rows
+            )
+            # A multi-row insert with a known row count gets ids starting at lastrowid, spaced by
+            # auto_increment_increment (more than 1 on Galera and group replication primaries)
+            first_id = cur.lastrowid
+            results = execute_batch(cur, [
+                ("SELECT @@SESSION.auto_increment_increment AS step", []),
+                *idempotent_result_statements(succeeded(inserted_booking_id)),
+                ("COMMIT", []),
+            ])
+            id_step = results[0]['rows'][0]['step']
+    except (pymysql.MySQLError, ValueError) as e:
+        conn.rollback()
+        print(f"Error during batch booking creation: {e}")
+        return jsonify({'status': 'error', 'message': f'Failed to create bookings: {e}'}), 500
+    finally:
+        conn.close()
+
+    for service_type in service_types:
+        invalidate_search_results(service_type)
+    invalidate_dashboard(user_id)
+    mark_session_write()
+    for (service_type, service_id), indexes in seat_groups.items():
+        if service_type in SEAT_TABLES:
+            seats_changed(service_type, service_id, [seat for i in indexes for seat in items[i]['seats']])
+
+    return jsonify(succeeded(lambda i: first_id + i * id_step))
+
 # --- Placeholder Routes (for pages without backend logic yet) ---
 @app.route('/order')
+@cached_page
 def order(): return render_template('order.html')
 
 @app.route('/quiz')
+@cached_page
 def quiz(): return render_template('quiz.html')
 
 @app.route('/virtual_exhibition')
+@cached_page
 def virtual_exhibition(): return render_template('virtual_exhibition.html')
 
 @app.route('/wishlist')
+@cached_page
 def wishlist(): return render_template('wishlist.html')
 
 # --- API Routes for Client-Side Actions ---
@@ -546,20 +3656,688 @@ def cancel_booking():
     data = request.get_json()
     booking_id = data.get('booking_id')
     user_id = session['user_id']
+    deleted_rows_count = 0
+    freed_seats = []
     conn = get_db_connection()
     try:
         with conn.cursor() as cur:
-            # Ensure the booking belongs to the logged-in user before deleting for security
-            deleted_rows_count = cur.execute("DELETE FROM bookings WHERE id = %s AND user_id = %s", (booking_id, user_id))
-        conn.commit()
+            # Lock the booking, scoped to the logged-in user so nobody can cancel someone
+            # else's booking, then free its seats, delete it and commit in one round trip.
+            cur.execute(
+                "SELECT service_type, service_id, details FROM bookings WHERE id = %s AND user_id = %s FOR UPDATE",
+                (booking_id, user_id)
+            )
+            booking = cur.fetchone()
+            if booking is not None:
+                statements, freed_seats = cancellation_statements(booking, user_id)
+                results = execute_batch(cur, statements + [
+                    ("DELETE FROM bookings WHERE id = %s AND user_id = %s", [booking_id, user_id]),
+                    ("COMMIT", []),
+                ])
+                deleted_rows_count = results[len(statements)]['rowcount']
+    except pymysql.MySQLError as e:
+        conn.rollback()
+        print(f"Database error in cancel_booking: {e}")
+        return jsonify({'success': False, 'message': 'A database error occurred.'}), 500
     finally:
         conn.close()
     
     if deleted_rows_count > 0:
+        invalidate_search_results(booking['service_type'])
+        invalidate_dashboard(user_id)
+        mark_session_write()
+        if freed_seats:
+            seats_changed(booking['service_type'], booking['service_id'], freed_seats, booked=False)
         return jsonify({'success': True, 'message': 'Booking cancelled successfully.'})
         
     return jsonify({'success': False, 'message': 'Cancellation failed. Booking not found or permission denied.'}), 400
 
+@app.route('/api/suggest')
+def suggest():
+    """API endpoint returning ranked location completions for a search field."""
+    field = request.args.get('field')
+    query = request.args.get('q', '')
+    if field not in LOCATION_FIELDS:
+        return jsonify({'success': False, 'message': f"Unknown field. Use one of: {', '.join(LOCATION_FIELDS)}."}), 400
+    limit = min(max(request.args.get('limit', 10, type=int), 1), 50)
+    return jsonify({'field': field, 'query': query, 'suggestions': location_index.suggest(field, query, limit)})
+
+@app.route('/api/quote', methods=['GET', 'POST'])
+def quote():
+    """
+    API endpoint pricing services across fare classes and quantities in one batch.
+    Takes type, service_id (repeatable or comma-separated), and optionally class and
+    quantity (both repeatable) as query parameters or as a JSON body.
+    """
+    payload = request.get_json(silent=True) if request.method == 'POST' else None
+
+    def values(name):
+        if payload is None:
+            return request.args.getlist(name)
+        value = payload.get(name)
+        return value if isinstance(value, list) else [value]
+
+    service_type = (values('type') or [None])[0]
+    if service_type not in FARE_CLASSES:
+        return jsonify({'success': False, 'message': f"Unknown type. Use one of: {', '.join(FARE_CLASSES)}."}), 400
+    try:
+        service_ids = list(dict.fromkeys(
+            int(part) for value in values('service_id') if value is not None for part in str(value).split(',') if part.strip()
+        ))
+        quantities = [int(value) for value in values('quantity') if value is not None] or list(app.config['FARE_MATRIX_QUANTITIES'])
+    except ValueError:
+        return jsonify({'success': False, 'message': 'service_id and quantity must be integers.'}), 400
+    classes = [value for value in values('class') if value] or fare_engine.class_names(service_type)
+    unknown = [name for name in classes if name not in fare_engine.class_names(service_type)]
+    if unknown:
+        return jsonify({'success': False, 'message': f"Unknown fare class(es) for {service_type}: {', '.join(unknown)}"}), 400
+    if not service_ids or len(service_ids) > app.config['SEARCH_MAX_PAGE_SIZE']:
+        return jsonify({'success': False, 'message': f"Give between 1 and {app.config['SEARCH_MAX_PAGE_SIZE']} service IDs."}), 400
+    if any(not 1 <= quantity <= app.config['FARE_MAX_QUANTITY'] for quantity in quantities):
+        return jsonify({'success': False, 'message': f"Quantities must be between 1 and {app.config['FARE_MAX_QUANTITY']}."}), 400
+
+    conn = get_db_connection(read_only=True)
+    try:
+        with conn.cursor() as cur:
+            cur.execute(BATCH_SERVICE_QUERIES[service_type].format(','.join(['%s'] * len(service_ids))), service_ids)
+            rows = {row['id']: row for row in cur.fetchall()}
+    except pymysql.MySQLError as e:
+        print(f"Database error in quote: {e}")
+        return jsonify({'success': False, 'message': 'A database error occurred.'}), 500
+    finally:
+        conn.close()
+
+    found = [service_id for service_id in service_ids if service_id in rows]
+    base_prices = [rows[service_id][FARE_PRICE_COLUMNS[service_type]] for service_id in found]
+    totals = fare_engine.matrix(service_type, base_prices, quantities, classes)
+    return jsonify({
+        'success': True, 'type': service_type, 'classes': classes, 'quantities': quantities,
+        'quotes': [
+            {'service_id': service_id, 'base_price': float(base_price),
+             'prices': {name: [float(to_money(cents)) for cents in per_quantity] for name, per_quantity in zip(classes, per_class)}}
+            for service_id, base_price, per_class in zip(found, base_prices, totals)
+        ],
+        'missing': [service_id for service_id in service_ids if service_id not in rows],
+    })
+
+@app.route('/api/hold_seats', methods=['POST'])
+def hold_seats_api():
+    """API endpoint placing short-lived holds on bus or flight seats while the user checks out."""
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Unauthorized action.'}), 401
+
+    data = request.get_json()
+    seat_type = data.get('type')
+    service_id = data.get('service_id')
+    seat_numbers = parse_seat_list(data.get('seats'))
+    if seat_type not in SEAT_TABLES or not service_id or not seat_numbers:
+        return jsonify({'success': False, 'message': 'Missing seat type, service ID or seats.'}), 400
+
+    start_hold_sweeper()
+    ttl = app.config['SEAT_HOLD_TTL']
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            hold_seats(cur, seat_type, service_id, seat_numbers, session['user_id'], ttl)
+        conn.commit()
+    except SeatUnavailableError as e:
+        conn.rollback()
+        return jsonify({'success': False, 'message': str(e), 'unavailable': e.seats}), 409
+    except pymysql.MySQLError as e:
+        conn.rollback()
+        print(f"Database error in hold_seats: {e}")
+        return jsonify({'success': False, 'message': 'A database error occurred.'}), 500
+    finally:
+        conn.close()
+
+    return jsonify({'success': True, 'held': seat_numbers, 'expires_in': ttl})
+
+@app.route('/api/release_seats', methods=['POST'])
+def release_seats_api():
+    """API endpoint releasing the user's holds on seats they deselected."""
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Unauthorized action.'}), 401
+
+    data = request.get_json()
+    seat_type = data.get('type')
+    service_id = data.get('service_id')
+    seat_numbers = parse_seat_list(data.get('seats'))
+    if seat_type not in SEAT_TABLES or not service_id or not seat_numbers:
+        return jsonify({'success': False, 'message': 'Missing seat type, service ID or seats.'}), 400
+
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            release_seat_holds(cur, seat_type, service_id, seat_numbers, session['user_id'])
+        conn.commit()
+    except pymysql.MySQLError as e:
+        print(f"Database error in release_seats: {e}")
+        return jsonify({'success': False, 'message': 'A database error occurred.'}), 500
+    finally:
+        conn.close()
+
+    return jsonify({'success': True})
+
+@app.route('/api/seats/<seat_type>/<int:service_id>')
+def seat_availability(seat_type, service_id):
+    """
+    API endpoint returning a service's seat availability as a hex bitset
+    (bit i set = seat i booked). Send If-None-Match to get 304 while unchanged;
+    pass include_layout=1 once to also receive the static seat numbers.
+    """
+    if seat_type not in SEAT_TABLES:
+        return jsonify({'success': False, 'message': 'Seat type must be bus or flight.'}), 400
+    try:
+        seat_map = seat_maps.get(seat_type, service_id)
+    except pymysql.MySQLError as e:
+        print(f"Database error in seat_availability: {e}")
+        return jsonify({'success': False, 'message': 'A database error occurred.'}), 500
+    if seat_map is None:
+        return jsonify({'success': False, 'message': 'Seat map not found.'}), 404
+
+    etag = seat_map.etag
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        payload = {
+            'type': seat_type,
+            'service_id': service_id,
+            'version': seat_map.version,
+            'seat_count': len(seat_map.layout),
+            'booked': seat_map.bits.hex(),
+        }
+        if request.args.get('include_layout') == '1':
+            payload['layout'] = list(seat_map.layout)
+        response = jsonify(payload)
+    response.set_etag(etag)
+    # Clients may keep the body but must revalidate, which is a cheap 304 while nothing changed
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@app.route('/api/search')
+def unified_search():
+    """
+    API endpoint searching buses, trains, flights and destination hotels at once.
+    Sources are queried concurrently, so latency is that of the slowest source,
+    and a source that misses the deadline is reported as timed out rather than failing the search.
+    """
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Unauthorized action.'}), 401
+
+    origin = request.args.get('origin')
+    destination = request.args.get('destination')
+    travel_date = request.args.get('date')
+    sort = request.args.get('sort', 'price')
+    if not origin or not destination:
+        return jsonify({'success': False, 'message': 'Both origin and destination are required.'}), 400
+    if sort not in ('price', 'departure'):
+        return jsonify({'success': False, 'message': 'Sort must be price or departure.'}), 400
+
+    limit = get_page_size()
+    timeout = app.config['UNIFIED_SEARCH_TIMEOUT']
+    sources = build_unified_search_sources(origin, destination, travel_date, limit, int(timeout * 1000))
+    cache_key = ('unified',) + normalize_search_params(origin, destination, travel_date, limit)
+    read_only = not reads_pinned_to_primary()
+    futures = {
+        service_type: unified_search_executor.submit(fetch_search_source, service_type, query, params, cache_key, read_only)
+        for service_type, (query, params) in sources.items()
+    }
+
+    deadline = time.monotonic() + timeout
+    results, hotels, source_status = [], [], {}
+    for service_type, future in futures.items():
+        try:
+            rows = future.result(timeout=max(deadline - time.monotonic(), 0))
+        except FutureTimeoutError:
+            future.cancel()
+            source_status[service_type] = 'timeout'
+            continue
+        except pymysql.MySQLError as e:
+            print(f"Database error in unified_search ({service_type}): {e}")
+            source_status[service_type] = 'error'
+            continue
+        source_status[service_type] = 'ok'
+        if service_type == 'hotel':
+            hotels = [{key: format_json_value(value) for key, value in row.items()} for row in rows]
+        else:
+            results.extend(normalize_search_result(service_type, row) for row in rows)
+
+    if sort == 'price':
+        results.sort(key=lambda r: (r['price'], r['date'] or '', r['departure'] or ''))
+    else:
+        results.sort(key=lambda r: (r['date'] or '', r['departure'] or '', r['price']))
+
+    return jsonify({'success': True, 'results': results, 'hotels': hotels, 'sources': source_status})
+
+@app.route('/api/itineraries')
+def itineraries():
+    """
+    API endpoint planning multi-leg journeys across buses, trains and flights,
+    for routes with no direct service or to compare connections with it.
+    """
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Unauthorized action.'}), 401
+
+    origin = request.args.get('origin')
+    destination = request.args.get('destination')
+    sort = request.args.get('sort', 'cheapest')
+    if not origin or not destination:
+        return jsonify({'success': False, 'message': 'Both origin and destination are required.'}), 400
+    if sort not in ('cheapest', 'fastest'):
+        return jsonify({'success': False, 'message': 'Sort must be cheapest or fastest.'}), 400
+    try:
+        day = date.fromisoformat(request.args.get('date') or date.today().isoformat())
+        hours, minutes = (request.args.get('after') or '00:00').split(':')[:2]
+        depart_after = datetime.combine(day, datetime.min.time()) + timedelta(hours=int(hours), minutes=int(minutes))
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Use YYYY-MM-DD for date and HH:MM for after.'}), 400
+    k = min(max(request.args.get('k', 5, type=int), 1), 20)
+    max_legs = min(max(request.args.get('max_legs', 3, type=int), 1), app.config['ITINERARY_MAX_LEGS'])
+
+    results, complete = timetable.search(origin, destination, depart_after, k=k, objective=sort, max_legs=max_legs)
+    return jsonify({'success': True, 'itineraries': results, 'complete': complete})
+
+@app.route('/api/itinerary_stats')
+def itinerary_stats():
+    """API endpoint reporting the size of the in-memory timetable."""
+    return jsonify(timetable.stats())
+
+@app.route('/api/hashing_stats')
+def hashing_stats():
+    """API endpoint exposing password hashing timings and admission counters."""
+    return jsonify(password_hasher.stats())
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus-style metrics: request, statement, pool, cache and hashing instrumentation."""
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    lines.extend(render_stats_gauges('travelgo_db_pool', get_db_pool().stats()))
+    cache_stats = search_cache.stats()
+    lines.extend(render_stats_gauges('travelgo_search_cache', {'size': cache_stats['size']}))
+    for service_type, counters in sorted(cache_stats['services'].items()):
+        for key, value in counters.items():
+            lines.append(f'travelgo_search_cache_{key}{{service="{service_type}"}} {value}')
+    hashing = password_hasher.stats()
+    lines.extend(render_stats_gauges('travelgo_password_hash', hashing))
+    for op in ('hash', 'verify'):
+        for key, value in hashing[op].items():
+            lines.append(f'travelgo_password_hash_{key}{{op="{op}"}} {value}')
+    return app.response_class('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/db_pool_stats')
+def db_pool_stats():
+    """API endpoint exposing connection pool usage counters, plus replica health and routing."""
+    stats = get_db_pool().stats()
+    replica_set = get_replica_set()
+    if replica_set is not None:
+        stats['read_replicas'] = replica_set.stats()
+    return jsonify(stats)
+
+@app.route('/api/seats/<seat_type>/<int:service_id>/stream')
+def seat_stream(seat_type, service_id):
+    """
+    Server-sent event stream of seat changes for one bus or flight. Sends a
+    snapshot (or, on reconnect, the changes missed since Last-Event-ID), then
+    deltas as bookings and cancellations commit, with comment heartbeats.
+
+    A viewer waits on a condition variable rather than polling, which costs a
+    greenlet under gevent/eventlet workers. Elsewhere the stream is disabled
+    (see seat_streams_enabled) and pages poll /api/seats with an ETag instead;
+    when forced on, streams are capped per worker and end after
+    SEAT_STREAM_MAX_SECONDS so threads recycle.
+    """
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Unauthorized action.'}), 401
+    if not seat_streams_enabled():
+        return jsonify({'success': False, 'message': 'Live seat streams are disabled on this server. Poll the seat endpoint instead.'}), 404
+    if seat_type not in SEAT_TABLES:
+        return jsonify({'success': False, 'message': f"Unknown seat type. Use one of: {', '.join(SEAT_TABLES)}."}), 400
+
+    channel = seat_feed.subscribe(seat_type, service_id)
+    if channel is None:
+        return jsonify({'success': False, 'message': 'Too many live viewers. Please try again shortly.'}), 503, {'Retry-After': '5'}
+
+    try:
+        # Resume from the client's last event when this channel still has it
+        cursor = None
+        token, _, version = (request.headers.get('Last-Event-ID') or '').partition(':')
+        if token == channel.token and version.isdigit():
+            cursor = int(version)
+        with channel.condition:
+            current = channel.version
+        if cursor is None or cursor > current:
+            # Read the version before the map: changes in between are replayed as idempotent deltas
+            cursor = current
+            seat_map = seat_maps.get(seat_type, service_id)
+            if seat_map is None:
+                seat_feed.unsubscribe(channel)
+                return jsonify({'success': False, 'message': 'No seats found for this service.'}), 404
+            first = sse_event('snapshot', seat_snapshot(seat_map), f"{channel.token}:{cursor}")
+            etag = seat_map.etag
+        else:
+            first, etag = '', None
+    except pymysql.MySQLError as e:
+        seat_feed.unsubscribe(channel)
+        print(f"Database error in seat_stream: {e}")
+        return jsonify({'success': False, 'message': 'A database error occurred.'}), 500
+
+    heartbeat = app.config['SEAT_STREAM_HEARTBEAT']
+    deadline = time.monotonic() + app.config['SEAT_STREAM_MAX_SECONDS']
+    retry_ms = app.config['SEAT_STREAM_RETRY_MS']
+
+    def generate(cursor, etag):
+        yield f"retry: {retry_ms}\n\n" + first
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            events, version, reset = seat_feed.wait(channel, cursor, min(heartbeat, remaining))
+            if events or reset:
+                seat_map = None
+                if reset:
+                    seat_map = seat_maps.get(seat_type, service_id)
+                    if seat_map is None:
+                        return
+                    yield sse_event('snapshot', seat_snapshot(seat_map), f"{channel.token}:{version}")
+                else:
+                    yield sse_event('seats', seat_delta(events), f"{channel.token}:{version}")
+                    seat_map = seat_maps.peek(seat_type, service_id)
+                cursor = version
+                etag = seat_map.etag if seat_map is not None else etag
+                continue
+
+            # Idle: bookings made by other workers only reach this one through the
+            # seat map's periodic reload, so resend the map when it has drifted
+            try:
+                seat_map = seat_maps.get(seat_type, service_id)
+            except pymysql.MySQLError as e:
+                print(f"Database error in seat_stream: {e}")
+                seat_map = None
+            if seat_map is not None and seat_map.etag != etag:
+                etag = seat_map.etag
+                yield sse_event('snapshot', seat_snapshot(seat_map), f"{channel.token}:{cursor}")
+            else:
+                yield ": ping\n\n"
+
+    response = app.response_class(generate(cursor, etag), mimetype='text/event-stream')
+    # Not a `finally` in generate: a generator closed before it starts (HEAD requests, viewers
+    # gone before the first chunk) never runs it, but the server always closes the response
+    response.call_on_close(lambda: seat_feed.unsubscribe(channel))
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # Keep nginx from buffering the stream
+    return response
+
+@app.route('/api/search_cache_stats')
+def search_cache_stats():
+    """API endpoint exposing search, dashboard and idempotency cache counters, hotel catalog and live seat stream stats."""
+    stats = search_cache.stats()
+    stats['dashboard'] = dashboard_cache.stats()
+    stats['idempotency'] = idempotency_store.stats()
+    stats['seat_streams'] = seat_feed.stats()
+    stats['hotel_catalog'] = hotel_catalog.stats()
+    return jsonify(stats)
+
+# --- Inventory Import ---
+app.config['IMPORT_BATCH_SIZE'] = 5000  # Inventory rows per executemany batch and commit
+app.config['IMPORT_PROGRESS_EVERY'] = 50000  # Rows between progress lines
+
+# kind -> (table, {column: type}, required columns). Every row must carry its primary key `id`,
+# which is what makes re-running an import an upsert rather than a duplicate load.
+INVENTORY_SPECS = {
+    'bus': ('services', {
+        'id': 'int', 'name': 'str', 'bus_type': 'str', 'from_city': 'str', 'to_city': 'str', 'details': 'str',
+        'departure_time': 'time', 'price': 'decimal', 'travel_date': 'date',
+    }, ('id', 'name', 'from_city', 'to_city', 'price', 'travel_date')),
+    'train': ('trains', {
+        'id': 'int', 'name': 'str', 'origin': 'str', 'destination': 'str', 'departure': 'time', 'arrival': 'time',
+        'price': 'decimal', 'travel_date': 'date',
+    }, ('id', 'name', 'origin', 'destination', 'price', 'travel_date')),
+    'flight': ('flights', {
+        'id': 'int', 'airline': 'str', 'number': 'str', 'origin': 'str', 'destination': 'str', 'departure': 'time',
+        'arrival': 'time', 'price': 'decimal', 'departure_date': 'date',
+    }, ('id', 'airline', 'number', 'origin', 'destination', 'price', 'departure_date')),
+    'hotel': ('hotels', {
+        'id': 'int', 'name': 'str', 'location': 'str', 'price_per_night': 'decimal', 'availability': 'int',
+    }, ('id', 'name', 'location', 'price_per_night')),
+}
+
+_TIME_VALUE = re.compile(r'^(\d{1,2}):(\d{2})(?::(\d{2}))?$')
+_SEAT_LAYOUT_SEGMENT = re.compile(r'^(\d+)-(\d+):([A-Za-z]+)$')
+
+
+def expand_seat_layout(layout):
+    """Expands a layout such as '1-2:AB 3-20:ABCD' into seat numbers ('1A', '1B', '2A', ...). Raises ValueError."""
+    seats = []
+    for segment in re.split(r'[\s;|]+', layout.strip()):
+        match = _SEAT_LAYOUT_SEGMENT.match(segment)
+        if not match:
+            raise ValueError(f"bad seat layout segment {segment!r}, expected e.g. '1-10:ABCD'")
+        first, last, letters = int(match.group(1)), int(match.group(2)), match.group(3).upper()
+        if first < 1 or last < first:
+            raise ValueError(f"bad row range in seat layout segment {segment!r}")
+        seats.extend(f"{row}{letter}" for row in range(first, last + 1) for letter in letters)
+    return seats
+
+def parse_inventory_value(kind, value):
+    """Converts one raw CSV/JSONL value to its column type, returning None for blanks. Raises ValueError."""
+    if value is None or (isinstance(value, str) and not value.strip()):
+        return None
+    if kind == 'int':
+        return int(value)
+    if kind == 'decimal':
+        try:
+            parsed = Decimal(str(value))
+        except ArithmeticError:
+            raise ValueError(f"not a number: {value!r}")
+        if not parsed.is_finite() or parsed < 0:
+            raise ValueError(f"not a valid price: {value!r}")
+        return parsed
+    if kind == 'date':
+        return date.fromisoformat(str(value).strip()).isoformat()
+    if kind == 'time':
+        match = _TIME_VALUE.match(str(value).strip())
+        if match is None:
+            raise ValueError(f"not a time: {value!r}")
+        # Range-checked here, as MySQL would reject e.g. 12:99 mid-batch and abort the whole import
+        hours, minutes, seconds = (int(part or 0) for part in match.groups())
+        if hours > 23 or minutes > 59 or seconds > 59:
+            raise ValueError(f"not a time: {value!r}")
+        return f"{hours:02d}:{minutes:02d}:{seconds:02d}"
+    return str(value).strip()
+
+def validate_inventory_row(kind, raw):
+    """
+    Validates one input record and returns (row tuple in spec column order, seat numbers).
+    Seats come from a `seat_layout` or an explicit comma-separated `seats` field. Raises ValueError.
+    """
+    _, columns, required = INVENTORY_SPECS[kind]
+    row = []
+    for column, column_type in columns.items():
+        try:
+            value = parse_inventory_value(column_type, raw.get(column))
+        except ValueError as e:
+            raise ValueError(f"{column}: {e}")
+        if value is None and column in required:
+            raise ValueError(f"{column} is required")
+        row.append(value)
+    if row[0] < 1:
+        raise ValueError("id must be positive")
+
+    seats = []
+    if kind in SEAT_TABLES:
+        if raw.get('seat_layout'):
+            seats = expand_seat_layout(str(raw['seat_layout']))
+        elif raw.get('seats'):
+            seats = parse_seat_list(raw['seats'])
+        too_long = [seat for seat in seats if len(seat) > 10]
+        if too_long:
+            raise ValueError(f"seat numbers longer than 10 characters: {', '.join(too_long[:5])}")
+    return tuple(row), list(dict.fromkeys(seats))
+
+def read_inventory_records(path, file_format):
+    """
+    Yields (line number, record dict, error) from a CSV or JSONL file one record at a
+    time, so memory stays flat however large the file is. Unparseable lines come back
+    with a None record and the parse error.
+    """
+    with open(path, newline='', encoding='utf-8') as f:
+        if file_format == 'csv':
+            reader = csv.DictReader(f)
+            for record in reader:
+                yield reader.line_num, record, None
+        else:
+            for line_number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError as e:
+                    yield line_number, None, f"invalid JSON: {e}"
+                    continue
+                if isinstance(record, dict):
+                    yield line_number, record, None
+                else:
+                    yield line_number, None, "expected a JSON object"
+
+def has_unique_key(cur, table, columns):
+    """Whether `table` has a unique index on exactly `columns`, in any order."""
+    cur.execute(f"SHOW INDEX FROM {table}")
+    unique = {}
+    for row in cur.fetchall():
+        if not int(row['Non_unique']):
+            unique.setdefault(row['Key_name'], set()).add(row['Column_name'].lower())
+    return set(columns) in unique.values()
+
+def inventory_upsert_sql(kind):
+    """Builds the INSERT ... ON DUPLICATE KEY UPDATE that loads or refreshes rows of one inventory kind."""
+    table, columns, _ = INVENTORY_SPECS[kind]
+    updates = ', '.join(f"{column} = VALUES({column})" for column in columns if column != 'id')
+    return (f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))}) "
+            f"ON DUPLICATE KEY UPDATE {updates}")
+
+@app.cli.command('import-inventory')
+@click.argument('kind', type=click.Choice(sorted(INVENTORY_SPECS)))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'file_format', type=click.Choice(['csv', 'jsonl']),
+              help='Input format. Guessed from the file extension when omitted.')
+@click.option('--batch-size', type=int, default=None, help='Rows per executemany batch and commit.')
+@click.option('--max-errors', type=int, default=100, show_default=True,
+              help='Abort after this many invalid rows (0 never aborts).')
+@click.option('--dry-run', is_flag=True, help='Validate the file without writing anything.')
+def import_inventory(kind, path, file_format, batch_size, max_errors, dry_run):
+    """
+    Streams KIND inventory (bus, train, flight or hotel) from a CSV or JSONL file.
+
+    Rows are upserted on their `id`, so re-running an import is safe. Bus and flight
+    rows may carry a `seat_layout` such as '1-10:ABCD' (or a `seats` list); the seats
+    are added to bus_seats/flight_seats without touching ones already booked, which
+    needs a (service, seat_number) unique key on those tables; the import stops
+    before writing anything if it is missing.
+    """
+    file_format = file_format or ('jsonl' if path.lower().endswith(('.jsonl', '.ndjson', '.json')) else 'csv')
+    batch_size = batch_size or app.config['IMPORT_BATCH_SIZE']
+    progress_every = app.config['IMPORT_PROGRESS_EVERY']
+    upsert_sql = inventory_upsert_sql(kind)
+    seat_sql = None
+    if kind in SEAT_TABLES:
+        seat_table, fk_column = SEAT_TABLES[kind]
+        seat_sql = (f"INSERT INTO {seat_table} ({fk_column}, seat_number) VALUES (%s, %s) "
+                    "ON DUPLICATE KEY UPDATE seat_number = seat_number")
+
+    # Location columns this kind feeds into the location index, as (field, position in the row)
+    spec_columns = list(INVENTORY_SPECS[kind][1])
+    location_columns = [
+        (field, spec_columns.index(column))
+        for field, sources in LOCATION_FIELDS.items()
+        for source_table, columns in sources if source_table == INVENTORY_SPECS[kind][0]
+        for column in columns
+    ]
+
+    rows, seat_rows = [], []
+    imported = seats_imported = errors = 0
+    started = last_report = time.perf_counter()
+    conn = None if dry_run else get_db_connection()
+    if conn is not None and seat_sql is not None:
+        # Without the key every re-run would add each seat again and inflate the counters
+        try:
+            with conn.cursor() as cur:
+                keyed = has_unique_key(cur, seat_table, (fk_column, 'seat_number'))
+        except pymysql.MySQLError as e:
+            conn.close()
+            raise click.ClickException(f"Database error checking {seat_table}: {e}")
+        if not keyed:
+            conn.close()
+            raise click.ClickException(
+                f"{seat_table} has no unique key on ({fk_column}, seat_number), so seats cannot be upserted. "
+                f"Add one first: ALTER TABLE {seat_table} ADD UNIQUE KEY uq_{seat_table}_seat ({fk_column}, seat_number)"
+            )
+
+    def flush():
+        if rows and conn is not None:
+            with conn.cursor() as cur:
+                cur.executemany(upsert_sql, rows)
+                if seat_rows:
+                    cur.executemany(seat_sql, seat_rows)
+                if kind in AVAILABILITY_SOURCES:
+                    refresh_availability_counters(cur, kind, [row[0] for row in rows])
+            conn.commit()
+            # New and edited locations are searchable from this process straight away; workers
+            # find them through the LIKE fallback until their next full rebuild
+            for field, position in location_columns:
+                for row in rows:
+                    location_index.add(field, row[position])
+        rows.clear()
+        seat_rows.clear()
+
+    try:
+        for line_number, record, error in read_inventory_records(path, file_format):
+            if error is None:
+                try:
+                    row, seats = validate_inventory_row(kind, record)
+                except ValueError as e:
+                    error = str(e)
+            if error is not None:
+                errors += 1
+                click.echo(f"{path}:{line_number}: skipped, {error}", err=True)
+                if max_errors and errors >= max_errors:
+                    raise click.ClickException(f"Aborting after {errors} invalid rows.")
+                continue
+
+            rows.append(row)
+            seat_rows.extend((row[0], seat) for seat in seats)
+            imported += 1
+            seats_imported += len(seats)
+            # Big seat layouts flush early so a batch never holds more than ~10x batch_size seats
+            if len(rows) >= batch_size or len(seat_rows) >= batch_size * 10:
+                flush()
+            if imported % progress_every == 0:
+                now = time.perf_counter()
+                click.echo(f"  {imported} rows, {seats_imported} seats, "
+                           f"{imported / (now - started):.0f} rows/sec ({progress_every / (now - last_report):.0f} recent)")
+                last_report = now
+        flush()
+    except pymysql.MySQLError as e:
+        if conn is not None:
+            conn.rollback()
+        raise click.ClickException(f"Database error after {imported} rows: {e}")
+    finally:
+        if conn is not None:
+            conn.close()
+
+    elapsed = time.perf_counter() - started
+    action = 'Validated' if dry_run else 'Imported'
+    click.echo(f"{action} {imported} {kind} rows and {seats_imported} seats in {elapsed:.1f}s "
+               f"({imported / elapsed if elapsed else 0:.0f} rows/sec); {errors} invalid rows skipped.")
+    if not dry_run:
+        invalidate_search_results(kind)
+
+
 # --- Main entry point for the application ---
 if __name__ == '__main__':
+    # Warm the location index, timetable and hotel catalog so the first searches do not pay for loading them
+    location_index.ensure_fresh()
+    timetable.ensure_fresh()
+    hotel_catalog.ensure_fresh()
     app.run(debug=True)
@@ -0,0 +1,422 @@
+"""
+Load-test and benchmark suite for the TravelGo app.
+
+Seeds a scratch MySQL database (``travelgo_bench`` by default, on the server
+configured in app.py) with a realistic inventory, points get_db_connection()
+at it, and drives the real booking flows through Flask test clients from
+several threads: search, seat selection, holds, create_booking, dashboard and
+cancellation. Prints throughput and p50/p95/p99 latency per route and can
+compare the run against a saved baseline.
+
+This is not a self-contained stand-in: it needs the MySQL server configured in
+app.py (MYSQL_HOST/USER/PASSWORD) to be running, and an account there allowed to
+create and drop databases. Because --seed drops the database it is given, it
+only accepts names ending in ``_bench`` and never the app's own MYSQL_DB.
+
+Usage:
+    python benchmark.py --seed                      # (re)create and seed the scratch database
+    python benchmark.py --threads 8 --iterations 50 --save-baseline baseline.json
+    python benchmark.py --threads 8 --iterations 50 --baseline baseline.json
+"""
+import argparse
+import json
+import math
+import random
+import sys
+import threading
+import time
+from datetime import date, timedelta
+
+import pymysql
+from werkzeug.security import generate_password_hash
+
+from app import app
+
+CITIES = [
+    'New York', 'Los Angeles', 'Chicago', 'Houston', 'Phoenix', 'Philadelphia', 'San Antonio',
+    'San Diego', 'Dallas', 'San Jose', 'Austin', 'Jacksonville', 'Fort Worth', 'Columbus',
+    'Charlotte', 'San Francisco', 'Indianapolis', 'Seattle', 'Denver', 'Washington', 'Boston',
+    'El Paso', 'Nashville', 'Detroit', 'Oklahoma City', 'Portland', 'Las Vegas', 'Memphis',
+    'Louisville', 'Baltimore', 'Milwaukee', 'Albuquerque', 'Tucson', 'Fresno', 'Sacramento',
+    'Kansas City', 'Mesa', 'Atlanta', 'Omaha', 'Colorado Springs', 'Raleigh', 'Miami',
+    'Long Beach', 'Virginia Beach', 'Oakland', 'Minneapolis', 'Tulsa', 'Tampa', 'Arlington',
+    'New Orleans', 'Wichita', 'Cleveland', 'Bakersfield', 'Aurora', 'Anaheim', 'Honolulu',
+]
+AIRPORTS = [
+    'JFK', 'LAX', 'ORD', 'DFW', 'DEN', 'ATL', 'SFO', 'SEA', 'LAS', 'MCO', 'EWR', 'CLT', 'PHX',
+    'IAH', 'MIA', 'BOS', 'MSP', 'FLL', 'DTW', 'PHL', 'LGA', 'BWI', 'SLC', 'SAN', 'IAD', 'DCA',
+]
+AIRLINES = ['Delta', 'United', 'American', 'Southwest', 'JetBlue', 'Alaska']
+BUS_SEATS = [f"{row}{col}" for row in range(1, 11) for col in 'ABCD']     # 40 seats, 2+2 layout
+FLIGHT_SEATS = [f"{row}{col}" for row in range(1, 11) for col in 'ABCDEF']  # 60 seats, 3+3 layout
+BENCH_PASSWORD = 'bench-password'
+BENCH_DB_SUFFIX = '_bench'  # --seed drops its database, so it only touches names ending in this
+
+# Core tables the app expects; extension tables are created by the app itself
+CORE_SCHEMA = [
+    """CREATE TABLE users (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        name VARCHAR(100) NOT NULL,
+        email VARCHAR(255) NOT NULL UNIQUE,
+        password VARCHAR(255) NOT NULL
+    )""",
+    """CREATE TABLE services (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        name VARCHAR(100) NOT NULL,
+        bus_type VARCHAR(50),
+        from_city VARCHAR(100) NOT NULL,
+        to_city VARCHAR(100) NOT NULL,
+        details VARCHAR(255),
+        departure_time TIME,
+        price DECIMAL(10, 2) NOT NULL,
+        travel_date DATE NOT NULL,
+        KEY idx_services_date (travel_date, id),
+        KEY idx_services_route (from_city, to_city)
+    )""",
+    """CREATE TABLE bus_seats (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        service_id INT NOT NULL,
+        seat_number VARCHAR(10) NOT NULL,
+        is_booked TINYINT(1) NOT NULL DEFAULT 0,
+        user_id INT,
+        UNIQUE KEY uq_bus_seat (service_id, seat_number)
+    )""",
+    """CREATE TABLE trains (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        name VARCHAR(100) NOT NULL,
+        origin VARCHAR(100) NOT NULL,
+        destination VARCHAR(100) NOT NULL,
+        departure TIME,
+        arrival TIME,
+        price DECIMAL(10, 2) NOT NULL,
+        travel_date DATE NOT NULL,
+        KEY idx_trains_date (travel_date, id),
+        KEY idx_trains_route (origin, destination)
+    )""",
+    """CREATE TABLE flights (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        airline VARCHAR(100) NOT NULL,
+        number VARCHAR(20) NOT NULL,
+        origin VARCHAR(100) NOT NULL,
+        destination VARCHAR(100) NOT NULL,
+        departure TIME,
+        arrival TIME,
+        price DECIMAL(10, 2) NOT NULL,
+        departure_date DATE NOT NULL,
+        KEY idx_flights_date (departure_date, id),
+        KEY idx_flights_route (origin, destination)
+    )""",
+    """CREATE TABLE flight_seats (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        flight_id INT NOT NULL,
+        seat_number VARCHAR(10) NOT NULL,
+        is_booked TINYINT(1) NOT NULL DEFAULT 0,
+        user_id INT,
+        UNIQUE KEY uq_flight_seat (flight_id, seat_number)
+    )""",
+    """CREATE TABLE hotels (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        name VARCHAR(100) NOT NULL,
+        location VARCHAR(100) NOT NULL,
+        price_per_night DECIMAL(10, 2) NOT NULL,
+        availability INT NOT NULL DEFAULT 0,
+        KEY idx_hotels_location (location)
+    )""",
+    """CREATE TABLE bookings (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        user_id INT NOT NULL,
+        service_type VARCHAR(20) NOT NULL,
+        service_id INT NOT NULL,
+        details TEXT NOT NULL,
+        total_price DECIMAL(10, 2) NOT NULL,
+        booking_date DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        KEY idx_bookings_user_date (user_id, booking_date, id)
+    )""",
+]
+
+
+def insert_batches(cur, conn, sql, rows, batch_size=5000):
+    """Inserts rows with multi-row executemany batches, committing after each one."""
+    for start in range(0, len(rows), batch_size):
+        cur.executemany(sql, rows[start:start + batch_size])
+        conn.commit()
+
+
+def random_time(rng):
+    return f"{rng.randrange(24):02d}:{rng.choice((0, 15, 30, 45)):02d}:00"
+
+
+def check_scratch_database(db_name):
+    """Raises ValueError unless `db_name` is safe to drop: a *_bench name that is not the app's database."""
+    if db_name == app.config['MYSQL_DB']:
+        raise ValueError(f"refusing to seed {db_name!r}: it is the app's own database (MYSQL_DB)")
+    if not db_name.endswith(BENCH_DB_SUFFIX):
+        raise ValueError(f"refusing to seed {db_name!r}: scratch database names must end in {BENCH_DB_SUFFIX!r}")
+
+def seed_database(db_name, scale, bookings, rng):
+    """Drops and recreates the scratch database, then fills it with generated inventory."""
+    check_scratch_database(db_name)
+    conn = pymysql.connect(
+        host=app.config['MYSQL_HOST'], user=app.config['MYSQL_USER'],
+        password=app.config['MYSQL_PASSWORD'], autocommit=False
+    )
+    started = time.perf_counter()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"DROP DATABASE IF EXISTS `{db_name}`")
+            cur.execute(f"CREATE DATABASE `{db_name}`")
+            cur.execute(f"USE `{db_name}`")
+            for statement in CORE_SCHEMA:
+                cur.execute(statement)
+
+            today = date.today()
+            n_services, n_trains, n_flights, n_hotels, n_users = (
+                2000 * scale, 2000 * scale, 2000 * scale, 5000 * scale, 1000 * scale
+            )
+
+            def route():
+                origin, destination = rng.sample(CITIES, 2)
+                return origin, destination
+
+            def travel_day():
+                return today + timedelta(days=rng.randrange(30))
+
+            print(f"Seeding {n_users} users...")
+            password_hash = generate_password_hash(BENCH_PASSWORD, app.config['PASSWORD_HASH_METHOD'])
+            insert_batches(cur, conn, "INSERT INTO users (name, email, password) VALUES (%s, %s, %s)",
+                           [(f"Bench User {i}", f"bench{i}@example.com", password_hash) for i in range(1, n_users + 1)])
+
+            print(f"Seeding {n_services} bus services and {n_services * len(BUS_SEATS)} seats...")
+            rows = []
+            for i in range(1, n_services + 1):
+                origin, destination = route()
+                rows.append((f"Express {i}", rng.choice(('AC Sleeper', 'Non-AC Seater', 'Volvo')), origin, destination,
+                             'Wi-Fi, Charging Point', random_time(rng), rng.randrange(15, 120), travel_day()))
+            insert_batches(cur, conn, """INSERT INTO services (name, bus_type, from_city, to_city, details, departure_time, price, travel_date)
+                                         VALUES (%s, %s, %s, %s, %s, %s, %s, %s)""", rows)
+            insert_batches(cur, conn, "INSERT INTO bus_seats (service_id, seat_number, is_booked) VALUES (%s, %s, %s)",
+                           [(sid, seat, int(rng.random() < 0.2)) for sid in range(1, n_services + 1) for seat in BUS_SEATS])
+
+            print(f"Seeding {n_trains} trains...")
+            rows = []
+            for i in range(1, n_trains + 1):
+                origin, destination = route()
+                rows.append((f"Limited {i}", origin, destination, random_time(rng), random_time(rng),
+                             rng.randrange(30, 250), travel_day()))
+            insert_batches(cur, conn, """INSERT INTO trains (name, origin, destination, departure, arrival, price, travel_date)
+                                         VALUES (%s, %s, %s, %s, %s, %s, %s)""", rows)
+
+            print(f"Seeding {n_flights} flights and {n_flights * len(FLIGHT_SEATS)} seats...")
+            rows = []
+            for i in range(1, n_flights + 1):
+                origin, destination = rng.sample(AIRPORTS, 2)
+                rows.append((rng.choice(AIRLINES), f"TG{i:04d}", origin, destination, random_time(rng), random_time(rng),
+                             rng.randrange(80, 900), travel_day()))
+            insert_batches(cur, conn, """INSERT INTO flights (airline, number, origin, destination, departure, arrival, price, departure_date)
+                                         VALUES (%s, %s, %s, %s, %s, %s, %s, %s)""", rows)
+            insert_batches(cur, conn, "INSERT INTO flight_seats (flight_id, seat_number, is_booked) VALUES (%s, %s, %s)",
+                           [(fid, seat, int(rng.random() < 0.2)) for fid in range(1, n_flights + 1) for seat in FLIGHT_SEATS])
+
+            print(f"Seeding {n_hotels} hotels...")
+            insert_batches(cur, conn, "INSERT INTO hotels (name, location, price_per_night, availability) VALUES (%s, %s, %s, %s)",
+                           [(f"Hotel {i}", rng.choice(CITIES), rng.randrange(40, 600), rng.randrange(0, 80))
+                            for i in range(1, n_hotels + 1)])
+
+            print(f"Seeding {bookings} bookings...")
+            batch = []
+            for i in range(bookings):
+                details = json.dumps({"name": f"Express {rng.randrange(1, n_services + 1)}", "from": rng.choice(CITIES),
+                                      "to": rng.choice(CITIES), "seats": rng.choice(BUS_SEATS),
+                                      "date": travel_day().isoformat()})
+                batch.append((rng.randrange(1, n_users + 1), 'bus', rng.randrange(1, n_services + 1), details,
+                              rng.randrange(15, 120), f"{today - timedelta(days=rng.randrange(730))} {random_time(rng)}"))
+                if len(batch) == 10000:
+                    insert_batches(cur, conn, """INSERT INTO bookings (user_id, service_type, service_id, details, total_price, booking_date)
+                                                 VALUES (%s, %s, %s, %s, %s, %s)""", batch, batch_size=10000)
+                    batch = []
+            insert_batches(cur, conn, """INSERT INTO bookings (user_id, service_type, service_id, details, total_price, booking_date)
+                                         VALUES (%s, %s, %s, %s, %s, %s)""", batch)
+    finally:
+        conn.close()
+    print(f"Seeded {db_name} in {time.perf_counter() - started:.1f}s")
+    return {'services': n_services, 'trains': n_trains, 'flights': n_flights, 'hotels': n_hotels, 'users': n_users}
+
+
+class Recorder:
+    """Thread-safe collection of per-route latencies and status codes."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = {}  # route -> list of (latency_ms, status)
+
+    def timed(self, route, call):
+        started = time.perf_counter()
+        response = call()
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        # Drain streamed bodies so their cost is included
+        response.get_data()
+        with self._lock:
+            self.samples.setdefault(route, []).append((elapsed_ms, response.status_code))
+        return response
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(math.ceil(pct / 100 * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+def run_user(recorder, sizes, user_index, iterations, seed):
+    """Drives one virtual user through the search -> seat -> book -> dashboard -> cancel flow."""
+    rng = random.Random(seed)
+    client = app.test_client()
+    recorder.timed('POST /login', lambda: client.post('/login', json={
+        'email': f"bench{user_index}@example.com", 'password': BENCH_PASSWORD
+    }))
+    for _ in range(iterations):
+        origin, destination = rng.sample(CITIES, 2)
+        travel_date = (date.today() + timedelta(days=rng.randrange(30))).isoformat()
+        recorder.timed('GET /bus_search', lambda: client.get('/bus_search'))
+        recorder.timed('POST /train_search', lambda: client.post('/train_search', data={
+            'from_city': origin[:4], 'to_city': destination[:4], 'travel_date': travel_date
+        }))
+        recorder.timed('POST /flight_search', lambda: client.post('/flight_search', data={
+            'from_airport': rng.choice(AIRPORTS), 'to_airport': rng.choice(AIRPORTS)
+        }))
+        recorder.timed('GET /search_hotels', lambda: client.get('/search_hotels', query_string={'location': destination}))
+        recorder.timed('GET /api/suggest', lambda: client.get('/api/suggest', query_string={
+            'field': 'train_city', 'q': origin[:3]
+        }))
+
+        service_id = rng.randrange(1, sizes['services'] + 1)
+        recorder.timed('GET /select_seats', lambda: client.get(f'/select_seats/{service_id}', query_string={
+            'travel_date': travel_date
+        }))
+        seat = rng.choice(BUS_SEATS)
+        recorder.timed('POST /api/hold_seats', lambda: client.post('/api/hold_seats', json={
+            'type': 'bus', 'service_id': service_id, 'seats': seat
+        }))
+        response = recorder.timed('POST /create_booking', lambda: client.post('/create_booking', json={
+            'type': 'bus', 'service_id': service_id, 'seats': seat, 'date': travel_date
+        }))
+        booking_id = response.get_json().get('booking_id') if response.status_code == 200 else None
+
+        recorder.timed('GET /dashboard', lambda: client.get('/dashboard'))
+        if booking_id:
+            recorder.timed('POST /api/cancel_booking', lambda: client.post('/api/cancel_booking', json={
+                'booking_id': booking_id
+            }))
+
+
+def build_report(recorder, wall_seconds):
+    """Summarizes samples into throughput and latency percentiles per route."""
+    report = {}
+    for route, samples in sorted(recorder.samples.items()):
+        latencies = sorted(latency for latency, _ in samples)
+        report[route] = {
+            'count': len(samples),
+            'errors': sum(1 for _, status in samples if status >= 500),
+            'conflicts': sum(1 for _, status in samples if status == 409),
+            'throughput_rps': round(len(samples) / wall_seconds, 2),
+            'p50_ms': round(percentile(latencies, 50), 2),
+            'p95_ms': round(percentile(latencies, 95), 2),
+            'p99_ms': round(percentile(latencies, 99), 2),
+        }
+    return report
+
+
+def print_report(report):
+    header = f"{'route':28} {'count':>7} {'err':>5} {'409':>5} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}"
+    print(header)
+    print('-' * len(header))
+    for route, row in report.items():
+        print(f"{route:28} {row['count']:>7} {row['errors']:>5} {row['conflicts']:>5} {row['throughput_rps']:>9.2f} "
+              f"{row['p50_ms']:>9.2f} {row['p95_ms']:>9.2f} {row['p99_ms']:>9.2f}")
+
+
+def compare_to_baseline(report, baseline, tolerance):
+    """Returns a list of human-readable regressions beyond `tolerance` (a fraction) versus the baseline."""
+    regressions = []
+    for route, row in report.items():
+        base = baseline.get(route)
+        if not base:
+            continue
+        for metric in ('p50_ms', 'p95_ms', 'p99_ms'):
+            if base[metric] and row[metric] > base[metric] * (1 + tolerance):
+                regressions.append(f"{route}: {metric} {base[metric]:.2f} -> {row[metric]:.2f}")
+        if base['throughput_rps'] and row['throughput_rps'] < base['throughput_rps'] * (1 - tolerance):
+            regressions.append(f"{route}: throughput {base['throughput_rps']:.2f} -> {row['throughput_rps']:.2f} req/s")
+        if row['errors'] > base['errors']:
+            regressions.append(f"{route}: errors {base['errors']} -> {row['errors']}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default='travelgo_bench', help='Scratch database to seed and benchmark against')
+    parser.add_argument('--seed', action='store_true', help='Drop, recreate and seed the scratch database first')
+    parser.add_argument('--scale', type=int, default=1, help='Inventory multiplier (1 = 2000 services/trains/flights)')
+    parser.add_argument('--bookings', type=int, default=200000, help='Historical bookings to seed')
+    parser.add_argument('--threads', type=int, default=8, help='Concurrent virtual users')
+    parser.add_argument('--iterations', type=int, default=25, help='Flow iterations per virtual user')
+    parser.add_argument('--random-seed', type=int, default=42)
+    parser.add_argument('--output', help='Write the report as JSON to this path')
+    parser.add_argument('--save-baseline', help='Write the report as the new baseline to this path')
+    parser.add_argument('--baseline', help='Compare against a saved baseline and exit 1 on regressions')
+    parser.add_argument('--tolerance', type=float, default=0.15, help='Allowed regression as a fraction (default 0.15)')
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.random_seed)
+    if args.seed:
+        try:
+            check_scratch_database(args.db)
+        except ValueError as e:
+            parser.error(str(e))
+        sizes = seed_database(args.db, args.scale, args.bookings, rng)
+    else:
+        sizes = {'services': 2000 * args.scale, 'users': 1000 * args.scale}
+
+    app.config['MYSQL_DB'] = args.db
+    app.config['TESTING'] = True
+    app.config['MYSQL_POOL_SIZE'] = max(app.config['MYSQL_POOL_SIZE'], args.threads * 2)
+
+    recorder = Recorder()
+    threads = [
+        threading.Thread(target=run_user, args=(recorder, sizes, (i % sizes['users']) + 1, args.iterations,
+                                                args.random_seed + i))
+        for i in range(args.threads)
+    ]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall_seconds = time.perf_counter() - started
+
+    report = build_report(recorder, wall_seconds)
+    print(f"\n{args.threads} users x {args.iterations} iterations in {wall_seconds:.1f}s\n")
+    print_report(report)
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, 'w') as f:
+                json.dump(report, f, indent=2)
+            print(f"\nReport written to {path}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare_to_baseline(report, baseline, args.tolerance)
+        if regressions:
+            print(f"\nRegressions beyond {args.tolerance:.0%} versus {args.baseline}:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print(f"\nNo regressions beyond {args.tolerance:.0%} versus {args.baseline}.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,117 @@
+"""Checks HotelCatalog's bisected, merged and paged search against a plain filter over every hotel."""
+import random
+from decimal import Decimal
+
+import pytest
+
+import app as travelgo
+from app import HOTEL_NO_RATING, HOTEL_SORTS, HotelCatalog
+
+LOCATIONS = ['New York', 'Newark', 'New Delhi', 'Boston', 'Paris', 'Delhi'] + [f'City {n}' for n in range(40)]
+
+
+class FakeCursor:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def execute(self, query, params=None):
+        pass
+
+    def fetchone(self):
+        return {'Field': 'rating'}  # SHOW COLUMNS: the table has a rating column
+
+    def __iter__(self):
+        return iter(self.rows)
+
+
+class FakeConnection:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def cursor(self, cursor_class=None):
+        return FakeCursor(self.rows)
+
+    def close(self):
+        pass
+
+
+@pytest.fixture(scope='module')
+def hotels():
+    rng = random.Random(7)
+    return [
+        {'id': hotel_id, 'name': f'Hotel {hotel_id}', 'location': rng.choice(LOCATIONS), 'availability': 5,
+         'price_per_night': Decimal(rng.randrange(2000, 50000)) / 100,
+         'rating': None if rng.random() < 0.15 else Decimal(rng.randrange(10, 51)) / 10}
+        for hotel_id in range(1, 5001)
+    ]
+
+
+@pytest.fixture
+def catalog(hotels, monkeypatch):
+    monkeypatch.setattr(travelgo, 'get_db_connection', lambda read_only=False: FakeConnection(hotels))
+    catalog = HotelCatalog(refresh_interval=float('inf'))
+    catalog.ensure_fresh()
+    return catalog
+
+
+def expected(hotels, location, price_range, rating_range, sort):
+    """Filters and sorts every hotel the way the SQL fallback does: NULL ratings never match a rating range."""
+    column, descending = HOTEL_SORTS[sort]
+    matches = []
+    for hotel in hotels:
+        if location and location.lower() not in hotel['location'].lower():
+            continue
+        for field, (low, high) in (('price_per_night', price_range), ('rating', rating_range)):
+            value = hotel[field]
+            if (low is not None or high is not None) and value is None:
+                break
+            if (low is not None and value < low) or (high is not None and value > high):
+                break
+        else:
+            matches.append(hotel)
+    sort_key = lambda hotel: (HOTEL_NO_RATING if hotel[column] is None else hotel[column], hotel['id'])
+    return sorted(matches, key=sort_key, reverse=descending)
+
+
+def all_pages(catalog, location, price_range, rating_range, sort, page_size):
+    """Walks every page, resuming from the (sort value, id) cursor of the last hotel as the results page does."""
+    column = HOTEL_SORTS[sort][0]
+    found, after_value, after_id = [], None, None
+    while True:
+        page = catalog.search(location, price_range, rating_range, sort, after_value, after_id, page_size)
+        found.extend(page)
+        if len(page) < page_size:
+            return found
+        last = page[-1]
+        after_value = HOTEL_NO_RATING if last[column] is None else last[column]
+        after_id = last['id']
+
+
+@pytest.mark.parametrize('location, price_range, rating_range, sort', [
+    (None, (None, None), (None, None), 'price'),
+    (None, (None, None), (None, None), 'rating'),
+    ('new', (Decimal(100), Decimal(300)), (None, None), 'price'),
+    ('new', (None, None), (None, None), 'price_desc'),
+    ('delhi', (None, Decimal(250)), (Decimal(2), Decimal(4)), 'price_desc'),
+    ('city 1', (Decimal(50), None), (Decimal(3), None), 'price_desc'),
+    (None, (None, None), (None, Decimal(3)), 'rating'),
+    ('new', (None, None), (Decimal(0), Decimal(5)), 'rating'),
+    (None, (Decimal(100), None), (None, Decimal('2.5')), 'price'),
+    ('nowhere', (None, None), (None, None), 'price'),
+])
+@pytest.mark.parametrize('page_size', [7, 50])
+def test_search_matches_filter(catalog, hotels, location, price_range, rating_range, sort, page_size):
+    found = all_pages(catalog, location, price_range, rating_range, sort, page_size)
+    assert [hotel['id'] for hotel in found] == \
+        [hotel['id'] for hotel in expected(hotels, location, price_range, rating_range, sort)]
+
+
+def test_rating_range_skips_unrated_hotels(catalog):
+    found = all_pages(catalog, None, (None, None), (None, Decimal(5)), 'rating', 100)
+    assert found and all(hotel['rating'] is not None for hotel in found)
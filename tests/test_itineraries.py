@@ -0,0 +1,76 @@
+"""Checks the itinerary planner's connection scan against an exhaustive search."""
+import bisect
+import random
+import time
+from array import array
+from datetime import datetime
+
+import pytest
+
+from app import TIMETABLE_FIELDS, TIMETABLE_MODES, Timetable, app
+
+START = datetime(2026, 1, 1)
+START_MINUTE = START.toordinal() * 1440
+
+
+def make_timetable(legs, n_stops):
+    """Builds a loaded Timetable from (dep, arr, origin, dest, price, mode, service_id) legs."""
+    legs = sorted(legs)
+    snapshot = {'stops': [f"Stop {n}" for n in range(n_stops)]}
+    snapshot['stop_ids'] = {name.lower(): n for n, name in enumerate(snapshot['stops'])}
+    for position, field in enumerate(TIMETABLE_FIELDS):
+        snapshot[field] = array('q', (leg[position] for leg in legs))
+    snapshot['feeders'] = Timetable.index_feeders(snapshot['origin'], snapshot['dest'])
+    timetable = Timetable({}, refresh_interval=float('inf'))
+    timetable._snapshot = snapshot
+    timetable._loaded_at = time.monotonic()
+    return timetable
+
+
+def brute_force(snapshot, origin, destination, k, objective, max_legs):
+    """Every journey by depth-first search, ranked the way Timetable.search ranks them."""
+    transfer = [app.config['ITINERARY_MIN_TRANSFER'].get(name, 0) for name in TIMETABLE_MODES]
+    last = bisect.bisect_right(snapshot['dep'], START_MINUTE + app.config['ITINERARY_HORIZON_HOURS'] * 60)
+    journeys = []
+
+    def extend(stop, arrival, first, cost, legs, visited, previous):
+        for i in range(0 if previous is None else previous + 1, last):
+            if snapshot['origin'][i] != stop or snapshot['dest'][i] == stop or snapshot['dest'][i] in visited:
+                continue
+            ready = arrival if previous is None else arrival + transfer[snapshot['mode'][i]]
+            if snapshot['dep'][i] < ready:
+                continue
+            departs = snapshot['dep'][i] if first is None else first
+            total, arrives = cost + snapshot['price'][i], snapshot['arr'][i]
+            if snapshot['dest'][i] == destination:
+                duration = arrives - departs
+                journeys.append((total, arrives, duration) if objective == 'cheapest' else (duration, total, arrives))
+            elif legs + 1 < max_legs:
+                extend(snapshot['dest'][i], arrives, departs, total, legs + 1, visited | {snapshot['dest'][i]}, i)
+
+    extend(origin, START_MINUTE, None, 0, 0, frozenset({origin}), None)
+    journeys.sort()
+    if objective == 'cheapest':
+        return [(total, duration) for total, _, duration in journeys[:k]]
+    return [(total, duration) for duration, total, _ in journeys[:k]]
+
+
+@pytest.mark.parametrize('seed', range(200))
+def test_search_matches_brute_force(seed):
+    rng = random.Random(seed)
+    n_stops = 6
+    legs = []
+    for service_id in range(180):
+        dep = START_MINUTE + rng.randrange(2 * 1440)
+        legs.append((dep, dep + rng.randrange(30, 600), rng.randrange(n_stops), rng.randrange(n_stops),
+                     rng.randrange(1, 60) * 100, rng.randrange(len(TIMETABLE_MODES)), service_id))
+    timetable = make_timetable(legs, n_stops)
+    origin, destination = rng.sample(range(n_stops), 2)
+    k, max_legs, objective = rng.randint(1, 8), rng.randint(1, 4), rng.choice(['cheapest', 'fastest'])
+
+    found, complete = timetable.search(f"Stop {origin}", f"Stop {destination}", START, k=k,
+                                       objective=objective, max_legs=max_legs)
+
+    assert complete
+    assert [(round(it['total_price'] * 100), it['duration_minutes']) for it in found] == \
+        brute_force(timetable._snapshot, origin, destination, k, objective, max_legs)